@@ -0,0 +1,279 @@
+import os
+import sys, getopt
+import gc
+import json
+import time
+import shutil
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+import synthetic
+
+sys.path.insert(0, synthetic.PACKAGE_FOLDER)
+from emodule import instrument
+
+
+#Benchmarks of the pipeline stages on synthetic datasets. Every (stage, size) runs in a fresh
+#forked process: its inputs are prepared first (not timed), then the stage is timed. The process
+#reports wall time, CPU time, resident memory before the stage and peak resident memory, and the
+#throughput in items per second. Results are written as JSON.
+STAGES = ['extract_exp',
+          'read_enhancerExp',
+          'normalize_exp',
+          'diff_exp',
+          'obtain_near_gene',
+          'obtain_near_gene_cached',
+          'identify_targets']
+
+
+#Every stage takes the dataset files and a folder for its outputs, prepares its inputs, and returns
+#the function to time and the number of items it processes with their unit.
+
+def stage_extract_exp(files, outFolder):
+    from emodule import calculateExp
+    enhancers = calculateExp.read_enhancer(files['annoFile'])
+    bwfiles = calculateExp.read_bwfiles(files['bwFolder'])
+
+    def run():
+        for i, bwfile in enumerate(bwfiles):
+            calculateExp.extract_exp(bwfile, enhancers, os.path.join(outFolder, 'exp_%d' % i))
+    return run, len(enhancers) * len(bwfiles), 'enhancer x sample'
+
+
+def stage_read_enhancerExp(files, outFolder):
+    from emodule import eNormalization
+    enhancer_index, lengths = eNormalization.read_enhancer(files['annoFile'])
+    tissue_samples, all_samples = eNormalization.read_sample(files['sampleFile'])
+
+    def run():
+        sample_counts = eNormalization.read_enhancerExp(enhancer_index, lengths, all_samples, files['expFolder'])
+        eNormalization.counts_dataframe(enhancer_index, sample_counts)
+    return run, len(enhancer_index) * len(all_samples), 'enhancer x sample'
+
+
+def stage_normalize_exp(files, outFolder):
+    from emodule import eNormalization
+    enhancer_index, lengths = eNormalization.read_enhancer(files['annoFile'])
+    tissue_samples, all_samples = eNormalization.read_sample(files['sampleFile'])
+    sample_counts = eNormalization.read_enhancerExp(enhancer_index, lengths, all_samples, files['expFolder'])
+    counts_df = eNormalization.counts_dataframe(enhancer_index, sample_counts)
+    del sample_counts
+
+    def run():
+        eNormalization.normalize_exp(counts_df, tissue_samples, outFolder + os.sep, 'python')
+    return run, counts_df.size, 'enhancer x sample'
+
+
+def stage_diff_exp(files, outFolder):
+    from emodule import diffExp
+
+    def run():
+        diffExp.diff_exp(files['expFile'], files['attributeFile'], synthetic.TISSUE,
+                         os.path.join(outFolder, 'sexBiasedEnhancer'), engine='irls')
+    with open(files['expFile']) as f:
+        n_enhancers = sum(1 for line in f) - 1
+    return run, n_enhancers, 'enhancer'
+
+
+def annotation_loci(annoFile):
+    loci = []
+    with open(annoFile) as f:
+        for line in f:
+            loci.append('%s:%s-%s' % tuple(line.strip().split('\t')))
+    return loci
+
+
+def stage_obtain_near_gene(files, outFolder, cached=False):
+    from emodule import identifyModule
+    from emodule import geneIndex
+    enhancers = annotation_loci(files['annoFile'])
+    cacheFile = os.path.join(outFolder, 'genes.npz')
+    if cached:
+        geneIndex.build_gene_cache(files['gtfFile'], cacheFile)
+    elif os.path.exists(cacheFile):
+        os.remove(cacheFile)
+
+    def run():
+        identifyModule.obtain_near_gene(enhancers, files['gtfFile'], 1000000, cacheFile)
+    return run, len(enhancers), 'enhancer'
+
+
+def stage_obtain_near_gene_cached(files, outFolder):
+    return stage_obtain_near_gene(files, outFolder, cached=True)
+
+
+def stage_identify_targets(files, outFolder):
+    from emodule import identifyModule
+    merged_exp_df = identifyModule.merge_exp(identifyModule.read_enhancer_exp(files['expFile']),
+                                             identifyModule.read_gene_exp(files['gExpFile']))
+    enhancers = identifyModule.read_enhancer(files['eFile'])
+    near_genes = identifyModule.obtain_near_gene(enhancers, files['gtfFile'], 1000000,
+                                                 os.path.join(outFolder, 'genes.npz'))
+    eTFBS = identifyModule.read_eTFBS(files['eTFBS_file'], 400, enhancers)
+    gTFBS = identifyModule.read_gTFBS(files['gTFBS_file'], 400, set().union(*near_genes.values()))
+
+    def run():
+        identifyModule.identify_targets(enhancers, near_genes, merged_exp_df, eTFBS, gTFBS, 0.3, 0.05,
+                                        os.path.join(outFolder, 'module'))
+    return run, len(enhancers), 'enhancer'
+
+
+#prepare and time one stage, in the current process
+def measure_stage(stage, files, outFolder):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        run, items, unit = globals()['stage_' + stage](files, outFolder)
+        #the libraries that the stages import lazily are loaded before the timer starts
+        import scipy.stats, patsy, pyBigWig
+        gc.collect()
+        rss_before = instrument.current_rss()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        run()
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - wall
+    return {'wall_s': round(wall, 4),
+            'cpu_s': round(cpu, 4),
+            'rss_before_mb': None if rss_before is None else round(rss_before, 1),
+            'peak_rss_mb': round(instrument.peak_rss(), 1),
+            'items': int(items),
+            'unit': unit,
+            'items_per_s': round(items / wall, 1) if wall > 0 else None}
+
+
+def _stage_process(connection, stage, files, outFolder):
+    try:
+        connection.send(measure_stage(stage, files, outFolder))
+    except Exception as error:
+        connection.send({'error': '%s: %s' % (type(error).__name__, error)})
+    connection.close()
+
+
+#run one stage in a fresh process, so that its peak memory is its own
+def run_stage(stage, files, outFolder):
+    if not os.path.exists(outFolder):
+        os.makedirs(outFolder)
+    context = multiprocessing.get_context('fork') if hasattr(os, 'fork') else multiprocessing.get_context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_stage_process, args=(sender, stage, files, outFolder))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': 'process exited with code %s' % process.exitcode}
+    process.join()
+    return result
+
+
+#dataset of one size, generated once and reused from the work folder
+def dataset(workFolder, n_enhancers, n_samples, n_bigwigs, seed):
+    folder = os.path.join(workFolder, 'data_%dx%d_%d_%d' % (n_enhancers, n_samples, n_bigwigs, seed))
+    filesJson = os.path.join(folder, 'files.json')
+    if os.path.exists(filesJson):
+        with open(filesJson) as f:
+            return json.load(f), 0.0
+    start = time.perf_counter()
+    files = synthetic.make_dataset(folder, n_enhancers, n_samples, n_bigwigs=n_bigwigs, seed=seed)
+    with open(filesJson, 'w') as f:
+        json.dump(files, f)
+    return files, time.perf_counter() - start
+
+
+def run_benchmarks(sizes, stages, workFolder, n_bigwigs=4, repeat=1, seed=1):
+    import pandas, scipy, statsmodels
+    report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'cpus': multiprocessing.cpu_count(),
+                       'numpy': np.__version__,
+                       'pandas': pandas.__version__,
+                       'scipy': scipy.__version__,
+                       'statsmodels': statsmodels.__version__,
+                       'bigwigs': n_bigwigs,
+                       'seed': seed},
+              'results': []}
+    for n_enhancers, n_samples in sizes:
+        files, generate_s = dataset(workFolder, n_enhancers, n_samples, min(n_bigwigs, n_samples), seed)
+        print('dataset %dx%d generated in %.1f s' % (n_enhancers, n_samples, generate_s), file=sys.stderr)
+        for stage in stages:
+            for run in range(repeat):
+                outFolder = os.path.join(workFolder, 'out_%dx%d' % (n_enhancers, n_samples), stage)
+                result = {'stage': stage, 'enhancers': n_enhancers, 'samples': n_samples, 'run': run}
+                result.update(run_stage(stage, files, outFolder))
+                report['results'].append(result)
+                if 'error' in result:
+                    print('%s %dx%d failed: %s' % (stage, n_enhancers, n_samples, result['error']), file=sys.stderr)
+                else:
+                    print('%s %dx%d: %.3f s, peak %.0f MB' % (stage, n_enhancers, n_samples,
+                                                                result['wall_s'], result['peak_rss_mb']), file=sys.stderr)
+    return report
+
+
+def usage():
+    print("""Parameters:
+        --sizes          comma-separated dataset sizes as <enhancers>x<samples> (default: 2000x40,10000x100).
+        --stages         comma-separated stages to run (default: all): %s.
+        --bigwigs        number of bigwig files quantified by extract_exp (default: 4).
+        --repeat         number of runs of every stage and size (default: 1).
+        --seed           random seed of the synthetic data (default: 1).
+        --workFolder     folder for the datasets and outputs, reused across runs (default: a temporary folder, removed).
+        --outFile        JSON report (default: standard output).
+        """ % ', '.join(STAGES))
+    print()
+    print('Example: python benchmarks/run_benchmarks.py  --sizes 2000x40,20000x100,94070x200 --outFile bench.json')
+
+
+if __name__ == '__main__':
+    param = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(param, '-h', ['sizes=', 'stages=', 'bigwigs=', 'repeat=', 'seed=', 'workFolder=', 'outFile='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    sizes = [(2000, 40), (10000, 100)]
+    stages = STAGES
+    n_bigwigs = 4
+    repeat = 1
+    seed = 1
+    workFolder = None
+    outFile = None
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit(2)
+        elif opt == '--sizes':
+            sizes = [tuple(int(n) for n in size.split('x')) for size in arg.split(',')]
+        elif opt == '--stages':
+            stages = arg.split(',')
+            if any(stage not in STAGES for stage in stages):
+                usage()
+                sys.exit(2)
+        elif opt == '--bigwigs':
+            n_bigwigs = int(arg)
+        elif opt == '--repeat':
+            repeat = int(arg)
+        elif opt == '--seed':
+            seed = int(arg)
+        elif opt == '--workFolder':
+            workFolder = str(arg)
+        elif opt == '--outFile':
+            outFile = str(arg)
+
+    removeWork = workFolder is None
+    if removeWork:
+        workFolder = tempfile.mkdtemp(prefix='emodule_bench_')
+    try:
+        report = run_benchmarks(sizes, stages, workFolder, n_bigwigs, repeat, seed)
+    finally:
+        if removeWork:
+            shutil.rmtree(workFolder, ignore_errors=True)
+
+    if outFile:
+        with open(outFile, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
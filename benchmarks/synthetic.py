@@ -0,0 +1,284 @@
+import os
+import sys, getopt
+import numpy as np
+import pandas as pd
+
+
+#Synthetic inputs of the four pipeline stages at a configurable scale. Enhancers are real loci of
+#Ensembl_Fantom5_enhancers_nonOverlapGene, taken evenly across the file; everything else is drawn
+#from a seeded random generator:
+#  anno                enhancer annotation (subset of the real one)
+#  bw/                 per-base coverage bigwig files, one per sample (Recount3 file names)
+#  exp/<tissue>/       per-base average files of every sample, the input of eNormalization.py --expFolder
+#  samples             tissue and sample file of eNormalization.py
+#  <tissue>_RPM.csv    enhancer RPM matrix, the input of diffExp.py
+#  <tissue>_sample.csv sample attributes with Sex, Age, RIN, PMI, PC1-3 and InferredCov1-15
+#  <tissue>_geneExp.csv gene (and TF) expression matrix
+#  eTFBS, gTFBS        TFBS tables of enhancers and genes
+#  genes.gtf           mini GTF with protein-coding genes near the enhancers
+#  eList               enhancers to analyze with identifyModule.py
+PACKAGE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANNOTATION = os.path.join(PACKAGE_FOLDER, 'Ensembl_Fantom5_enhancers_nonOverlapGene')
+TISSUE = 'Spleen'
+COVERAGE_STEP = 50
+
+
+#n enhancers of the real annotation as (chrom, start, end), evenly spaced over the file
+def sample_enhancers(n, annoFile=ANNOTATION):
+    loci = []
+    with open(annoFile) as f:
+        for line in f:
+            chrom, start, end = line.strip().split('\t')
+            loci.append((chrom, int(start), int(end)))
+    if n > len(loci):
+        raise ValueError('%s has only %d enhancers' % (annoFile, len(loci)))
+    return [loci[i] for i in np.linspace(0, len(loci) - 1, n).astype(int)]
+
+
+def write_annotation(enhancers, annoFile):
+    with open(annoFile, 'w') as f:
+        for chrom, start, end in enhancers:
+            f.write('%s\t%d\t%d\n' % (chrom, start, end))
+
+
+def locus(enhancer):
+    return '%s:%d-%d' % enhancer
+
+
+#GTEx-like sample IDs, which eNormalization.py parses from the file names
+def sample_ids(n):
+    return ['GTEX-B%04d-0126-SM-B%04d' % (i, i) for i in range(n)]
+
+
+#sample attributes (attribute x sample, as downloaded from Recount3), about one third female
+def sample_attributes(samples, rng):
+    n = len(samples)
+    attributes = {'Sex': np.where(rng.random(n) < 0.35, 2, 1),
+                  'Age': rng.integers(25, 70, n),
+                  'RIN': np.round(rng.normal(6.9, 0.8, n), 1),
+                  'PMI': rng.integers(30, 1200, n)}
+    for i in range(1, 4):
+        attributes['PC%d' % i] = np.round(rng.normal(0, 0.04, n), 4)
+    #up to 15 inferred covariates, fewer for small cohorts so that the GLM stays identifiable
+    for i in range(1, min(15, max(1, n // 2 - 7)) + 1):
+        attributes['InferredCov%d' % i] = rng.normal(0, 0.05, n)
+    return pd.DataFrame(attributes, index=samples).T
+
+
+#read counts (enhancer x sample): gamma-Poisson around a per-enhancer mean, with a per-sample
+#library factor and a sex effect on a tenth of the enhancers
+def read_counts(enhancers, sex, rng, sex_biased=0.1):
+    n = len(enhancers)
+    lengths = np.array([end - start + 1 for chrom, start, end in enhancers])
+    means = rng.gamma(0.6, 4.0, n) * lengths / 10
+    library = rng.lognormal(0, 0.2, len(sex))
+    effects = np.where(rng.random(n) < sex_biased, rng.normal(0, 1.5, n), 0)
+    mu = means[:, None] * library[None, :] * np.exp(effects[:, None] * (sex[None, :] == 2))
+    return rng.poisson(rng.gamma(2.0, mu / 2.0)), lengths
+
+
+#per-base averages with two decimals, as calculateExp.py writes them
+def average_exp(counts, lengths):
+    return np.round(counts / lengths[:, None], 2)
+
+
+def write_average_files(enhancers, samples, averages, expFolder, tissue=TISSUE):
+    folder = os.path.join(expFolder, tissue)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    loci = [locus(enhancer) for enhancer in enhancers]
+    for i, sample in enumerate(samples):
+        fileName = 'gtex.base_sums.%s_%s.1.ALL.bw' % (tissue.upper(), sample)
+        with open(os.path.join(folder, fileName), 'w') as f:
+            for enhancer, average in zip(loci, averages[:, i].tolist()):
+                f.write('%s\t%s\n' % (enhancer, average))
+
+
+#bigwig of one sample: steps of COVERAGE_STEP bases over every enhancer, whose values average to
+#the enhancer's per-base average
+def write_bigwig(enhancers, averages, bwFile, rng):
+    import pyBigWig
+    chrom_sizes = {}
+    for chrom, start, end in enhancers:
+        chrom_sizes[chrom] = max(chrom_sizes.get(chrom, 0), end + 1000000)
+    chroms = sorted(chrom_sizes)
+    bw = pyBigWig.open(bwFile, 'w')
+    bw.addHeader([(chrom, chrom_sizes[chrom]) for chrom in chroms])
+    order = sorted(range(len(enhancers)), key=lambda i: (chroms.index(enhancers[i][0]), enhancers[i][1]))
+    for chrom in chroms:
+        starts = []
+        ends = []
+        values = []
+        last_end = 0
+        for i in order:
+            enhancer_chrom, start, end = enhancers[i]
+            if enhancer_chrom != chrom or averages[i] <= 0:
+                continue
+            start = max(start, last_end)
+            if start >= end:
+                continue
+            step_starts = np.arange(start, end, COVERAGE_STEP)
+            step_ends = np.minimum(step_starts + COVERAGE_STEP, end)
+            weights = rng.gamma(4.0, 0.25, len(step_starts))
+            weights *= (end - start) / (weights * (step_ends - step_starts)).sum()
+            starts.extend(step_starts.tolist())
+            ends.extend(step_ends.tolist())
+            values.extend((weights * averages[i]).tolist())
+            last_end = end
+        if starts:
+            bw.addEntries([chrom] * len(starts), starts, ends=ends, values=values)
+    bw.close()
+
+
+#RPM of every sample, as eNormalization.py writes them
+def rpm_matrix(counts):
+    return np.round(counts / counts.sum(axis=0, keepdims=True) * 1000000).astype(int)
+
+
+#expression of TFs and genes, driven by shared factors so that some of them correlate with enhancers
+def gene_expression(n_genes, n_samples, factors, rng):
+    weights = rng.normal(size=(n_genes, factors.shape[0])) * (rng.random((n_genes, factors.shape[0])) < 0.3)
+    return np.round(np.exp(2 + weights @ factors * 0.5 + 0.5 * rng.normal(size=(n_genes, n_samples))) * 10).astype(int)
+
+
+#TFBS table: header, then key, TF (dimers as TF1::TF2, in mixed case) and score
+def write_tfbs(keys, tfs, tfbsFile, rng, mean_sites=5, header='enhancer\tTF\tscore'):
+    with open(tfbsFile, 'w') as f:
+        f.write(header + '\n')
+        for key in keys:
+            for k in range(rng.poisson(mean_sites)):
+                names = [tfs[j] for j in rng.choice(len(tfs), rng.integers(1, 3), replace=False)]
+                names = [name if rng.random() < 0.5 else name.lower() for name in names]
+                f.write('%s\t%s\t%d\n' % (key, '::'.join(names), rng.integers(300, 900)))
+
+
+#mini GTF: every gene within 1.5 Mb of a random enhancer, with a transcript line, and some non-coding genes
+def write_gtf(enhancers, genes, gtfFile, rng, noncoding=0.1):
+    with open(gtfFile, 'w') as f:
+        f.write('#!genome-build GRCh38.p13\n')
+        symbols = genes + ['LNC%d' % i for i in range(int(len(genes) * noncoding))]
+        for i, symbol in enumerate(symbols):
+            chrom, start, end = enhancers[rng.integers(len(enhancers))]
+            gene_start = max(1, start + int(rng.integers(-1500000, 1500000)))
+            biotype = 'lncRNA' if symbol.startswith('LNC') else 'protein_coding'
+            strand = '+' if rng.random() < 0.5 else '-'
+            attributes = 'gene_id "ENSG%011d"; gene_version "1"; gene_name "%s"; gene_source "ensembl_havana"; gene_biotype "%s";' % (i, symbol, biotype)
+            for feature, extra in (('gene', ''), ('transcript', ' transcript_id "ENST%011d";' % i)):
+                f.write('\t'.join([chrom[3:] if chrom.startswith('chr') else chrom,
+                                   'ensembl_havana', feature, str(gene_start), str(gene_start + 20000),
+                                   '.', strand, '.', attributes + extra]) + '\n')
+
+
+#write a full synthetic dataset; returns the paths of its files
+def make_dataset(outFolder, n_enhancers, n_samples, n_genes=None, n_tfs=100, n_bigwigs=None, seed=1):
+    rng = np.random.default_rng(seed)
+    if not os.path.exists(outFolder):
+        os.makedirs(outFolder)
+    if n_genes is None:
+        n_genes = max(200, n_enhancers // 10)
+    if n_bigwigs is None:
+        n_bigwigs = n_samples
+    files = dict((name, os.path.join(outFolder, fileName)) for name, fileName in
+                 [('annoFile', 'anno'),
+                  ('bwFolder', 'bw'),
+                  ('expFolder', 'exp' + os.sep),
+                  ('sampleFile', 'samples'),
+                  ('expFile', '%s_RPM.csv' % TISSUE),
+                  ('attributeFile', '%s_sample.csv' % TISSUE),
+                  ('gExpFile', '%s_geneExp.csv' % TISSUE),
+                  ('eTFBS_file', 'eTFBS'),
+                  ('gTFBS_file', 'gTFBS'),
+                  ('gtfFile', 'genes.gtf'),
+                  ('eFile', 'eList')])
+
+    enhancers = sample_enhancers(n_enhancers)
+    loci = [locus(enhancer) for enhancer in enhancers]
+    write_annotation(enhancers, files['annoFile'])
+    samples = sample_ids(n_samples)
+    attributes = sample_attributes(samples, rng)
+    attributes.to_csv(files['attributeFile'])
+    with open(files['sampleFile'], 'w') as f:
+        f.write('tissue\tsample\tnote\n')
+        for sample in samples:
+            f.write('%s\t%s\t\n' % (TISSUE, sample))
+
+    counts, lengths = read_counts(enhancers, attributes.loc['Sex'].values, rng)
+    averages = average_exp(counts, lengths)
+    write_average_files(enhancers, samples, averages, files['expFolder'])
+    if not os.path.exists(files['bwFolder']):
+        os.makedirs(files['bwFolder'])
+    for i, sample in enumerate(samples[:n_bigwigs]):
+        bwFile = os.path.join(files['bwFolder'], 'gtex.base_sums.%s_%s.1.ALL.bw' % (TISSUE.upper(), sample))
+        write_bigwig(enhancers, averages[:, i], bwFile, rng)
+
+    #enhancers with a median RPM of at least 1, as eNormalization.py keeps them
+    rpm = rpm_matrix(counts)
+    keep = np.median(rpm, axis=1) >= 1
+    rpm = rpm[keep]
+    loci = [enhancer for enhancer, kept in zip(loci, keep) if kept]
+    pd.DataFrame(rpm, index=loci, columns=samples).to_csv(files['expFile'])
+
+    factors = np.log1p(rpm[rng.choice(len(rpm), min(8, len(rpm)), replace=False)])
+    factors = (factors - factors.mean(axis=1, keepdims=True)) / (factors.std(axis=1, keepdims=True) + 1e-9)
+    tfs = ['TF%d' % i for i in range(n_tfs)]
+    genes = ['GENE%d' % i for i in range(n_genes)]
+    gene_exp = gene_expression(n_tfs + n_genes, n_samples, factors, rng)
+    pd.DataFrame(gene_exp, index=tfs + genes, columns=samples).to_csv(files['gExpFile'])
+
+    write_tfbs(loci, tfs, files['eTFBS_file'], rng, header='enhancer\tTF\tscore')
+    write_tfbs(genes, tfs, files['gTFBS_file'], rng, header='gene\tTF\tscore')
+    write_gtf(enhancers, genes, files['gtfFile'], rng)
+    with open(files['eFile'], 'w') as f:
+        for enhancer in loci[::max(1, len(loci) // max(1, len(loci) // 20))]:
+            f.write(enhancer + '\n')
+    return files
+
+
+def usage():
+    print("""Parameters:
+        --outFolder      folder to write the synthetic dataset.
+        --enhancers      number of enhancers, taken from Ensembl_Fantom5_enhancers_nonOverlapGene (default: 2000).
+        --samples        number of samples (default: 40).
+        --genes          number of genes (default: enhancers / 10, at least 200).
+        --tfs            number of TFs (default: 100).
+        --bigwigs        number of samples with a bigwig file (default: all).
+        --seed           random seed (default: 1).
+        """)
+    print()
+    print('Example: python benchmarks/synthetic.py  --outFolder synthetic/ --enhancers 20000 --samples 100')
+
+
+if __name__ == '__main__':
+    param = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(param, '-h', ['outFolder=', 'enhancers=', 'samples=', 'genes=', 'tfs=', 'bigwigs=', 'seed='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    n_enhancers = 2000
+    n_samples = 40
+    n_genes = None
+    n_tfs = 100
+    n_bigwigs = None
+    seed = 1
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit(2)
+        elif opt == '--outFolder':
+            outFolder = str(arg)
+        elif opt == '--enhancers':
+            n_enhancers = int(arg)
+        elif opt == '--samples':
+            n_samples = int(arg)
+        elif opt == '--genes':
+            n_genes = int(arg)
+        elif opt == '--tfs':
+            n_tfs = int(arg)
+        elif opt == '--bigwigs':
+            n_bigwigs = int(arg)
+        elif opt == '--seed':
+            seed = int(arg)
+
+    make_dataset(outFolder, n_enhancers, n_samples, n_genes, n_tfs, n_bigwigs, seed)
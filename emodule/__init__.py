@@ -0,0 +1,76 @@
+#eModule: a computational framework for enhancer analysis with transcriptomic data.
+#
+#The stages of the pipeline as functions on in-memory data. Expression dataframes have enhancer loci
+#(chr:start-end) or genes as index and samples as columns.
+#  read_annotation   enhancer annotation file -> enhancers, the input of quantify
+#  quantify          bigwig files -> per-base averages                              (calculateExp.py)
+#  normalize         per-base averages -> RPM of every tissue, and the TMM factors  (eNormalization.py)
+#  sex_biased        RPM and sample attributes of a tissue -> sex-biased enhancers  (diffExp.py)
+#  near_genes        enhancers and a gtf file -> genes near every enhancer
+#  read_tfbs         TFBS file -> TFs binding every enhancer or gene
+#  modules           RPM, gene expression, TFBS and near genes -> modules           (identifyModule.py)
+#Importing emodule itself is cheap: the modules behind these functions are imported on their first
+#call, and that first call imports numpy and pandas with them. scipy, statsmodels, pyBigWig, rpy2
+#and pyarrow are imported later still, only by the code paths that need them.
+#python -m emodule <script> runs one of the scripts.
+
+
+#enhancers of the annotation file, as (chrom, start, end, locus)
+def read_annotation(annoFile):
+    from . import calculateExp
+    return calculateExp.read_enhancer(annoFile)
+
+
+#enhancer x sample dataframe of per-base averages of the bigwig files
+def quantify(bwfiles, enhancers, processes=1, engine='vector', prefetch_depth=0):
+    from . import calculateExp
+    return calculateExp.exp_frame(bwfiles, enhancers, processes, engine, prefetch_depth)
+
+
+#RPM dataframe of every tissue ({tissue: [samples]}), and the TMM factors of the samples, from an
+#enhancer x sample dataframe of per-base averages
+def normalize(exp_df, tissue_samples, tmm='edgeR'):
+    from . import eNormalization
+    enhancer_index, lengths = eNormalization.loci_lengths(exp_df.index)
+    counts_df = eNormalization.averages_counts(enhancer_index, lengths, exp_df)
+    return eNormalization.normalize_counts(counts_df, tissue_samples, tmm)
+
+
+#sex-biased enhancers of one tissue, from its RPM dataframe and its attribute x sample dataframe
+#(the sample attribute file)
+def sex_biased(rpm_df, attributes_df, tissue, engine='statsmodels', fdr_cutoff=0.05, prefilter='none'):
+    from . import diffExp
+    return diffExp.sex_biased_enhancers(rpm_df, attributes_df, tissue, engine, fdr_cutoff, prefilter)
+
+
+#genes near every enhancer locus, {enhancer: set of genes}
+def near_genes(enhancers, gtfFile, window=1000000, gtfCache=None):
+    from . import identifyModule
+    return identifyModule.obtain_near_gene(enhancers, gtfFile, window, gtfCache)
+
+
+#TFs binding every enhancer or gene of a TFBS file above the score cutoff, {key: set of TFs},
+#only for the given keys if any
+def read_tfbs(tfbsFile, tfcutoff, keys=None):
+    from . import identifyModule
+    return identifyModule.read_eTFBS(tfbsFile, tfcutoff, keys)
+
+
+#modules of the enhancers, one row per enhancer, regulating TF and target gene
+def modules(rpm_df,
+            gene_exp_df,
+            enhancers,
+            near_genes,
+            eTFBS,
+            gTFBS,
+            corr_cutoff=0.3,
+            pval_cutoff=0.05,
+            engine='matrix',
+            permutations=0,
+            seed=1,
+            processes=1):
+    from . import identifyModule
+    merged_exp_df = identifyModule.merge_exp(rpm_df, gene_exp_df)
+    eModules, pair_p, pair_q = identifyModule.find_modules(enhancers, near_genes, merged_exp_df, eTFBS, gTFBS,
+                                                           corr_cutoff, pval_cutoff, engine, permutations, seed, processes)
+    return identifyModule.modules_frame(eModules, pair_p, pair_q)
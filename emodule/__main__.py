@@ -0,0 +1,32 @@
+import sys
+import importlib
+
+
+#python -m emodule <script> [options] runs one script of the package; only its module is imported
+SCRIPTS = ['calculateExp', 'eNormalization', 'diffExp', 'identifyModule', 'geneIndex', 'pipeline']
+
+
+def usage():
+    print("""Usage: python -m emodule <script> [options]
+
+Scripts:
+        calculateExp     calculate the expression of enhancers from bigwig files.
+        eNormalization   normalize enhancer expression by TMM and RPM.
+        diffExp          identify sex-biased enhancers.
+        identifyModule   infer enhancer-mediated gene regulation modules.
+        geneIndex        build the gene table cache of a gtf file.
+        pipeline         run the four scripts as a cached DAG of tasks.
+        """)
+    print()
+    print('Example: python -m emodule diffExp -h')
+
+
+def main(argv):
+    if not argv or argv[0] not in SCRIPTS:
+        usage()
+        sys.exit(2)
+    importlib.import_module('emodule.' + argv[0]).main(argv[1:])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,120 @@
+import bisect
+import struct
+
+
+#Byte ranges of the data blocks of a bigwig file that overlap genomic spans, found through the
+#file's own indexes (the chromosome B+ tree and the R-tree of the data blocks), as pyBigWig does
+#when it reads values. Used to bring only those blocks into the page cache ahead of the reads.
+BIGWIG_MAGIC = 0x888FFC26
+BPT_MAGIC = 0x78CA8C91
+CIRTREE_MAGIC = 0x2468ACE0
+#blocks closer than this (a page) are fetched as one range
+MERGE_GAP = 4096
+
+
+def unpack(f, order, fmt):
+    size = struct.calcsize(order + fmt)
+    return struct.unpack(order + fmt, f.read(size))
+
+
+#byte order of the file and the offsets of its chromosome tree and data index
+def read_header(f, path):
+    f.seek(0)
+    magic = f.read(4)
+    for order in ('<', '>'):
+        if struct.unpack(order + 'I', magic)[0] == BIGWIG_MAGIC:
+            break
+    else:
+        raise ValueError('%s is not a bigwig file' % path)
+    version, zoomLevels, chromTreeOffset, fullDataOffset, fullIndexOffset = unpack(f, order, 'HHQQQ')
+    return order, chromTreeOffset, fullIndexOffset
+
+
+#{chromosome name: chromosome ID} of the chromosome B+ tree
+def read_chrom_ids(f, order, offset):
+    f.seek(offset)
+    magic, blockSize, keySize, valSize, itemCount, reserved = unpack(f, order, 'IIIIQQ')
+    if magic != BPT_MAGIC:
+        raise ValueError('bad chromosome tree')
+    chrom_ids = {}
+    nodes = [offset + 32]
+    while nodes:
+        f.seek(nodes.pop())
+        isLeaf, reserved, count = unpack(f, order, 'BBH')
+        for k in range(count):
+            key = f.read(keySize).rstrip(b'\0').decode()
+            if isLeaf:
+                chromId, chromSize = unpack(f, order, 'II')
+                chrom_ids[key] = chromId
+            else:
+                nodes.append(unpack(f, order, 'Q')[0])
+    return chrom_ids
+
+
+#spans of every chromosome ID, merged and sorted: {chromId: (starts, ends)}
+def merge_spans(spans, chrom_ids):
+    id_spans = {}
+    for chrom in spans:
+        if chrom not in chrom_ids:
+            continue
+        starts, ends = [], []
+        for start, end in sorted(spans[chrom]):
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        id_spans[chrom_ids[chrom]] = (starts, ends)
+    return id_spans
+
+
+#whether the region (startChrom, startBase) - (endChrom, endBase) of the R-tree overlaps a span
+def overlaps(id_spans, chroms, startChrom, startBase, endChrom, endBase):
+    for k in range(bisect.bisect_left(chroms, startChrom), bisect.bisect_right(chroms, endChrom)):
+        chrom = chroms[k]
+        starts, ends = id_spans[chrom]
+        low = startBase if chrom == startChrom else 0
+        high = endBase if chrom == endChrom else float('inf')
+        i = bisect.bisect_right(ends, low)
+        if i < len(starts) and starts[i] < high:
+            return True
+    return False
+
+
+#(offset, size) of the data blocks of the R-tree that overlap the spans, in file order
+def read_data_blocks(f, order, offset, id_spans):
+    f.seek(offset)
+    magic, blockSize, itemCount, startChrom, startBase, endChrom, endBase, endFileOffset, itemsPerSlot, reserved = \
+        unpack(f, order, 'IIQIIIIQII')
+    if magic != CIRTREE_MAGIC:
+        raise ValueError('bad data index')
+    chroms = sorted(id_spans)
+    blocks = []
+    nodes = [offset + 48]
+    while nodes:
+        f.seek(nodes.pop())
+        isLeaf, reserved, count = unpack(f, order, 'BBH')
+        itemFormat = 'IIIIQQ' if isLeaf else 'IIIIQ'
+        for item in struct.iter_unpack(order + itemFormat, f.read(count * struct.calcsize(order + itemFormat))):
+            if overlaps(id_spans, chroms, *item[:4]):
+                if isLeaf:
+                    blocks.append((item[4], item[5]))
+                else:
+                    nodes.append(item[4])
+    return sorted(blocks)
+
+
+#byte ranges (offset, length) of a bigwig file holding the values of the spans ({chrom: [(start, end)]}),
+#with blocks closer than merge_gap joined
+def data_ranges(path, spans, merge_gap=MERGE_GAP):
+    with open(path, 'rb') as f:
+        order, chromTreeOffset, fullIndexOffset = read_header(f, path)
+        id_spans = merge_spans(spans, read_chrom_ids(f, order, chromTreeOffset))
+        blocks = read_data_blocks(f, order, fullIndexOffset, id_spans)
+    ranges = []
+    for offset, size in blocks:
+        if ranges and offset - (ranges[-1][0] + ranges[-1][1]) <= merge_gap:
+            ranges[-1][1] = max(ranges[-1][1], offset + size - ranges[-1][0])
+        else:
+            ranges.append([offset, size])
+    return [tuple(byteRange) for byteRange in ranges]
@@ -0,0 +1,485 @@
+import os
+import sys, getopt
+import multiprocessing
+import numpy as np
+from . import bwIndex
+from . import expStore
+from . import instrument
+from . import prefetch
+from . import tableIO
+
+
+def read_enhancer(annoFile):
+    enhancers = []
+    with open(annoFile) as f:
+        for line in f:
+            chrom, start, end = line.strip().split('\t')
+            locus = '%s:%s-%s' % (chrom, start, end)
+            start = int(start)
+            end = int(end)
+            enhancers.append((chrom,
+                              start,
+                              end,
+                              locus))
+    return enhancers
+    
+    
+#sample ID of a Recount3 bigwig file, e.g. gtex.base_sums.ADIPOSE_TISSUE_GTEX-1A3MV-2126-SM-718BV.1.ALL.bw
+def sample_id(bwfile):
+    fileName = os.path.basename(bwfile)
+    if 'GTEX-' in fileName and '.ALL.bw' in fileName:
+        return fileName[fileName.find('GTEX-'):(fileName.find('.ALL.bw')-2)]
+    return os.path.splitext(fileName)[0]
+
+
+#enhancers of a chromosome are read from the bigwig file in spans of at most this many bases;
+#a span also ends where the next enhancer is more than MAX_GAP bases away, so that the bases
+#between distant enhancers are not read
+CHUNK_SIZE = 10000000
+MAX_GAP = 10000
+
+
+#average expression of every enhancer in one bigwig file, one exact stats call per enhancer
+def quantify_exp_stats(bwfile, enhancers):
+    import pyBigWig
+    bw = pyBigWig.open(bwfile)
+    counts = []
+    for chrom, start, end, locus in enhancers:
+        count = bw.stats(chrom, start, end, exact=True)[0] #the average value over a range
+        if count is None: #no bigwig entry over the enhancer, i.e. no coverage
+            count = 0.0
+        counts.append(round(count, 2))
+    bw.close()
+    return counts
+
+
+#(start, end, index) of the enhancers of every chromosome, sorted
+def chrom_regions(enhancers):
+    regions = {}
+    for i, (chrom, start, end, locus) in enumerate(enhancers):
+        if chrom not in regions:
+            regions[chrom] = []
+        regions[chrom].append((start, end, i))
+    for chrom in regions:
+        regions[chrom].sort()
+    return regions
+
+
+#chunks of sorted regions read with one call, as (i, j, chunk_start, chunk_end) covering regions[i:j]
+def region_chunks(regions, chunk_size=CHUNK_SIZE, max_gap=MAX_GAP):
+    i = 0
+    while i < len(regions):
+        chunk_start = regions[i][0]
+        chunk_end = regions[i][1]
+        j = i + 1
+        while j < len(regions) and regions[j][0] - chunk_end <= max_gap and max(chunk_end, regions[j][1]) - chunk_start <= chunk_size:
+            chunk_end = max(chunk_end, regions[j][1])
+            j += 1
+        yield i, j, chunk_start, chunk_end
+        i = j
+
+
+#genomic spans that the engines read from every bigwig file, {chrom: [(start, end)]}
+def read_spans(enhancers, chunk_size=CHUNK_SIZE, max_gap=MAX_GAP):
+    spans = {}
+    for chrom, regions in chrom_regions(enhancers).items():
+        spans[chrom] = [(chunk_start, chunk_end) for i, j, chunk_start, chunk_end in region_chunks(regions, chunk_size, max_gap)]
+    return spans
+
+
+#bring the data blocks of the spans into the page cache ahead of the reads; a URL is left to pyBigWig
+def warm_bigwig(bwfile, spans):
+    if '://' in bwfile:
+        return 0
+    return prefetch.warm_ranges(bwfile, bwIndex.data_ranges(bwfile, spans))
+
+
+#average expression of every enhancer in one bigwig file, reading each chromosome in large sorted chunks
+def quantify_exp_vector(bwfile, enhancers, chunk_size=CHUNK_SIZE, max_gap=MAX_GAP):
+    import pyBigWig
+    means = np.zeros(len(enhancers))
+    bw = pyBigWig.open(bwfile)
+    chrom_sizes = bw.chroms()
+    for chrom, regions in chrom_regions(enhancers).items():
+        if chrom not in chrom_sizes:
+            continue
+        for i, j, chunk_start, chunk_end in region_chunks(regions, chunk_size, max_gap):
+            chunk_end = min(chunk_end, chrom_sizes[chrom])
+
+            #per-base values, with NaN where the bigwig file has no entry
+            values = bw.values(chrom, chunk_start, chunk_end, numpy=True)
+            covered = ~np.isnan(values)
+            value_sums = np.zeros(len(values) + 1)
+            np.cumsum(np.where(covered, values, 0), dtype=np.float64, out=value_sums[1:])
+            base_counts = np.zeros(len(values) + 1, dtype=np.int64)
+            np.cumsum(covered, out=base_counts[1:])
+
+            #mean over covered bases of every enhancer from the prefix sums
+            starts = np.array([region[0] for region in regions[i:j]]) - chunk_start
+            ends = np.minimum(np.array([region[1] for region in regions[i:j]]), chunk_end) - chunk_start
+            index = np.array([region[2] for region in regions[i:j]])
+            sums = value_sums[ends] - value_sums[starts]
+            bases = base_counts[ends] - base_counts[starts]
+            means[index] = np.where(bases > 0, sums / np.maximum(bases, 1), 0.0)
+    bw.close()
+    return [round(mean, 2) for mean in means.tolist()]
+
+
+def quantify_exp(bwfile, enhancers, engine='vector'):
+    if engine == 'stats':
+        return quantify_exp_stats(bwfile, enhancers)
+    return quantify_exp_vector(bwfile, enhancers)
+
+
+def extract_exp(bwfile, enhancers, outFile, engine='vector'):
+    with instrument.stage('quantify %s' % sample_id(bwfile), total=len(enhancers), unit='enhancers'):
+        counts = quantify_exp(bwfile, enhancers, engine)
+
+    with open(outFile, 'w') as f_re:
+        for t, count in zip(enhancers, counts):
+            locus = t[-1]
+            f_re.write('\t'.join([locus, str(count)])+'\n')
+
+
+#read bigwig files from a folder, or from a manifest file with one bigwig path per line
+def read_bwfiles(bwList):
+    if os.path.isdir(bwList):
+        bwfiles = []
+        for fileName in sorted(os.listdir(bwList)):
+            if fileName.endswith('.bw') or fileName.endswith('.bigWig'):
+                bwfiles.append(os.path.join(bwList, fileName))
+        return bwfiles
+
+    bwfiles = []
+    with open(bwList) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                bwfiles.append(line)
+    return bwfiles
+
+
+#enhancers are handed to each worker once instead of once per bigwig file
+_worker_enhancers = None
+_worker_engine = None
+
+def _init_worker(enhancers, engine):
+    global _worker_enhancers, _worker_engine
+    _worker_enhancers = enhancers
+    _worker_engine = engine
+
+
+def _quantify_worker(bwfile):
+    return quantify_exp(bwfile, _worker_enhancers, _worker_engine)
+
+
+#quantify many bigwig files with a process pool, yielding each sample's values in input order;
+#in a single process, the data blocks of the enhancers in the next prefetch_depth files are brought
+#into the page cache by threads while one is quantified (pyBigWig holds the GIL while it reads, so
+#its own reads cannot overlap)
+def iter_quantify_exp(bwfiles, enhancers, processes=1, engine='vector', prefetch_depth=0):
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(enhancers, engine))
+        try:
+            for counts in pool.imap(_quantify_worker, bwfiles):
+                instrument.advance()
+                yield counts
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        if prefetch_depth > 0:
+            spans = read_spans(enhancers)
+            bwfiles = (bwfile for bwfile, size in prefetch.iter_prefetch(lambda bwfile: warm_bigwig(bwfile, spans), bwfiles, prefetch_depth))
+        for bwfile in bwfiles:
+            counts = quantify_exp(bwfile, enhancers, engine)
+            instrument.advance()
+            yield counts
+
+
+def batch_quantify_exp(bwfiles, enhancers, processes=1, engine='vector', prefetch_depth=0):
+    exp_matrix = np.empty((len(enhancers), len(bwfiles)))
+    for i, counts in enumerate(iter_quantify_exp(bwfiles, enhancers, processes, engine, prefetch_depth)):
+        exp_matrix[:, i] = counts
+    return exp_matrix
+
+
+#enhancer x sample per-base averages of many bigwig files as a dataframe, with enhancer loci as index
+#and sample IDs as columns (the content of the batch mode's matrix)
+def exp_frame(bwfiles, enhancers, processes=1, engine='vector', prefetch_depth=0):
+    import pandas as pd
+    with instrument.stage('quantify', total=len(bwfiles), unit='samples'):
+        exp_matrix = batch_quantify_exp(bwfiles, enhancers, processes, engine, prefetch_depth)
+    return pd.DataFrame(exp_matrix,
+                        index=[t[-1] for t in enhancers],
+                        columns=[sample_id(bwfile) for bwfile in bwfiles])
+
+
+#write an enhancer x sample matrix, the input of eNormalization.py --expMatrix, as tab-separated text
+#or as a Parquet file of float columns
+def write_exp_matrix(enhancers, samples, exp_matrix, outFile, outFormat='text'):
+    if outFormat == 'parquet':
+        import pandas as pd
+        exp_df = pd.DataFrame(exp_matrix, index=pd.Index([t[-1] for t in enhancers], name='Enhancer'), columns=samples)
+        tableIO.write_table(exp_df, outFile, 'parquet')
+        return
+    with open(outFile, 'w') as f_re:
+        f_re.write('\t'.join(['Enhancer'] + samples)+'\n')
+        for t, counts in zip(enhancers, exp_matrix.tolist()):
+            f_re.write('\t'.join([t[-1]] + [str(count) for count in counts])+'\n')
+
+
+def batch_extract_exp(bwfiles, enhancers, outFile, processes=1, engine='vector', outFormat='text', prefetch_depth=0):
+    samples = [sample_id(bwfile) for bwfile in bwfiles]
+    with instrument.stage('quantify', total=len(bwfiles), unit='samples'):
+        if outFormat == 'store':
+            #every sample is written to the memory-mapped store as soon as it is quantified
+            loci = [t[-1] for t in enhancers]
+            exp_matrix = expStore.create_exp_store(outFile, loci, samples)
+            for i, counts in enumerate(iter_quantify_exp(bwfiles, enhancers, processes, engine, prefetch_depth)):
+                exp_matrix[:, i] = expStore.encode_column(counts)
+            exp_matrix.flush()
+            del exp_matrix
+        else:
+            exp_matrix = batch_quantify_exp(bwfiles, enhancers, processes, engine, prefetch_depth)
+    if outFormat != 'store':
+        with instrument.stage('write matrix', total=len(enhancers), unit='enhancers'):
+            write_exp_matrix(enhancers, samples, exp_matrix, outFile, outFormat)
+
+
+#Sharded batch mode: the work is split into units of one sample and one chromosome, and unit k
+#belongs to shard k % N, so that N jobs run with --shard 0/N ... --shard N-1/N (e.g. on N nodes)
+#share the work without overlap. Every finished unit is written atomically to
+#<shardFolder>/<sample>/<chrom>.npy and recorded in the manifest of its job
+#(<shardFolder>/manifest.<i>of<N>). A restarted job skips the units recorded in any manifest.
+#Once all units are done, --merge assembles them into the matrix or store of the batch mode.
+
+#enhancer indices of every chromosome, in order of first appearance
+def chrom_enhancers(enhancers):
+    chrom_index = {}
+    for i, (chrom, start, end, locus) in enumerate(enhancers):
+        if chrom not in chrom_index:
+            chrom_index[chrom] = []
+        chrom_index[chrom].append(i)
+    return chrom_index
+
+
+#(bigwig file, sample, chromosome) of every unit of a shard
+def shard_units(bwfiles, enhancers, shard=0, nshards=1):
+    units = []
+    k = 0
+    chroms = list(chrom_enhancers(enhancers))
+    for bwfile in bwfiles:
+        sample = sample_id(bwfile)
+        for chrom in chroms:
+            if k % nshards == shard:
+                units.append((bwfile, sample, chrom))
+            k += 1
+    return units
+
+
+def unit_file(shardFolder, sample, chrom):
+    return os.path.join(shardFolder, sample, chrom + '.npy')
+
+
+#(sample, chromosome) of the units recorded in all manifests of the shard folder
+def read_manifests(shardFolder):
+    done = set()
+    if not os.path.exists(shardFolder):
+        return done
+    for fileName in os.listdir(shardFolder):
+        if fileName.startswith('manifest.'):
+            with open(os.path.join(shardFolder, fileName)) as f:
+                for line in f:
+                    cols = line.rstrip('\n').split('\t')
+                    if len(cols) == 2:
+                        done.add((cols[0], cols[1]))
+    return done
+
+
+_worker_chroms = None
+
+def _init_unit_worker(enhancers, engine):
+    global _worker_chroms
+    _init_worker(enhancers, engine)
+    _worker_chroms = chrom_enhancers(enhancers)
+
+
+def _quantify_unit(task):
+    bwfile, sample, chrom, outFile = task
+    counts = quantify_exp(bwfile, [_worker_enhancers[i] for i in _worker_chroms[chrom]], _worker_engine)
+    tmpFile = '%s.%d.tmp.npy' % (outFile[:-len('.npy')], os.getpid())
+    np.save(tmpFile, np.array(counts, dtype=np.float64))
+    os.replace(tmpFile, outFile)
+    return sample, chrom
+
+
+#quantify the units of one shard that are not done yet; returns the number of units quantified
+def shard_quantify_exp(bwfiles, enhancers, shardFolder, shard=0, nshards=1, processes=1, engine='vector'):
+    if not os.path.exists(shardFolder):
+        os.makedirs(shardFolder, exist_ok=True)
+    done = read_manifests(shardFolder)
+    tasks = []
+    for bwfile, sample, chrom in shard_units(bwfiles, enhancers, shard, nshards):
+        outFile = unit_file(shardFolder, sample, chrom)
+        if (sample, chrom) in done and os.path.exists(outFile):
+            continue
+        if not os.path.exists(os.path.dirname(outFile)):
+            os.makedirs(os.path.dirname(outFile), exist_ok=True)
+        tasks.append((bwfile, sample, chrom, outFile))
+
+    manifest = os.path.join(shardFolder, 'manifest.%dof%d' % (shard, nshards))
+    with open(manifest, 'a') as f, instrument.stage('quantify shard %d/%d' % (shard, nshards), total=len(tasks), unit='units'):
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, initializer=_init_unit_worker, initargs=(enhancers, engine))
+            finished = pool.imap_unordered(_quantify_unit, tasks)
+        else:
+            pool = None
+            _init_unit_worker(enhancers, engine)
+            finished = (_quantify_unit(task) for task in tasks)
+        try:
+            for sample, chrom in finished:
+                #a unit is recorded only after its file is in place
+                f.write('%s\t%s\n' % (sample, chrom))
+                f.flush()
+                os.fsync(f.fileno())
+                instrument.advance()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    return len(tasks)
+
+
+#assemble the units of all shards into an enhancer x sample matrix (or store)
+def merge_shards(bwfiles, enhancers, shardFolder, outFile, outFormat='text'):
+    samples = [sample_id(bwfile) for bwfile in bwfiles]
+    chrom_index = chrom_enhancers(enhancers)
+    done = read_manifests(shardFolder)
+    missing = [(sample, chrom) for sample in samples for chrom in chrom_index
+               if (sample, chrom) not in done or not os.path.exists(unit_file(shardFolder, sample, chrom))]
+    if missing:
+        raise ValueError('%d units are not quantified yet, e.g. sample %s, %s' % (len(missing), missing[0][0], missing[0][1]))
+
+    def sample_counts(sample):
+        counts = np.empty(len(enhancers))
+        for chrom in chrom_index:
+            counts[chrom_index[chrom]] = np.load(unit_file(shardFolder, sample, chrom))
+        instrument.advance()
+        return counts
+
+    with instrument.stage('merge shards', total=len(samples), unit='samples'):
+        if outFormat == 'store':
+            exp_matrix = expStore.create_exp_store(outFile, [t[-1] for t in enhancers], samples)
+            for i, sample in enumerate(samples):
+                exp_matrix[:, i] = expStore.encode_column(sample_counts(sample))
+            exp_matrix.flush()
+            del exp_matrix
+        else:
+            exp_matrix = np.empty((len(enhancers), len(samples)))
+            for i, sample in enumerate(samples):
+                exp_matrix[:, i] = sample_counts(sample)
+            write_exp_matrix(enhancers, samples, exp_matrix, outFile, outFormat)
+
+
+def usage():
+    print("""Parameters:
+        --annoFile       enhancer_annotation_file. 
+        --bwfile         bigwig file. This file can be downloaded from the Recount3 platform.
+        --bwList         folder of bigwig files, or a file listing one bigwig path per line (batch mode, replaces --bwfile).
+        --processes      number of worker processes in batch mode (default: 1).
+        --engine         vector (default): read each chromosome in large chunks; stats: one exact bw.stats call per enhancer.
+        --prefetch       batch mode with --processes 1: number of bigwig files whose enhancer data blocks are read ahead into the page cache by threads while one is quantified (default: 0, no read-ahead).
+        --outFormat      batch mode output, text (default): tab-separated matrix; parquet: Parquet matrix for eNormalization.py --expMatrix; store: binary store for eNormalization.py --expStore.
+        --outFile        the file to write result. In batch mode, an enhancer x sample matrix (the file prefix for --outFormat store).
+        --shardFolder    sharded batch mode: folder of the per sample and chromosome results and the manifests.
+        --shard          i/N: quantify shard i (0 to N-1) of N; the units recorded in the manifests are skipped (default: 0/1).
+        --merge          assemble the results of all shards in --shardFolder into --outFile.
+        --progress       print the progress of long stages, with ETA, to stderr.
+        --report         JSON file to write the wall time, CPU time, peak memory and throughput of every stage.
+        --profile        run the stages under cProfile; the top functions go to the report (or to stderr without --report).
+        """)
+    print()
+    print('Example: python calculateExp.py  --annoFile Ensembl_Fantom5_enhancers_nonOverlapGene --bwfile gtex.base_sums.ADIPOSE_TISSUE_GTEX-1A3MV-2126-SM-718BV.1.ALL.bw --outFile rawExp')
+    print('Example: python calculateExp.py  --annoFile Ensembl_Fantom5_enhancers_nonOverlapGene --bwList bigwigs/ --processes 8 --outFile rawExpMatrix')
+    print('Example: python calculateExp.py  --annoFile Ensembl_Fantom5_enhancers_nonOverlapGene --bwList bigwigs/ --processes 8 --shardFolder shards/ --shard 0/16')
+    print('Example: python calculateExp.py  --annoFile Ensembl_Fantom5_enhancers_nonOverlapGene --bwList bigwigs/ --shardFolder shards/ --merge --outFile rawExpMatrix')
+    
+       
+def main(argv):
+    param = argv
+    try:
+        opts, args = getopt.getopt(param, '-h', ['annoFile=', 'bwfile=', 'bwList=', 'processes=', 'engine=', 'outFormat=', 'outFile=',
+                                                 'prefetch=', 'shardFolder=', 'shard=', 'merge', 'progress', 'report=', 'profile'])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    
+    bwfile = None
+    bwList = None
+    processes = 1
+    engine = 'vector'
+    outFormat = 'text'
+    prefetchDepth = 0
+    shardFolder = None
+    shard = 0
+    nshards = 1
+    merge = False
+    progress = False
+    reportFile = None
+    profile = False
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit(2)
+        elif opt == '--annoFile':
+            annoFile = str(arg)
+        elif opt == '--bwfile':
+            bwfile = str(arg)
+        elif opt == '--bwList':
+            bwList = str(arg)
+        elif opt == '--processes':
+            processes = int(arg)
+        elif opt == '--engine':
+            engine = str(arg)
+        elif opt == '--outFormat':
+            outFormat = str(arg)
+        elif opt == '--outFile':
+            outFile = str(arg)
+        elif opt == '--prefetch':
+            prefetchDepth = int(arg)
+        elif opt == '--shardFolder':
+            shardFolder = str(arg)
+        elif opt == '--shard':
+            shard, nshards = [int(value) for value in arg.split('/')]
+            if not 0 <= shard < nshards:
+                usage()
+                sys.exit(2)
+        elif opt == '--merge':
+            merge = True
+        elif opt == '--progress':
+            progress = True
+        elif opt == '--report':
+            reportFile = str(arg)
+        elif opt == '--profile':
+            profile = True
+            
+    instrument.configure(progress, reportFile, profile)
+
+    enhancers = read_enhancer(annoFile)
+    
+    if bwList and shardFolder:
+        bwfiles = read_bwfiles(bwList)
+        if merge:
+            merge_shards(bwfiles, enhancers, shardFolder, outFile, outFormat)
+        else:
+            shard_quantify_exp(bwfiles, enhancers, shardFolder, shard, nshards, processes, engine)
+    elif bwList:
+        bwfiles = read_bwfiles(bwList)
+        batch_extract_exp(bwfiles, enhancers, outFile, processes, engine, outFormat, prefetchDepth)
+    else:
+        extract_exp(bwfile, enhancers, outFile, engine)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
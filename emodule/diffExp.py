@@ -0,0 +1,704 @@
+import pandas as pd
+import numpy as np
+import os
+import sys, getopt
+import multiprocessing
+import traceback
+from . import instrument
+from . import tableIO
+
+
+FLOAT_EPS = np.finfo(float).eps
+
+
+#read sample attributes, and exclude gene expression PCs that significantly correlate with sex
+def read_attributes(sampleFile):
+    # read attribute data
+    return prepare_attributes(pd.read_csv(sampleFile, index_col=0))
+
+
+#sample attributes (attribute x sample, as in the sample attribute file) with samples as index,
+#without the gene expression PCs that significantly correlate with sex
+def prepare_attributes(attributes_df):
+    from scipy.stats import pointbiserialr
+
+    # Samples as index, attribute as column
+    individual_attributes = attributes_df.T
+    
+    #identify gene expression PCs that significantly correlate with sex by Point-Biserial Correlation test
+    correlatedPCs = set()
+    expPCs = [PC for PC in individual_attributes.columns if 'InferredCov' in PC]
+    for expPC in expPCs:
+        corr, p_value = pointbiserialr(individual_attributes['Sex'], individual_attributes[expPC])
+        if p_value < 0.05:
+            correlatedPCs.add(expPC)
+            
+    #exclude sex-correlated gene expression PCs
+    for expPC in correlatedPCs:
+        individual_attributes = individual_attributes.drop(expPC, axis = 1)
+    return individual_attributes
+
+
+#median log2 expression of male and female samples, and male VS female fold change, of every enhancer
+def sex_medians(expression_data, sex):
+    sex = sex.reindex(expression_data.index)
+    log_exp = np.log2(expression_data.values + 0.01)
+    male_medians = [round(float(m), 3) for m in np.median(log_exp[(sex == 1).values], axis=0)]
+    female_medians = [round(float(m), 3) for m in np.median(log_exp[(sex == 2).values], axis=0)]
+    fold_changes = [round(m - f, 3) for m, f in zip(male_medians, female_medians)]
+    return male_medians, female_medians, fold_changes
+
+
+#GLM design matrix shared by all enhancers, built from the formula once
+def design_matrix(expression_data, individual_attributes):
+    import patsy
+    formula = ' + '.join(individual_attributes.columns)
+    attributes = individual_attributes.reindex(expression_data.index)
+    design = patsy.dmatrix(formula, attributes, return_type='dataframe')
+    return design
+
+
+#solutions of the stacked linear systems A[i] x = b[i]; a singular system is solved by pseudo-inverse,
+#as statsmodels does, so that it does not fail the other responses of the chunk
+def solve_stacked(A, b):
+    try:
+        return np.linalg.solve(A, b[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        x = np.empty(b.shape)
+        for i in range(len(A)):
+            try:
+                x[i] = np.linalg.solve(A[i], b[i])
+            except np.linalg.LinAlgError:
+                x[i] = np.linalg.pinv(A[i]) @ b[i]
+        return x
+
+
+#inverses of stacked matrices, by pseudo-inverse for the singular ones
+def inv_stacked(A):
+    try:
+        return np.linalg.inv(A)
+    except np.linalg.LinAlgError:
+        inverses = np.empty(A.shape)
+        for i in range(len(A)):
+            try:
+                inverses[i] = np.linalg.inv(A[i])
+            except np.linalg.LinAlgError:
+                inverses[i] = np.linalg.pinv(A[i])
+        return inverses
+
+
+#Poisson GLM (log link) of many responses sharing one design matrix, fitted together by IRLS
+#X: samples x covariates; Y: samples x responses. Returns coefficients and standard errors (covariates x responses),
+#and the fitted means (samples x responses) if return_mu is True. A response that cannot be fitted (all
+#counts zero) gets NaN coefficients and standard errors, and does not affect the others.
+def fit_poisson_irls(X, Y, maxiter=100, tol=1e-8, return_mu=False):
+    #covariates are rescaled to comparable magnitudes, which keeps the normal equations well conditioned
+    scales = np.sqrt((X ** 2).mean(axis=0))
+    scales[scales == 0] = 1
+    Xs = X / scales
+    nresponses = Y.shape[1]
+    ncovariates = X.shape[1]
+    #outer products of the covariates of every sample, so that X'WX of all responses is one matrix product
+    XX = (Xs[:, :, None] * Xs[:, None, :]).reshape(len(Xs), -1)
+
+    #statsmodels starting values and deviance based convergence criterion
+    params = np.zeros((ncovariates, nresponses))
+    XtWX = np.zeros((nresponses, ncovariates, ncovariates))
+    #responses of all-zero counts have no finite fit (statsmodels fails on them)
+    fitted = Y.any(axis=0)
+    params[:, ~fitted] = np.nan
+    XtWX[~fitted] = np.nan
+    mu = (Y + Y.mean(axis=0)) / 2
+    mu[:, ~fitted] = 1
+    eta = np.log(mu)
+    deviance = poisson_deviance(Y, mu)
+    active = np.flatnonzero(fitted)
+    for iteration in range(maxiter):
+        if len(active) == 0:
+            break
+        W = mu[:, active]
+        z = eta[:, active] + (Y[:, active] - W) / W
+        A = (W.T @ XX).reshape(-1, ncovariates, ncovariates)
+        b = (W * z).T @ Xs
+        XtWX[active] = A
+        params[:, active] = solve_stacked(A, b).T
+
+        eta[:, active] = Xs @ params[:, active]
+        mu[:, active] = np.exp(eta[:, active])
+        new_deviance = poisson_deviance(Y[:, active], mu[:, active])
+        converged = np.abs(new_deviance - deviance[active]) <= tol
+        deviance[active] = new_deviance
+        active = active[~converged]
+
+    #covariance from the weights of the final IRLS step, the scale of Poisson family is one
+    cov = inv_stacked(XtWX)
+    mu[:, ~fitted] = np.nan
+    bse = np.sqrt(np.diagonal(cov, axis1=1, axis2=2)).T
+    if return_mu:
+        return params / scales[:, None], bse / scales[:, None], mu
+    return params / scales[:, None], bse / scales[:, None]
+
+
+def poisson_deviance(Y, mu):
+    mu = np.clip(mu, FLOAT_EPS, np.inf)
+    endog_mu = np.clip(Y / mu, FLOAT_EPS, np.inf)
+    return 2 * np.sum(Y * np.log(endog_mu) - (Y - mu), axis=0)
+
+
+#coefficient and Wald p-value of Sex for every enhancer, by the batched IRLS engine
+def glm_irls(expression_data, individual_attributes, chunk_size=2000):
+    from scipy.stats import norm
+    design = design_matrix(expression_data, individual_attributes)
+    X = design.values
+    Y = expression_data.loc[design.index].values.astype(np.float64)
+    sex_column = list(design.columns).index('Sex')
+    coefs = np.empty(Y.shape[1])
+    pvals = np.empty(Y.shape[1])
+    for start in range(0, Y.shape[1], chunk_size):
+        params, bse = fit_poisson_irls(X, Y[:, start:start+chunk_size])
+        coefs[start:start+chunk_size] = params[sex_column]
+        pvals[start:start+chunk_size] = 2 * norm.sf(np.abs(params[sex_column] / bse[sex_column]))
+        instrument.advance(params.shape[1])
+    #enhancers that could not be fitted are not tested
+    pvals[np.isnan(pvals)] = 1.0
+    return coefs, pvals
+
+
+#Rao score test p-value of Sex for every enhancer. Only the model without Sex is fitted (batched IRLS);
+#the score and information of Sex are evaluated at its fitted means.
+def glm_score(expression_data, individual_attributes, chunk_size=2000):
+    from scipy.stats import norm
+    design = design_matrix(expression_data, individual_attributes)
+    X = design.values
+    Y = expression_data.loc[design.index].values.astype(np.float64)
+    sex_column = list(design.columns).index('Sex')
+    X0 = np.delete(X, sex_column, axis=1)
+    xs = X[:, sex_column]
+    ncovariates = X0.shape[1]
+    XX0 = (X0[:, :, None] * X0[:, None, :]).reshape(len(X0), -1)
+    X0xs = X0 * xs[:, None]
+    pvals = np.empty(Y.shape[1])
+    for start in range(0, Y.shape[1], chunk_size):
+        Yc = Y[:, start:start+chunk_size]
+        params, bse, mu = fit_poisson_irls(X0, Yc, return_mu=True)
+        score = xs @ (Yc - mu)
+        #information of Sex, adjusted for the other covariates
+        A = (mu.T @ XX0).reshape(-1, ncovariates, ncovariates)
+        b = mu.T @ X0xs
+        info = mu.T @ (xs ** 2) - np.einsum('ij,ij->i', b, solve_stacked(A, b))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pvals[start:start+chunk_size] = 2 * norm.sf(np.abs(score) / np.sqrt(info))
+        instrument.advance(Yc.shape[1])
+    pvals[np.isnan(pvals)] = 1.0
+    return pvals
+
+
+#coefficient and Wald p-value of Sex for every enhancer, by one statsmodels fit per enhancer
+def glm_statsmodels(expression_data, individual_attributes):
+    from statsmodels.formula.api import glm
+    from statsmodels.genmod.families import Poisson
+
+    # construct a formula for GLM
+    formula = 'expression ~ ' + ' + '.join(individual_attributes.columns)
+    
+    coefs = []
+    pvals = []
+    # Iterate over each enhancer
+    for enhancer in expression_data.columns:
+        enhancer_expression_data = expression_data[[enhancer]]
+        
+        #enhancer_expression_data.rename(columns = {enhancer: 'expression'}, inplace=True)
+        enhancer_expression_data.columns  = ['expression']
+    
+        combined_data = enhancer_expression_data.join(individual_attributes)
+    
+        # Fit a generalized linear model
+        model = glm(formula, combined_data, family=Poisson()).fit()
+
+        # extract p values
+        model_summary = model.summary2().tables[1]
+        pvals.append(model_summary['P>|z|']['Sex'])
+        coefs.append(model_summary['Coef.']['Sex'])
+        instrument.advance()
+    return np.array(coefs), np.array(pvals)
+
+
+#coefficient and Wald p-value of Sex for every enhancer by the GLM engine
+def glm_fit(expression_data, individual_attributes, engine='statsmodels'):
+    if engine == 'irls':
+        return glm_irls(expression_data, individual_attributes)
+    return glm_statsmodels(expression_data, individual_attributes)
+
+
+#Pre-filter: an enhancer is written only if abs(log2(FC)) > 1, and the fold change comes from the medians,
+#so the full GLM is fitted only for those candidates. The other enhancers still take part in the BH
+#correction, with p-values by
+#  score  the score test of Sex (glm_score); every enhancer is tested, by Wald or score test
+#         (the FDRs are approximate: score p-values stand in for Wald p-values)
+#  fc     no test, p-value 1; conservative, the FDR of the candidates can only be larger
+#Their coefficient is NaN.
+PREFILTERS = ['none', 'score', 'fc']
+
+
+#medians, fold change and GLM statistics of every enhancer; returns one row per enhancer and the p-values
+def enhancer_stats(expression_data,
+                   individual_attributes,
+                   tissue,
+                   engine='statsmodels',
+                   prefilter='none'):
+    male_medians, female_medians, fold_changes = sex_medians(expression_data, individual_attributes['Sex'])
+    
+    # identify sex-associated enhancers
+    if prefilter == 'none':
+        coefs, p_values = glm_fit(expression_data, individual_attributes, engine)
+    else:
+        candidates = np.abs(fold_changes) > 1
+        coefs = np.full(len(fold_changes), np.nan)
+        p_values = np.ones(len(fold_changes))
+        if candidates.any():
+            coefs[candidates], p_values[candidates] = glm_fit(expression_data.loc[:, candidates], individual_attributes, engine)
+        if prefilter == 'score' and not candidates.all():
+            p_values[~candidates] = glm_score(expression_data.loc[:, ~candidates], individual_attributes)
+    
+    results = []
+    for i, enhancer in enumerate(expression_data.columns):
+        results.append([tissue,
+                        enhancer,
+                        male_medians[i],
+                        female_medians[i],
+                        fold_changes[i],
+                        round(coefs[i], 3),
+                        format(p_values[i], '.3e')])
+    return results, p_values
+
+
+#Benjamini-Hochberg p-value correction, the same arithmetic as statsmodels' multipletests(method='fdr_bh')
+def bh_fdrs(p_values):
+    p_values = np.asarray(p_values)
+    order = np.argsort(p_values)
+    ecdffactor = np.arange(1, len(p_values) + 1) / float(len(p_values))
+    fdrs_sorted = np.minimum.accumulate((p_values[order] / ecdffactor)[::-1])[::-1]
+    fdrs_sorted[fdrs_sorted > 1] = 1
+    fdrs = np.empty_like(fdrs_sorted)
+    fdrs[order] = fdrs_sorted
+    return fdrs
+
+
+#test every enhancer for sex-biased expression; returns one row per enhancer
+def test_enhancers(expression_data,
+                   individual_attributes,
+                   tissue,
+                   engine='statsmodels',
+                   prefilter='none'):
+    results, p_values = enhancer_stats(expression_data, individual_attributes, tissue, engine, prefilter)
+
+    fdrs = bh_fdrs(p_values)
+    for i in range(len(fdrs)):
+        results[i].append(fdrs[i])
+    return results
+
+
+#whether an enhancer is sex-biased
+def is_sex_biased(fold_change, coef, fdr, fdr_cutoff=0.05):
+    return fdr < fdr_cutoff and abs(fold_change)>1 and coef*fold_change<0
+
+
+RESULT_COLUMNS = ['Tissue',
+                  'Enhancer',
+                  'Male_exp',
+                  'Female_exp',
+                  'log2(FC)',
+                  'coef',
+                  'Pval',
+                  'FDR']
+
+
+def result_line(tissue, enhancer, male_median, female_median, fold_change, coef, pval, fdr):
+    return '\t'.join([tissue,
+                      enhancer,
+                      str(male_median),
+                      str(female_median),
+                      str(fold_change),
+                      str(coef),
+                      str(pval),
+                      str(format(fdr, '.3e'))])+'\n'
+
+
+#write rows of sex-biased enhancers (RESULT_COLUMNS, with the FDR as a number) as tab-separated text,
+#or as a Parquet table of typed columns holding the values of the text
+def write_result_rows(rows, outFile, outFormat='csv'):
+    if outFormat == 'parquet':
+        results_df = pd.DataFrame([row[:7] + [format(row[7], '.3e')] for row in rows], columns=RESULT_COLUMNS)
+        results_df[RESULT_COLUMNS[2:]] = results_df[RESULT_COLUMNS[2:]].astype(np.float64)
+        tableIO.write_table(results_df, outFile, outFormat, index=False)
+        return
+    with open(outFile, 'w') as f:
+        f.write('\t'.join(RESULT_COLUMNS)+'\n')
+        for row in rows:
+            f.write(result_line(*row))
+
+
+#write sex-biased enhancers
+def write_results(results, outFile, fdr_cutoff=0.05, outFormat='csv'):
+    rows = []
+    for tissue, enhancer, male_median, female_median, fold_change, coef, pval, fdr in results:
+        if is_sex_biased(fold_change, coef, fdr, fdr_cutoff):
+            rows.append([tissue, enhancer, male_median, female_median, fold_change, coef, pval, fdr])
+    write_result_rows(rows, outFile, outFormat)
+
+
+#sex-biased enhancers of an enhancer x sample RPM dataframe and an attribute x sample dataframe,
+#as a dataframe of RESULT_COLUMNS with the p-values at full precision
+def sex_biased_enhancers(exp_df,
+                         attributes_df,
+                         tissue,
+                         engine='statsmodels',
+                         fdr_cutoff=0.05,
+                         prefilter='none'):
+    individual_attributes = prepare_attributes(attributes_df)
+    with instrument.stage('diff_exp %s' % tissue, total=exp_df.shape[0], unit='enhancers'):
+        results, p_values = enhancer_stats(exp_df.T, individual_attributes, tissue, engine, prefilter)
+        fdrs = bh_fdrs(p_values)
+    rows = []
+    for row, p_value, fdr in zip(results, p_values, fdrs):
+        tissue, enhancer, male_median, female_median, fold_change, coef = row[:6]
+        if is_sex_biased(fold_change, coef, fdr, fdr_cutoff):
+            rows.append([tissue, enhancer, male_median, female_median, fold_change, coef, p_value, fdr])
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+#identify differentally expressed enhancers
+def diff_exp(expFile,
+             sampleFile,
+             tissue,
+             outFile,
+             engine='statsmodels',
+             fdr_cutoff=0.05,
+             block_size=None,
+             spillFile=None,
+             prefilter='none',
+             outFormat='csv'):
+    if block_size:
+        diff_exp_blocks(expFile, sampleFile, tissue, outFile, engine, fdr_cutoff, block_size, spillFile, prefilter, outFormat)
+        return
+
+    # read expression data
+    expression_data = tableIO.read_matrix(expFile)
+    
+    # Samples as index, enhancers as column
+    expression_data = expression_data.T
+    
+    individual_attributes = read_attributes(sampleFile)
+
+    with instrument.stage('diff_exp %s' % tissue, total=expression_data.shape[1], unit='enhancers'):
+        results = test_enhancers(expression_data, individual_attributes, tissue, engine, prefilter)
+
+    #write result                         
+    write_results(results, outFile, fdr_cutoff, outFormat)
+
+
+#Out-of-core mode: the expression matrix is read block_size enhancers at a time. The statistics
+#of every enhancer are written unfiltered to a spill file (the p-value at full precision), and a
+#second pass corrects the p-values of all enhancers and writes the sex-biased ones. Only one block
+#and the p-values are held in memory; the output is the same as that of diff_exp without blocks.
+SPILL_COLUMNS = ['Tissue', 'Enhancer', 'Male_exp', 'Female_exp', 'log2(FC)', 'coef', 'P']
+
+
+#first pass: statistics of every block of enhancers to the spill file
+def spill_stats(expFile, individual_attributes, tissue, spillFile, engine='statsmodels', block_size=10000, prefilter='none'):
+    with open(spillFile, 'w') as f, instrument.stage('diff_exp %s' % tissue, unit='enhancers'):
+        f.write('\t'.join(SPILL_COLUMNS)+'\n')
+        for block in tableIO.iter_matrix_blocks(expFile, block_size):
+            results, p_values = enhancer_stats(block.T, individual_attributes, tissue, engine, prefilter)
+            for row, p_value in zip(results, p_values):
+                f.write('\t'.join([str(value) for value in row[:6]] + [repr(float(p_value))])+'\n')
+
+
+#second pass: BH correction of all spilled p-values, and the sex-biased enhancers to outFile
+def filter_spilled(spillFile, outFile, fdr_cutoff=0.05, outFormat='csv'):
+    p_values = pd.read_csv(spillFile, sep='\t', usecols=['P'], dtype={'P': np.float64},
+                           float_precision='round_trip')['P'].values
+    fdrs = bh_fdrs(p_values)
+    rows = []
+    with open(spillFile) as f:
+        f.readline()
+        for i, line in enumerate(f):
+            tissue, enhancer, male_median, female_median, fold_change, coef, p_value = line.rstrip('\n').split('\t')
+            if is_sex_biased(float(fold_change), float(coef), fdrs[i], fdr_cutoff):
+                rows.append([tissue, enhancer, male_median, female_median, fold_change, coef,
+                             format(float(p_value), '.3e'), fdrs[i]])
+    write_result_rows(rows, outFile, outFormat)
+
+
+#identify differentally expressed enhancers block by block; the spill file is kept only if given
+def diff_exp_blocks(expFile,
+                    sampleFile,
+                    tissue,
+                    outFile,
+                    engine='statsmodels',
+                    fdr_cutoff=0.05,
+                    block_size=10000,
+                    spillFile=None,
+                    prefilter='none',
+                    outFormat='csv'):
+    individual_attributes = read_attributes(sampleFile)
+    keepSpill = spillFile is not None
+    if spillFile is None:
+        spillFile = '%s.%d.spill' % (outFile, os.getpid())
+    try:
+        spill_stats(expFile, individual_attributes, tissue, spillFile, engine, block_size, prefilter)
+        filter_spilled(spillFile, outFile, fdr_cutoff, outFormat)
+    finally:
+        if not keepSpill and os.path.exists(spillFile):
+            os.remove(spillFile)
+
+
+#tissues of the normalization output folder (<tissue>.csv or <tissue>.parquet, written by eNormalization.py) and their sample attribute files
+def read_tissue_files(expFolder, sampleFolder=None, sampleMap=None):
+    sampleFiles = {}
+    if sampleMap:
+        with open(sampleMap) as f:
+            for line in f:
+                if line.strip():
+                    tissue, sampleFile = line.rstrip('\n').split('\t')
+                    sampleFiles[tissue] = sampleFile
+
+    tissue_files = []
+    for tissue, expFile in tableIO.folder_matrices(expFolder):
+        if tissue in sampleFiles:
+            sampleFile = sampleFiles[tissue]
+        elif sampleFolder and os.path.exists(os.path.join(sampleFolder, tissue + '_sample.csv')):
+            sampleFile = os.path.join(sampleFolder, tissue + '_sample.csv')
+        elif sampleFolder and os.path.exists(os.path.join(sampleFolder, tissue + '.csv')):
+            sampleFile = os.path.join(sampleFolder, tissue + '.csv')
+        else:
+            print('No sample attribute file for tissue %s, skipped' % tissue, file=sys.stderr)
+            continue
+        tissue_files.append((tissue, expFile, sampleFile))
+    return tissue_files
+
+
+#available memory in bytes, or None if unknown
+def available_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+#number of tissues to run at once, bounded by cores and by memory
+#a tissue needs roughly MEMORY_PER_CSV_BYTE times the size of its expression csv, unless read in blocks
+MEMORY_PER_CSV_BYTE = 10
+
+def default_processes(tissue_files, block_size=None):
+    processes = min(multiprocessing.cpu_count(), max(len(tissue_files), 1))
+    memory = available_memory()
+    if memory and tissue_files and not block_size:
+        largest = max(os.path.getsize(expFile) for tissue, expFile, sampleFile in tissue_files)
+        processes = min(processes, max(1, memory // max(largest * MEMORY_PER_CSV_BYTE, 1)))
+    return int(processes)
+
+
+def _diff_exp_worker(task):
+    tissue, expFile, sampleFile, outFile, engine, fdr_cutoff, block_size, prefilter, outFormat = task
+    try:
+        diff_exp(expFile, sampleFile, tissue, outFile, engine, fdr_cutoff, block_size, None, prefilter, outFormat)
+        return tissue, None
+    except Exception:
+        return tissue, traceback.format_exc()
+
+
+#identify differentally expressed enhancers of every tissue with a process pool
+#a failed tissue is reported and does not stop the others; returns the failed tissues
+def diff_exp_tissues(expFolder,
+                     outFolder,
+                     sampleFolder=None,
+                     sampleMap=None,
+                     processes=None,
+                     engine='statsmodels',
+                     fdr_cutoff=0.05,
+                     block_size=None,
+                     prefilter='none',
+                     outFormat='csv'):
+    if not os.path.exists(outFolder):
+        os.makedirs(outFolder)
+    tissue_files = read_tissue_files(expFolder, sampleFolder, sampleMap)
+    if processes is None:
+        processes = default_processes(tissue_files, block_size)
+
+    tasks = []
+    for tissue, expFile, sampleFile in tissue_files:
+        outFile = tableIO.results_file(os.path.join(outFolder, tissue + '_sexBiasedEnhancer'), outFormat)
+        tasks.append((tissue, expFile, sampleFile, outFile, engine, fdr_cutoff, block_size, prefilter, outFormat))
+
+    failed = {}
+    pool = multiprocessing.Pool(processes)
+    try:
+        with instrument.stage('diff_exp tissues', total=len(tasks), unit='tissues'):
+            for tissue, error in pool.imap_unordered(_diff_exp_worker, tasks):
+                if error:
+                    failed[tissue] = error
+                    print('%s failed:\n%s' % (tissue, error), file=sys.stderr)
+                else:
+                    print(tissue)
+                instrument.advance()
+    finally:
+        pool.close()
+        pool.join()
+
+    #combined table of all finished tissues
+    allFile = tableIO.results_file(os.path.join(outFolder, 'sexBiasedEnhancer_allTissues'), outFormat)
+    if outFormat == 'parquet':
+        tables = [tableIO.read_table(task[3]) for task in tasks if task[0] not in failed]
+        results_df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=RESULT_COLUMNS)
+        tableIO.write_table(results_df, allFile, outFormat, index=False)
+        return failed
+    with open(allFile, 'w') as f_all:
+        header_written = False
+        for tissue, expFile, sampleFile, outFile, engine, fdr_cutoff, block_size, prefilter, outFormat in tasks:
+            if tissue in failed:
+                continue
+            with open(outFile) as f:
+                header = f.readline()
+                if not header_written:
+                    f_all.write(header)
+                    header_written = True
+                for line in f:
+                    f_all.write(line)
+    return failed
+
+
+def usage():
+    print("""Parameters:
+        --expFile        enhancer RPM matrix, csv or Parquet (.parquet). 
+        --sampleFile     sample_attribute_file of the tissue. The file can be downloaded from Recount3 platform.  
+        --tissue         the tissue label.
+        --outFile        the file to write result.
+        --expFolder      folder of per-tissue enhancer RPM matrices (<tissue>.csv or <tissue>.parquet, the output of eNormalization.py); runs all tissues, replaces --expFile and --tissue.
+        --sampleFolder   folder of per-tissue sample attribute files (<tissue>_sample.csv or <tissue>.csv), used with --expFolder.
+        --sampleMap      tab-separated file of tissue and sample attribute file, used with --expFolder.
+        --outFolder      folder to write per-tissue results and the combined table, used with --expFolder.
+        --processes      number of tissues run at once (default: bounded by cores and available memory).
+        --fdrcutoff      FDR cutoff of sex-biased enhancers (default: 0.05).
+        --engine         GLM engine, statsmodels (default): one statsmodels fit per enhancer; irls: all enhancers fitted together by batched IRLS.
+        --blockSize      read the expression matrix this many enhancers at a time (out-of-core mode); by default it is read at once.
+        --prefilter      none (default): fit the GLM for every enhancer; score: fit only enhancers with abs(log2(FC)) > 1, score-test the rest for the FDR (approximate Wald/score FDRs, not identical to none); fc: as score, with p-value 1 for the rest (conservative FDR).
+        --format         format of the results, csv (default): tab-separated text; parquet: Parquet table of typed columns (.parquet added to the file names written with --expFolder).
+        --spillFile      file to keep the unfiltered statistics of every enhancer in out-of-core mode (default: a temporary file).
+        --progress       print the progress of long stages, with ETA, to stderr.
+        --report         JSON file to write the wall time, CPU time, peak memory and throughput of every stage.
+        --profile        run the stages under cProfile; the top functions go to the report (or to stderr without --report).
+        """)
+    print()
+    print('Example: python diffExp.py  --expFile Spleen_RPM.csv --sampleFile Spleen_sample.csv --tissue Spleen --outFile sexBiasedEnhancer')
+    print('Example: python diffExp.py  --expFile Spleen_RPM.csv --sampleFile Spleen_sample.csv --tissue Spleen --outFile sexBiasedEnhancer --blockSize 20000')
+    print('Example: python diffExp.py  --expFolder eRNA_RPM/ --sampleFolder samples/ --outFolder sexBiasedEnhancers/ --processes 8')
+    
+
+def main(argv):
+    param = argv
+    try:
+        opts, args = getopt.getopt(param, '-h', ['expFile=', 'sampleFile=', 'tissue=', 'outFile=', 'engine=',
+                                                 'expFolder=', 'sampleFolder=', 'sampleMap=', 'outFolder=', 'processes=', 'fdrcutoff=',
+                                                 'blockSize=', 'spillFile=', 'prefilter=', 'format=', 'progress', 'report=', 'profile'])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+        
+    engine = 'statsmodels'
+    expFolder = None
+    sampleFolder = None
+    sampleMap = None
+    processes = None
+    fdr_cutoff = 0.05
+    block_size = None
+    spillFile = None
+    prefilter = 'none'
+    outFormat = 'csv'
+    progress = False
+    reportFile = None
+    profile = False
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit(2)
+        elif opt == '--expFile':
+            expFile = str(arg)
+        elif opt == '--sampleFile':
+            sampleFile = str(arg)
+        elif opt == '--tissue':
+            tissue = str(arg)
+        elif opt == '--outFile':
+            outFile = str(arg)  
+        elif opt == '--engine':
+            engine = str(arg)
+        elif opt == '--expFolder':
+            expFolder = str(arg)
+        elif opt == '--sampleFolder':
+            sampleFolder = str(arg)
+        elif opt == '--sampleMap':
+            sampleMap = str(arg)
+        elif opt == '--outFolder':
+            outFolder = str(arg)
+        elif opt == '--processes':
+            processes = int(arg)
+        elif opt == '--fdrcutoff':
+            fdr_cutoff = float(arg)
+        elif opt == '--blockSize':
+            block_size = int(arg)
+        elif opt == '--spillFile':
+            spillFile = str(arg)
+        elif opt == '--prefilter':
+            prefilter = str(arg)
+            if prefilter not in PREFILTERS:
+                usage()
+                sys.exit(2)
+        elif opt == '--format':
+            outFormat = str(arg)
+            if outFormat not in tableIO.FORMATS:
+                usage()
+                sys.exit(2)
+        elif opt == '--progress':
+            progress = True
+        elif opt == '--report':
+            reportFile = str(arg)
+        elif opt == '--profile':
+            profile = True
+    
+    instrument.configure(progress, reportFile, profile)
+
+    if expFolder:
+        failed = diff_exp_tissues(expFolder,
+                                  outFolder,
+                                  sampleFolder,
+                                  sampleMap,
+                                  processes,
+                                  engine,
+                                  fdr_cutoff,
+                                  block_size,
+                                  prefilter,
+                                  outFormat)
+        if failed:
+            sys.exit(1)
+    else:
+        diff_exp(expFile,
+                 sampleFile,
+                 tissue,
+                 outFile,
+                 engine,
+                 fdr_cutoff,
+                 block_size,
+                 spillFile,
+                 prefilter,
+                 outFormat)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
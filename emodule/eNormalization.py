@@ -0,0 +1,665 @@
+import os
+import sys, getopt
+import json
+import hashlib
+import tempfile
+import pandas as pd
+import numpy as np
+from . import expStore
+from . import instrument
+from . import prefetch
+from . import tableIO
+
+
+#read enhancer annotation
+def read_enhancer(annoFile):
+    enhancer_index = []
+    lengths = {}
+    with open(annoFile) as f:
+        for line in f:
+            chr, start, end = line.strip().split('\t')
+            length = int(end) - int(start) + 1
+            enhancer = '%s:%s-%s' % (chr, start, end)
+            enhancer_index.append(enhancer)
+            lengths[enhancer] = length
+    return enhancer_index, lengths
+
+
+#enhancer index and lengths of enhancer loci (chr:start-end), as read_enhancer returns them
+def loci_lengths(loci):
+    enhancer_index = list(loci)
+    lengths = {}
+    for enhancer in enhancer_index:
+        start, end = enhancer.split(':')[1].split('-')
+        lengths[enhancer] = int(end) - int(start) + 1
+    return enhancer_index, lengths
+
+
+#read tissues and samples
+def read_sample(sampleFile):
+    tissue_samples = {}
+    all_samples = set()
+    with open(sampleFile) as f:
+        f.readline()
+        for line in f:
+            cols = line.split('\t')
+            tissue = cols[0]
+            sample = cols[1]
+            if tissue not in tissue_samples:
+                tissue_samples[tissue] = []
+            tissue_samples[tissue].append(sample)
+            all_samples.add(sample)
+    return tissue_samples, all_samples
+    
+
+#Read counts are held as one enhancer x sample block of unsigned 32-bit integers, column-major
+#so that every sample is contiguous (64-bit only if a count does not fit). The steps below work
+#one sample column at a time and never copy the whole block.
+UINT32_MAX = np.iinfo(np.uint32).max
+
+
+#enhancer x sample block of read counts, filled from an iterable of per-sample count arrays
+def counts_block(columns, nrows, ncols):
+    block = np.empty((nrows, ncols), dtype=np.uint32, order='F')
+    for i, counts in enumerate(columns):
+        if block.dtype == np.uint32 and len(counts) and counts.max() > UINT32_MAX:
+            block = block.astype(np.int64, order='F')
+        block[:, i] = counts
+    return block
+
+
+#dataframe view of a count block, with enhancer as index, and sample as column
+def counts_frame(block, enhancer_index, samples):
+    return pd.DataFrame(block, index=enhancer_index, columns=samples, copy=False)
+
+
+#count array of one sample, in the narrowest type of the block
+def column_counts(values):
+    counts = np.array(values, dtype=np.int64)
+    if len(counts) == 0 or counts.max() <= UINT32_MAX:
+        return counts.astype(np.uint32)
+    return counts
+
+
+#read eRNA expression; the next prefetch_depth sample files are read by threads while one is parsed
+def read_enhancerExp(enhancer_index, 
+                     lengths, 
+                     all_samples, 
+                     expFolder,
+                     prefetch_depth=prefetch.DEPTH):
+    sampleIDs = []
+    sampleFiles = []
+    for tissue in os.listdir(expFolder):
+        print(tissue)
+        for sampleFile in os.listdir(expFolder+tissue):
+            sampleID = sampleFile[sampleFile.find('GTEX-'):(sampleFile.find('.ALL.bw')-2)]
+            if sampleID in all_samples:
+                sampleIDs.append(sampleID)
+                sampleFiles.append(expFolder+tissue+'/'+sampleFile)
+
+    sample_counts = {}
+    with instrument.stage('read_enhancerExp', total=len(sampleFiles), unit='samples'):
+        texts = prefetch.iter_prefetch(prefetch.read_text, sampleFiles, prefetch_depth)
+        for i, (sampleFile, text) in enumerate(texts):
+            this_sample_counts = {}
+            for line in text.split('\n'):
+                cols = line.split('\t')
+                if cols[0] in lengths:
+                    this_sample_counts[cols[0]] = round(float(cols[1]) * lengths[cols[0]])
+            sample_counts[sampleIDs[i]] = column_counts([this_sample_counts[enhancer] for enhancer in enhancer_index])
+            instrument.advance()
+    return sample_counts
+
+
+#convert per-sample read counts to a dataframe with enhancer as index, and sample as column
+def counts_dataframe(enhancer_index, sample_counts):
+    sampleList = list(sample_counts.keys())
+    block = counts_block((sample_counts[sample] for sample in sampleList), len(enhancer_index), len(sampleList))
+    return counts_frame(block, enhancer_index, sampleList)
+
+
+def enhancer_lengths(enhancer_index, lengths):
+    return np.array([lengths[enhancer] for enhancer in enhancer_index], dtype=np.float64)
+
+
+#per-base averages (enhancer x sample) to a count block, one column at a time; rows and columns
+#pick the enhancer rows and sample columns of the averages (all if None)
+def average_to_counts(enhancer_index, lengths, averages, scale=1, rows=None, columns=None):
+    enhancer_length = enhancer_lengths(enhancer_index, lengths)
+    if columns is None:
+        columns = range(averages.shape[1])
+
+    def sample_counts():
+        for i in columns:
+            values = averages[:, i] if rows is None else averages[:, i][rows]
+            if scale != 1:
+                values = expStore.decode_values(values, scale)
+            yield np.round(values * enhancer_length).astype(np.int64)
+
+    return counts_block(sample_counts(), len(enhancer_index), len(columns))
+
+
+#rows of the enhancer annotation in another enhancer list, None if the order is the same
+def enhancer_rows(enhancers, enhancer_index, source):
+    if list(enhancers) == enhancer_index:
+        return None
+    rows = pd.Index(enhancers).get_indexer(enhancer_index)
+    if (rows < 0).any():
+        raise KeyError('%d annotated enhancers are not in %s' % ((rows < 0).sum(), source))
+    return rows
+
+
+#read eRNA expression from the enhancer x sample matrix written by calculateExp.py --bwList (text or
+#Parquet); only the columns of the samples are read
+def read_enhancerExp_matrix(enhancer_index,
+                            lengths,
+                            all_samples,
+                            expMatrix):
+    with instrument.stage('read_enhancerExp_matrix', unit='samples'):
+        exp_df = tableIO.read_matrix(expMatrix, columns=all_samples, sep='\t')
+        counts_df = averages_counts(enhancer_index, lengths, exp_df, source=expMatrix)
+        instrument.advance(counts_df.shape[1])
+    return counts_df
+
+
+#read counts (enhancer x sample dataframe) of an enhancer x sample dataframe of per-base averages,
+#e.g. that of calculateExp.exp_frame
+def averages_counts(enhancer_index, lengths, exp_df, source='the expression matrix'):
+    rows = enhancer_rows(exp_df.index, enhancer_index, source)
+    counts = average_to_counts(enhancer_index, lengths, exp_df.values, rows=rows)
+    return counts_frame(counts, enhancer_index, list(exp_df.columns))
+
+
+#read eRNA expression from the binary store written by calculateExp.py --outFormat store
+def read_enhancerExp_store(enhancer_index,
+                           lengths,
+                           all_samples,
+                           expStorePrefix):
+    enhancers, samples, matrix, scale = expStore.read_exp_store(expStorePrefix)
+    columns = [i for i, sample in enumerate(samples) if sample in all_samples]
+    rows = enhancer_rows(enhancers, enhancer_index, expStorePrefix)
+    with instrument.stage('read_enhancerExp_store', total=len(columns), unit='samples'):
+        counts = average_to_counts(enhancer_index, lengths, matrix, scale, rows, columns)
+    return counts_frame(counts, enhancer_index, [samples[i] for i in columns])
+
+
+#TMM scaling factor of one sample against the reference sample, as edgeR's .calcFactorTMM
+def calc_factor_tmm(obs,
+                    ref,
+                    libsize_obs,
+                    libsize_ref,
+                    logratioTrim=0.3,
+                    sumTrim=0.05,
+                    doWeighting=True,
+                    Acutoff=-1e10):
+    obs = np.asarray(obs, dtype=np.float64)
+    ref = np.asarray(ref, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logR = np.log2((obs / libsize_obs) / (ref / libsize_ref))
+        absE = (np.log2(obs / libsize_obs) + np.log2(ref / libsize_ref)) / 2
+        v = (libsize_obs - obs) / libsize_obs / obs + (libsize_ref - ref) / libsize_ref / ref
+
+    #remove infinite values, cutoff based on A
+    fin = np.isfinite(logR) & np.isfinite(absE) & (absE > Acutoff)
+    logR = logR[fin]
+    absE = absE[fin]
+    v = v[fin]
+    if len(logR) == 0 or np.max(np.abs(logR)) < 1e-6:
+        return 1.0
+
+    #trim the M and A values
+    n = len(logR)
+    loL = np.floor(n * logratioTrim) + 1
+    hiL = n + 1 - loL
+    loS = np.floor(n * sumTrim) + 1
+    hiS = n + 1 - loS
+    from scipy.stats import rankdata
+    rankR = rankdata(logR)
+    rankE = rankdata(absE)
+    keep = (rankR >= loL) & (rankR <= hiL) & (rankE >= loS) & (rankE <= hiS)
+
+    if doWeighting:
+        f = np.nansum(logR[keep] / v[keep]) / np.nansum(1 / v[keep])
+    else:
+        f = np.nanmean(logR[keep])
+    if np.isnan(f):
+        f = 0
+    return 2 ** f
+
+
+#enhancers with a non-zero count in some sample, and the library size of every sample
+def expressed_rows(counts):
+    nsamples = counts.shape[1]
+    lib_size = np.array([counts[:, i].sum(dtype=np.int64) for i in range(nsamples)], dtype=np.float64)
+    expressed = np.zeros(counts.shape[0], dtype=bool)
+    for i in range(nsamples):
+        expressed |= counts[:, i] > 0
+    return expressed, lib_size
+
+
+#reference sample (column) of TMM, as edgeR: the upper quartile closest to the mean upper quartile
+def reference_column(counts):
+    counts = np.asarray(counts)
+    expressed, lib_size = expressed_rows(counts)
+    nsamples = counts.shape[1]
+    if not expressed.any():
+        return 0
+    f75 = np.array([np.quantile(counts[:, i][expressed], 0.75) for i in range(nsamples)]) / lib_size
+    if np.median(f75) < 1e-20:
+        return int(np.argmax([np.sqrt(counts[:, i][expressed]).sum() for i in range(nsamples)]))
+    return int(np.argmin(np.abs(f75 - f75.mean())))
+
+
+#TMM normalization factors of every sample (column), as edgeR's calcNormFactors(method='TMM');
+#the reference sample is chosen as edgeR does unless refColumn is given
+def calc_norm_factors(counts,
+                      logratioTrim=0.3,
+                      sumTrim=0.05,
+                      doWeighting=True,
+                      Acutoff=-1e10,
+                      refColumn=None):
+    counts = np.asarray(counts)
+    nsamples = counts.shape[1]
+
+    #enhancers with zero counts in every sample are ignored
+    expressed, lib_size = expressed_rows(counts)
+    if not expressed.any() or nsamples == 1:
+        return np.ones(nsamples)
+
+    def sample_counts(i):
+        return counts[:, i][expressed]
+
+    if refColumn is None:
+        refColumn = reference_column(counts)
+
+    ref = sample_counts(refColumn)
+    factors = np.empty(nsamples)
+    for i in range(nsamples):
+        factors[i] = calc_factor_tmm(sample_counts(i),
+                                     ref,
+                                     lib_size[i],
+                                     lib_size[refColumn],
+                                     logratioTrim,
+                                     sumTrim,
+                                     doWeighting,
+                                     Acutoff)
+        instrument.advance()
+
+    #factors multiply to one
+    return factors / np.exp(np.mean(np.log(factors)))
+
+
+#TMM normalization in python; returns the same counts as the edgeR path and the normalization factors
+def tmm_python(counts_df, refColumn=None):
+    norm_factors = pd.Series(calc_norm_factors(counts_df.values, refColumn=refColumn), index=counts_df.columns)
+    return counts_df, norm_factors
+
+
+#TMM normalization with edgeR through rpy2 (the default engine)
+def tmm_edgeR(counts_df, refColumn=None):
+    from rpy2.robjects import r, pandas2ri, NULL
+    pandas2ri.activate()
+    r.source(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmm.r'))
+
+    #convert to R dataframe
+    counts_df_r = pandas2ri.py2rpy(counts_df.astype(np.int64))
+
+    tmpFolder = tempfile.mkdtemp()
+    outFile = os.path.join(tmpFolder, 'TMM_read_counts.csv')
+    try:
+        r.tmm_nor(counts_df_r, outFile)
+        #read TMM-normalized read counts
+        counts_tmm = pd.read_csv(outFile, index_col=0)
+    finally:
+        if os.path.exists(outFile):
+            os.remove(outFile)
+        os.rmdir(tmpFolder)
+    norm_factors = pd.Series(np.asarray(r.tmm_factors(counts_df_r, NULL if refColumn is None else refColumn + 1)),
+                             index=counts_df.columns)
+    return counts_tmm, norm_factors
+
+
+#RPM of the samples of one tissue, computed one sample column at a time, with the enhancers of
+#median RPM >= 1; lib_sizes caches the library size of every sample across tissues
+def tissue_rpm(counts_tmm,
+               samples,
+               lib_sizes=None):
+    #normalized by reads per million (RPM) method
+    constant = 1000000
+    if lib_sizes is None:
+        lib_sizes = {}
+
+    counts_rpm_tissue = np.empty((counts_tmm.shape[0], len(samples)), dtype=np.int32, order='F')
+    for i, sample in enumerate(samples):
+        counts = counts_tmm[sample].values
+        if sample not in lib_sizes:
+            lib_sizes[sample] = int(counts.sum(dtype=np.int64))
+        counts_rpm_tissue[:, i] = np.round((counts / lib_sizes[sample]) * constant)
+    
+    medians = np.median(counts_rpm_tissue, axis=1)
+    
+    keep = medians >= 1
+
+    return pd.DataFrame(counts_rpm_tissue[keep], index=counts_tmm.index[keep], columns=samples)
+
+
+#RPM of every tissue written to <tissue>.csv (or <tissue>.parquet); only one tissue is held at a time
+def write_tissue_rpm(counts_tmm,
+                     tissue_samples,
+                     outFolder,
+                     outFormat='csv',
+                     lib_sizes=None):
+    if lib_sizes is None:
+        lib_sizes = {}
+
+    #export csv file for each tissue
+    with instrument.stage('rpm', total=len(tissue_samples), unit='tissues'):
+        for tissue in tissue_samples:
+            counts_rpm_tissue = tissue_rpm(counts_tmm, tissue_samples[tissue], lib_sizes)
+            
+            tableIO.write_table(counts_rpm_tissue, outFolder + tableIO.matrix_file(tissue, outFormat), outFormat)
+            instrument.advance()
+
+
+#TMM normalization by the python or the edgeR engine; refColumn is the reference sample, by default
+#chosen as edgeR does
+def tmm_normalize(counts_df, tmm='edgeR', refColumn=None):
+    with instrument.stage('tmm', total=counts_df.shape[1], unit='samples'):
+        if tmm == 'edgeR':
+            return tmm_edgeR(counts_df, refColumn)
+        return tmm_python(counts_df, refColumn)
+
+
+#enhancer expression normalization
+def normalize_exp(counts_df,
+                  tissue_samples,
+                  outFolder,
+                  tmm='edgeR',
+                  outFormat='csv'):    
+    #TMM normalization
+    counts_tmm, norm_factors = tmm_normalize(counts_df, tmm)
+
+    write_tissue_rpm(counts_tmm, tissue_samples, outFolder, outFormat)
+    return norm_factors
+
+
+#enhancer expression normalization in memory; returns the RPM dataframe of every tissue and the TMM factors
+def normalize_counts(counts_df,
+                     tissue_samples,
+                     tmm='edgeR'):
+    counts_tmm, norm_factors = tmm_normalize(counts_df, tmm)
+
+    lib_sizes = {}
+    tissue_exp = {}
+    with instrument.stage('rpm', total=len(tissue_samples), unit='tissues'):
+        for tissue in tissue_samples:
+            tissue_exp[tissue] = tissue_rpm(counts_tmm, tissue_samples[tissue], lib_sizes)
+            instrument.advance()
+    return tissue_exp, norm_factors
+
+
+#Incremental normalization keeps its state in a folder:
+#  state.json   the enhancer annotation hash, the ingested batches, every sample's batch, column and
+#               library size, the TMM reference sample and every sample's unscaled factor against
+#               it, the TMM factors of the cohort, and the samples of every tissue at its last output
+#  batch_<n>.*  raw read counts of the samples ingested by one run (an expStore with scale 1)
+#A run reads only samples that are not in the state yet, and rewrites only the tissues whose
+#sample set changed. The RPM of a sample depends on its own counts and library size only, so the
+#output of a tissue is the same as that of a full run over the cohort.
+#The TMM factor of a sample against a given reference depends on the two samples only (enhancers
+#with no counts in either are left out by the trimming anyway), so the reference is chosen in the
+#first batch, as edgeR does, and kept: a new batch is compared with the reference column alone, and
+#the factors of the cohort are the unscaled factors rescaled to a geometric mean of one. They equal
+#those of a full run with that reference sample (refColumn), without reading the cohort again, but
+#they can differ from those of a full run that picks its reference among all samples. state.json
+#records the reference and the batch it was chosen from (tmm.reference, tmm.reference_batch).
+
+def enhancers_hash(enhancer_index):
+    return hashlib.sha256('\n'.join(enhancer_index).encode()).hexdigest()
+
+
+def read_state(stateFolder, enhancer_index):
+    stateFile = os.path.join(stateFolder, 'state.json')
+    if not os.path.exists(stateFile):
+        return {'enhancers': enhancers_hash(enhancer_index),
+                'batches': [],
+                'samples': {},
+                'tmm': {'engine': None, 'reference': None, 'reference_batch': None, 'factors': {}},
+                'norm_factors': {},
+                'tissues': {}}
+    with open(stateFile) as f:
+        state = json.load(f)
+    if state['enhancers'] != enhancers_hash(enhancer_index):
+        raise ValueError('%s was built with another enhancer annotation' % stateFolder)
+    return state
+
+
+def write_state(stateFolder, state):
+    stateFile = os.path.join(stateFolder, 'state.json')
+    with open(stateFile + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(stateFile + '.tmp', stateFile)
+
+
+#persist the raw counts of newly read samples as a new batch
+def ingest_samples(stateFolder, state, counts_df):
+    batch = 'batch_%d' % len(state['batches'])
+    counts = counts_df.values
+    dtype = np.uint32 if counts.size == 0 or (counts.min() >= 0 and counts.max() <= np.iinfo(np.uint32).max) else np.int64
+    expStore.write_exp_store(os.path.join(stateFolder, batch),
+                             list(counts_df.index),
+                             list(counts_df.columns),
+                             counts,
+                             dtype=dtype,
+                             scale=1)
+    lib_sizes = counts.sum(axis=0)
+    for i, sample in enumerate(counts_df.columns):
+        state['samples'][sample] = {'batch': batch, 'column': i, 'lib_size': int(lib_sizes[i])}
+    state['batches'].append(batch)
+
+
+#raw counts of the given samples from the persisted batches (enhancer x sample dataframe)
+def stored_counts(stateFolder, state, enhancer_index, samples):
+    stores = {}
+    columns = []
+    for sample in samples:
+        batch = state['samples'][sample]['batch']
+        if batch not in stores:
+            stores[batch] = expStore.read_exp_store(os.path.join(stateFolder, batch))[2]
+        columns.append(stores[batch][:, state['samples'][sample]['column']])
+    return counts_frame(counts_block(columns, len(enhancer_index), len(columns)), enhancer_index, list(samples))
+
+
+#update the TMM factors of the state with the samples of a new batch (counts_df), against the
+#reference sample of the state; the stored counts are read only for the reference sample, and for
+#every sample when the engine changed. The reference is chosen from the first batch and kept, so
+#the factors are fixed to it and can differ from those of a full run over the cohort.
+def update_norm_factors(stateFolder, state, enhancer_index, counts_df, tmm='edgeR'):
+    tmm_state = state.get('tmm') or {'engine': None, 'reference': None, 'reference_batch': None, 'factors': {}}
+    if tmm_state['engine'] != tmm:
+        tmm_state = {'engine': tmm, 'reference': tmm_state['reference'],
+                     'reference_batch': tmm_state.get('reference_batch'), 'factors': {}}
+    reference = tmm_state['reference']
+    if reference is None:
+        reference = counts_df.columns[reference_column(counts_df.values)]
+        tmm_state['reference_batch'] = state['samples'][reference]['batch']
+    pending = [sample for sample in state['samples'] if sample not in tmm_state['factors'] and sample != reference]
+
+    columns = [reference] + pending
+    frames = [counts_df[[sample for sample in columns if sample in counts_df.columns]]]
+    stored = [sample for sample in columns if sample not in counts_df.columns]
+    if stored:
+        frames.append(stored_counts(stateFolder, state, enhancer_index, stored))
+    counts_tmm, norm_factors = tmm_normalize(pd.concat(frames, axis=1)[columns], tmm, refColumn=0)
+
+    #factors against the reference (its own factor is one before the rescaling)
+    tmm_state['reference'] = reference
+    tmm_state['factors'][reference] = 1.0
+    for sample in pending:
+        tmm_state['factors'][sample] = float(norm_factors[sample] / norm_factors[reference])
+    state['tmm'] = tmm_state
+
+    samples = list(state['samples'])
+    factors = np.array([tmm_state['factors'][sample] for sample in samples])
+    factors /= np.exp(np.mean(np.log(factors)))
+    state['norm_factors'] = dict((sample, float(factor)) for sample, factor in zip(samples, factors))
+
+
+#incremental enhancer expression normalization; read_counts(samples) returns the counts dataframe of
+#those samples found in the input. Returns the tissues that were written. The RPM output equals that
+#of normalize_exp over all samples; the TMM factors of the state (norm_factors) are fixed to the
+#reference sample chosen from the first batch.
+def normalize_incremental(enhancer_index,
+                          tissue_samples,
+                          all_samples,
+                          read_counts,
+                          outFolder,
+                          stateFolder,
+                          tmm='edgeR',
+                          outFormat='csv'):
+    if not os.path.exists(stateFolder):
+        os.makedirs(stateFolder)
+    state = read_state(stateFolder, enhancer_index)
+
+    #read only the samples that are not in the state yet
+    new_samples = set(sample for sample in all_samples if sample not in state['samples'])
+    if new_samples:
+        counts_df = read_counts(new_samples)
+        if counts_df.shape[1] > 0:
+            ingest_samples(stateFolder, state, counts_df)
+            #TMM factors of the cohort, updated from the new batch and the reference sample
+            update_norm_factors(stateFolder, state, enhancer_index, counts_df, tmm)
+
+    #tissues whose sample set changed, or whose output is missing
+    changed = {}
+    for tissue in tissue_samples:
+        samples = [sample for sample in tissue_samples[tissue] if sample in state['samples']]
+        if not samples:
+            continue
+        if state['tissues'].get(tissue) != samples or not os.path.exists(outFolder + tableIO.matrix_file(tissue, outFormat)):
+            changed[tissue] = samples
+
+    #library sizes were recorded when the samples were ingested
+    lib_sizes = dict((sample, state['samples'][sample]['lib_size']) for sample in state['samples'])
+    for tissue in changed:
+        counts_tmm = stored_counts(stateFolder, state, enhancer_index, changed[tissue])
+        write_tissue_rpm(counts_tmm, {tissue: changed[tissue]}, outFolder, outFormat, lib_sizes)
+        state['tissues'][tissue] = changed[tissue]
+
+    write_state(stateFolder, state)
+    return list(changed)
+
+
+def usage():
+    print("""Parameters:
+        --annoFile       enhancer_annotation_file. 
+        --sampleFile     sample_attribute_file. 
+        --expFolder      Path of enhancers' raw expression.
+        --expMatrix      enhancer x sample raw expression matrix written by calculateExp.py --bwList, text or Parquet (.parquet) (replaces --expFolder).
+        --expStore       binary raw expression store written by calculateExp.py --outFormat store (replaces --expFolder).
+        --outFolder      Output path to write enhancers' normalized expression.
+        --format         format of the normalized expression, csv (default): <tissue>.csv; parquet: <tissue>.parquet with integer columns.
+        --stateFolder    folder of the incremental normalization state; only new samples are read and only tissues whose samples changed are rewritten.
+        --tmm            TMM engine, edgeR (default): edgeR through rpy2; python: native implementation of edgeR's calcNormFactors, checked against edgeR by tests/test_tmm.py.
+        --prefetch       number of sample files of --expFolder read ahead by threads while one is parsed (default: 4; 0: no read-ahead).
+        --progress       print the progress of long stages, with ETA, to stderr.
+        --report         JSON file to write the wall time, CPU time, peak memory and throughput of every stage.
+        --profile        run the stages under cProfile; the top functions go to the report (or to stderr without --report).
+        """)
+    print()
+    print('Example: python eNormalization.py  --annoFile Ensembl_Fantom5_enhancers_nonOverlapGene --sampleFile sampleAttributes --expFolder eRNA_perbase_average/ --outFolder eRNA_RPM/')
+    print('Example: python eNormalization.py  --annoFile Ensembl_Fantom5_enhancers_nonOverlapGene --sampleFile sampleAttributes --expMatrix rawExpMatrix --outFolder eRNA_RPM/')
+
+    
+def main(argv):
+    param = argv
+    try:
+        opts, args = getopt.getopt(param, '-h', ['annoFile=', 'sampleFile=', 'expFolder=', 'expMatrix=', 'expStore=', 'outFolder=', 'tmm=', 'stateFolder=',
+                                                 'format=', 'prefetch=', 'progress', 'report=', 'profile'])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+        
+    expFolder = None
+    expMatrix = None
+    expStorePrefix = None
+    tmm = 'edgeR'
+    stateFolder = None
+    outFormat = 'csv'
+    prefetchDepth = prefetch.DEPTH
+    progress = False
+    reportFile = None
+    profile = False
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit(2)
+        elif opt == '--annoFile':
+            annoFile = str(arg)
+        elif opt == '--sampleFile':
+            sampleFile = str(arg)
+        elif opt == '--expFolder':
+            expFolder = str(arg)
+        elif opt == '--expMatrix':
+            expMatrix = str(arg)
+        elif opt == '--expStore':
+            expStorePrefix = str(arg)
+        elif opt == '--outFolder':
+            outFolder = str(arg)   
+        elif opt == '--tmm':
+            tmm = str(arg)
+        elif opt == '--stateFolder':
+            stateFolder = str(arg)
+        elif opt == '--format':
+            outFormat = str(arg)
+            if outFormat not in tableIO.FORMATS:
+                usage()
+                sys.exit(2)
+        elif opt == '--prefetch':
+            prefetchDepth = int(arg)
+        elif opt == '--progress':
+            progress = True
+        elif opt == '--report':
+            reportFile = str(arg)
+        elif opt == '--profile':
+            profile = True
+     
+    instrument.configure(progress, reportFile, profile)
+
+    if not os.path.exists(outFolder):
+        os.mkdir(outFolder)
+    
+    enhancer_index, lengths = read_enhancer(annoFile)
+
+    tissue_samples, all_samples = read_sample(sampleFile)
+    
+    #counts of the requested samples found in the input
+    def read_counts(samples):
+        if expStorePrefix:
+            return read_enhancerExp_store(enhancer_index, lengths, samples, expStorePrefix)
+        elif expMatrix:
+            return read_enhancerExp_matrix(enhancer_index, lengths, samples, expMatrix)
+        sample_counts = read_enhancerExp(enhancer_index, lengths, samples, expFolder, prefetchDepth)
+        return counts_dataframe(enhancer_index, sample_counts)
+
+    if stateFolder:
+        normalize_incremental(enhancer_index,
+                              tissue_samples,
+                              all_samples,
+                              read_counts,
+                              outFolder,
+                              stateFolder,
+                              tmm,
+                              outFormat)
+    else:
+        counts_df = read_counts(all_samples)
+
+        normalize_exp(counts_df,
+                      tissue_samples,
+                      outFolder,
+                      tmm,
+                      outFormat)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,88 @@
+import os
+import json
+import numpy as np
+
+
+#A store keeps an enhancer x sample matrix in binary form:
+#  <prefix>.npy        the matrix, column-major so that every sample is contiguous
+#  <prefix>.enhancers  enhancer loci, one per line
+#  <prefix>.samples    sample IDs, one per line
+#  <prefix>.json       dtype and the scale of the stored values
+#Per-base averages are stored as int32 in hundredths (scale 100), which holds the
+#two-decimal values of calculateExp.py exactly.
+
+
+def store_files(prefix):
+    return (prefix + '.npy',
+            prefix + '.enhancers',
+            prefix + '.samples',
+            prefix + '.json')
+
+
+def write_names(names, nameFile):
+    with open(nameFile, 'w') as f:
+        for name in names:
+            f.write(name+'\n')
+
+
+def read_names(nameFile):
+    names = []
+    with open(nameFile) as f:
+        for line in f:
+            names.append(line.rstrip('\n'))
+    return names
+
+
+#create an empty store and return the writable memory-mapped matrix
+def create_exp_store(prefix, enhancers, samples, dtype=np.int32, scale=100):
+    matrix_file, enhancer_file, sample_file, meta_file = store_files(prefix)
+    folder = os.path.dirname(matrix_file)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    write_names(enhancers, enhancer_file)
+    write_names(samples, sample_file)
+    with open(meta_file, 'w') as f:
+        json.dump({'dtype': np.dtype(dtype).name, 'scale': scale}, f)
+    return np.lib.format.open_memmap(matrix_file,
+                                     mode='w+',
+                                     dtype=dtype,
+                                     shape=(len(enhancers), len(samples)),
+                                     fortran_order=True)
+
+
+#encode one sample's values into a column of the store; integer dtypes hold values up to
+#iinfo(dtype).max / scale (about 2.1e7 for int32 hundredths), larger values raise instead of wrapping
+def encode_column(values, dtype=np.int32, scale=100):
+    values = np.asarray(values, dtype=np.float64)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        encoded = np.rint(values * scale)
+        info = np.iinfo(dtype)
+        if encoded.size and (encoded.min() < info.min or encoded.max() > info.max):
+            raise ValueError('values from %g to %g do not fit in %s with scale %g' % (values.min(), values.max(),
+                                                                                     np.dtype(dtype).name, scale))
+        return encoded.astype(dtype)
+    return (values * scale).astype(dtype)
+
+
+def write_exp_store(prefix, enhancers, samples, exp_matrix, dtype=np.int32, scale=100):
+    matrix = create_exp_store(prefix, enhancers, samples, dtype, scale)
+    for i in range(len(samples)):
+        matrix[:, i] = encode_column(exp_matrix[:, i], dtype, scale)
+    matrix.flush()
+    del matrix
+
+
+#open a store; the matrix is memory-mapped read-only unless mmap is False
+def read_exp_store(prefix, mmap=True):
+    matrix_file, enhancer_file, sample_file, meta_file = store_files(prefix)
+    with open(meta_file) as f:
+        meta = json.load(f)
+    matrix = np.load(matrix_file, mmap_mode='r' if mmap else None)
+    enhancers = read_names(enhancer_file)
+    samples = read_names(sample_file)
+    return enhancers, samples, matrix, meta['scale']
+
+
+#decode stored values back to float64, e.g. hundredths to per-base averages
+def decode_values(values, scale):
+    return np.asarray(values, dtype=np.float64) / scale
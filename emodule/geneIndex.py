@@ -0,0 +1,174 @@
+import os
+import re
+import sys, getopt
+import gzip
+import json
+import numpy as np
+
+
+#Genomic interval index: per chromosome, intervals sorted by start in numpy arrays.
+#A point query looks only at intervals starting within the longest interval length
+#before the point, found by binary search, so it costs O(log n + k).
+
+
+#build the index from (chrom, start, end, name) tuples
+def build_interval_index(intervals):
+    chrom_intervals = {}
+    for chrom, start, end, name in intervals:
+        if chrom not in chrom_intervals:
+            chrom_intervals[chrom] = []
+        chrom_intervals[chrom].append((start, end, name))
+
+    index = {}
+    for chrom in chrom_intervals:
+        chrom_intervals[chrom].sort()
+        starts = np.array([t[0] for t in chrom_intervals[chrom]], dtype=np.int64)
+        ends = np.array([t[1] for t in chrom_intervals[chrom]], dtype=np.int64)
+        names = [t[2] for t in chrom_intervals[chrom]]
+        index[chrom] = (starts, ends, names, int((ends - starts).max()))
+    return index
+
+
+#names of the intervals strictly containing each point (start < pos < end); returns one list of
+#names per query point
+def query_points(index, chroms, positions):
+    positions = np.asarray(positions, dtype=np.int64)
+    chroms = np.asarray(chroms)
+    results = [[] for i in range(len(positions))]
+    for chrom in np.unique(chroms):
+        if chrom not in index:
+            continue
+        starts, ends, names, max_length = index[chrom]
+        queries = np.flatnonzero(chroms == chrom)
+        pos = positions[queries]
+        los = np.searchsorted(starts, pos - max_length, side='right')
+        his = np.searchsorted(starts, pos, side='left')
+        for query, p, lo, hi in zip(queries.tolist(), pos.tolist(), los.tolist(), his.tolist()):
+            hits = np.flatnonzero(ends[lo:hi] > p) + lo
+            results[query] = [names[i] for i in hits.tolist()]
+    return results
+
+
+#window of +/- window bases around every gene start, as intervals for the index
+def gene_windows(genes, window=1000000):
+    intervals = []
+    for chrom, start, gene_symbol in genes:
+        intervals.append((chrom, start - window, start + window, gene_symbol))
+    return intervals
+
+
+#The gene table of a gtf file (chrom, start, end, strand, symbol, biotype of every gene) is
+#cached next to the gtf file as <gtfFile>.genes.npz. The cache records the path, size and
+#modification time of the gtf file and is rebuilt when any of them change.
+GENE_COLUMNS = ['chrom', 'start', 'end', 'strand', 'symbol', 'biotype']
+
+
+def open_gtf(gtfFile):
+    if gtfFile.endswith('.gz'):
+        return gzip.open(gtfFile, 'rt')
+    return open(gtfFile)
+
+
+#parse every gene line of a gtf file into columns
+def parse_gtf(gtfFile):
+    table = dict((column, []) for column in GENE_COLUMNS)
+    name_pattern = re.compile('gene_name "(.+?)"')
+    id_pattern = re.compile('gene_id "(.+?)"')
+    biotype_pattern = re.compile('gene_(?:bio)?type "(.+?)"')
+    with open_gtf(gtfFile) as f:
+        for line in f:
+            if '\tgene\t' not in line or line.startswith('#'):
+                continue
+            cols = line.rstrip('\n').split('\t')
+            if cols[2] != 'gene':
+                continue
+            symbol = name_pattern.search(cols[8]) or id_pattern.search(cols[8])
+            biotype = biotype_pattern.search(cols[8])
+            table['chrom'].append(cols[0])
+            table['start'].append(int(cols[3]))
+            table['end'].append(int(cols[4]))
+            table['strand'].append(cols[6])
+            table['symbol'].append(symbol.group(1) if symbol else '')
+            table['biotype'].append(biotype.group(1) if biotype else '')
+
+    gene_table = {}
+    for column in GENE_COLUMNS:
+        if column in ('start', 'end'):
+            gene_table[column] = np.array(table[column], dtype=np.int64)
+        else:
+            gene_table[column] = np.array(table[column], dtype=str)
+    return gene_table
+
+
+def default_cache_file(gtfFile):
+    return gtfFile + '.genes.npz'
+
+
+def gtf_key(gtfFile):
+    stat = os.stat(gtfFile)
+    return json.dumps([os.path.abspath(gtfFile), stat.st_size, stat.st_mtime_ns])
+
+
+#parse the gtf file and write the gene table cache; returns the gene table
+def build_gene_cache(gtfFile, cacheFile=None):
+    if cacheFile is None:
+        cacheFile = default_cache_file(gtfFile)
+    key = gtf_key(gtfFile)
+    gene_table = parse_gtf(gtfFile)
+    tmpFile = '%s.%d.tmp' % (cacheFile, os.getpid())
+    with open(tmpFile, 'wb') as f:
+        np.savez(f, key=np.array(key), **gene_table)
+    os.replace(tmpFile, cacheFile)
+    return gene_table
+
+
+#gene table of a gtf file, from the cache when it matches the gtf file
+def load_gene_table(gtfFile, cacheFile=None):
+    if cacheFile is None:
+        cacheFile = default_cache_file(gtfFile)
+    if os.path.exists(cacheFile):
+        try:
+            with np.load(cacheFile) as cache:
+                if str(cache['key']) == gtf_key(gtfFile):
+                    return dict((column, cache[column]) for column in GENE_COLUMNS)
+        except (OSError, ValueError, KeyError):
+            pass
+    try:
+        return build_gene_cache(gtfFile, cacheFile)
+    except OSError:
+        #the cache cannot be written, e.g. a read-only folder
+        return parse_gtf(gtfFile)
+
+
+def usage():
+    print("""Parameters:
+        --gtfFile         Gene GTF file. This file can be downloaded from Ensembl.
+        --gtfCache        Cache file to write (default: <gtfFile>.genes.npz).
+        """)
+    print()
+    print('Example: python geneIndex.py  --gtfFile Homo_sapiens.GRCh38.101.gtf')
+
+
+def main(argv):
+    param = argv
+    try:
+        opts, args = getopt.getopt(param, '-h', ['gtfFile=', 'gtfCache='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    gtfCache = None
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit(2)
+        elif opt == '--gtfFile':
+            gtfFile = str(arg)
+        elif opt == '--gtfCache':
+            gtfCache = str(arg)
+
+    build_gene_cache(gtfFile, gtfCache)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
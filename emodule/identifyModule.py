@@ -0,0 +1,900 @@
+import os
+import json
+import pandas as pd
+import numpy as np
+import sys, getopt
+import multiprocessing
+from . import geneIndex
+from . import tfbsReader
+from . import tableIO
+from . import instrument
+
+
+#enhancer expression (csv or Parquet), only of the given enhancers if any
+def read_enhancer_exp(eExpCsv, enhancers=None):
+    eExp_df = tableIO.read_matrix(eExpCsv, rows=enhancers)
+    return eExp_df
+    
+    
+#gene expression (csv or Parquet), only of the given genes if any
+def read_gene_exp(gExpCsv, genes=None):
+    gExp_df = tableIO.read_matrix(gExpCsv, rows=genes)
+    return gExp_df
+    
+    
+def merge_exp(eExp_df, gExp_df):
+    common_columns = eExp_df.columns.intersection(gExp_df.columns)
+    merged_exp_df = pd.concat([eExp_df[common_columns], gExp_df[common_columns]])
+    return merged_exp_df
+    
+  
+#enhancers' binding TFs, only for the given enhancers if any
+def read_eTFBS(eTFBS_file, tfcutoff, enhancers=None):
+    eTFBS = tfbsReader.read_tfbs(eTFBS_file, tfcutoff, enhancers)
+    return tfbsReader.tfbs_sets(eTFBS, enhancers)
+    
+    
+#genes' binding TFs, only for the given genes if any
+def read_gTFBS(gTFBS_file, tfcutoff, genes=None):
+    gTFBS = tfbsReader.read_tfbs(gTFBS_file, tfcutoff, genes)
+    return tfbsReader.tfbs_sets(gTFBS, genes)
+    
+
+def read_enhancer(eFile):
+    enhancers = []
+    with open(eFile) as f:
+        for line in f:
+            enhancers.append(line.strip())
+    return enhancers
+
+    
+#protein-coding genes of the gtf file as (chrom, start, gene_symbol), read from the gene table cache
+def read_genes(gtfFile, gtfCache=None):
+    gene_table = geneIndex.load_gene_table(gtfFile, gtfCache)
+    coding = gene_table['biotype'] == 'protein_coding'
+    chroms = gene_table['chrom'][coding].tolist()
+    starts = gene_table['start'][coding].tolist()
+    symbols = gene_table['symbol'][coding].tolist()
+    genes = []
+    for chrom, start, gene_symbol in zip(chroms, starts, symbols):
+        genes.append(('chr'+chrom, start, gene_symbol))
+    return genes
+
+
+#genes whose start is within window bases of the enhancer start
+def obtain_near_gene(enhancers, gtfFile, window=1000000, gtfCache=None):
+    with instrument.stage('obtain_near_gene', total=len(enhancers), unit='enhancers'):
+        genes = read_genes(gtfFile, gtfCache)
+        index = geneIndex.build_interval_index(geneIndex.gene_windows(genes, window))
+
+        chroms = []
+        eStarts = []
+        for enhancer in enhancers:
+            chrom, locus = enhancer.split(':')
+            chroms.append(chrom)
+            eStarts.append(int(locus.split('-')[0]))
+
+        near_genes = {}
+        for enhancer, gene_symbols in zip(enhancers, geneIndex.query_points(index, chroms, eStarts)):
+            if gene_symbols:
+                if enhancer not in near_genes:
+                    near_genes[enhancer] = set()
+                near_genes[enhancer].update(gene_symbols)
+    return near_genes
+    
+    
+#ranks of every row of the expression matrix, centred and scaled to unit length,
+#so that the dot product of two rows is their Spearman correlation
+def rank_matrix(merged_exp_df):
+    from scipy import stats
+    ranks = stats.rankdata(merged_exp_df.values.astype(np.float64), axis=1)
+    ranks -= ranks.mean(axis=1, keepdims=True)
+    norms = np.sqrt((ranks ** 2).sum(axis=1, keepdims=True))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ranks /= norms #constant rows become NaN, as in spearmanr
+    row_index = {}
+    for i, name in enumerate(merged_exp_df.index):
+        if name not in row_index:
+            row_index[name] = i
+    return ranks, row_index
+
+
+#two-sided p-value of Spearman correlations from the t-distribution, as spearmanr
+def spearman_pvalues(r, nobs):
+    from scipy import stats
+    dof = nobs - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt((dof / ((r + 1.0) * (1.0 - r))).clip(0))
+    return 2 * stats.t.sf(np.abs(t), dof)
+
+
+#Spearman correlation and p-value of row pairs of the rank matrix, computed in blocks of pairs
+def pair_correlations(ranks, rows_a, rows_b, block_size=50000):
+    rows_a = np.asarray(rows_a, dtype=np.int64)
+    rows_b = np.asarray(rows_b, dtype=np.int64)
+    r = np.empty(len(rows_a))
+    for start in range(0, len(rows_a), block_size):
+        a = ranks[rows_a[start:start+block_size]]
+        b = ranks[rows_b[start:start+block_size]]
+        r[start:start+block_size] = np.einsum('ij,ij->i', a, b)
+    r = np.clip(r, -1.0, 1.0)
+    return r, spearman_pvalues(r, ranks.shape[1])
+
+
+#which of the (name, name) pairs pass the correlation and p-value cutoffs; the correlation of
+#every pair is recorded in tested if given
+def correlated_pairs(pairs, ranks, row_index, corr_cutoff, pval_cutoff, tested=None):
+    pairs = list(pairs)
+    if not pairs:
+        return set()
+    r, pvals = pair_correlations(ranks,
+                                 [row_index[a] for a, b in pairs],
+                                 [row_index[b] for a, b in pairs])
+    if tested is not None:
+        tested.update(zip(pairs, r))
+    passed = (np.abs(r) > corr_cutoff) & (pvals < pval_cutoff)
+    return set(pair for pair, ok in zip(pairs, passed) if ok)
+
+
+#enhancer modules with all correlations computed by the matrix engine
+def find_modules_matrix(enhancers,
+                        near_genes,
+                        merged_exp_df,
+                        eTFBS,
+                        gTFBS,
+                        corr_cutoff,
+                        pval_cutoff,
+                        ranked=None,
+                        tested=None):
+    if ranked is None:
+        ranked = rank_matrix(merged_exp_df)
+    ranks, row_index = ranked
+
+    #enhancer-TF correlations
+    eTF_pairs = []
+    for enhancer in enhancers:
+        if enhancer in eTFBS and enhancer in row_index:
+            for eTF in eTFBS[enhancer]:
+                if eTF in row_index:
+                    eTF_pairs.append((enhancer, eTF))
+    regulating = correlated_pairs(eTF_pairs, ranks, row_index, corr_cutoff, pval_cutoff, tested)
+
+    #enhancer-gene and TF-gene correlations of the candidate targets
+    candidates = []
+    for enhancer, regulating_TF in eTF_pairs:
+        if (enhancer, regulating_TF) not in regulating:
+            continue
+        for nearGene in near_genes.get(enhancer, ()):
+            if nearGene not in gTFBS or regulating_TF not in gTFBS[nearGene]:
+                if nearGene in row_index:
+                    candidates.append((enhancer, regulating_TF, nearGene))
+    gene_pairs = set()
+    for enhancer, regulating_TF, nearGene in candidates:
+        gene_pairs.add((enhancer, nearGene))
+        gene_pairs.add((regulating_TF, nearGene))
+    correlated = correlated_pairs(gene_pairs, ranks, row_index, corr_cutoff, pval_cutoff, tested)
+
+    eModules = {}
+    for enhancer, regulating_TF, nearGene in candidates:
+        if (enhancer, nearGene) in correlated and (regulating_TF, nearGene) in correlated:
+            if enhancer not in eModules:
+                eModules[enhancer] = {}
+            if regulating_TF not in eModules[enhancer]:
+                eModules[enhancer][regulating_TF] = set()
+            eModules[enhancer][regulating_TF].add(nearGene)
+    return eModules
+
+
+#enhancer modules with one spearmanr call per correlation
+def find_modules_scipy(enhancers,
+                       near_genes,
+                       merged_exp_df,
+                       eTFBS,
+                       gTFBS,
+                       corr_cutoff,
+                       pval_cutoff):
+    from scipy import stats
+    eModules = {}
+    for enhancer in enhancers:
+        regulating_TFs = set()
+        if enhancer in eTFBS:
+            for eTF in eTFBS[enhancer]:
+                if eTF in merged_exp_df.index:
+                    r, pval = stats.spearmanr(merged_exp_df.loc[enhancer],
+                                              merged_exp_df.loc[eTF])
+                    if abs(r) > corr_cutoff and pval < pval_cutoff:
+                        regulating_TFs.add(eTF)
+                    
+        target_genes = {}
+        if regulating_TFs:
+            for nearGene in near_genes.get(enhancer, ()):
+                for regulating_TF in regulating_TFs:
+                    if nearGene not in gTFBS or regulating_TF not in gTFBS[nearGene]:
+                        if nearGene in merged_exp_df.index:
+                            r1, pval1 = stats.spearmanr(merged_exp_df.loc[enhancer],
+                                                        merged_exp_df.loc[nearGene])
+                            r2, pval2 = stats.spearmanr(merged_exp_df.loc[regulating_TF],
+                                                        merged_exp_df.loc[nearGene])
+                            if (abs(r1) > corr_cutoff and pval1 < pval_cutoff) and (abs(r2) > corr_cutoff and pval2 < pval_cutoff):
+                                if regulating_TF not in target_genes:
+                                    target_genes[regulating_TF] = set()
+                                target_genes[regulating_TF].add(nearGene)                                
+        
+        if target_genes:
+            eModules[enhancer] = target_genes
+        instrument.advance()
+    return eModules
+
+
+#Permutation p-values of correlations. When the sample labels of one row of the rank matrix are
+#permuted at random, its correlation with another row has the same distribution as u . v[perm],
+#u and v being the sorted ranks of the two rows, so the null distribution depends only on their tie
+#patterns. Rows are grouped by tie pattern (all rows without ties fall in one group), and one seeded
+#set of permutations is applied to every pair of groups, in batches, as a matrix product. The cost
+#grows with the number of tie patterns times permutations, not with the number of pairs.
+PERMUTATION_BATCH = 1000
+
+
+#tie pattern group of every row of the rank matrix (-1 for rows not given, and for rows of
+#constant expression, whose ranks are NaN); returns the groups and the sorted ranks of every group
+def tie_groups(ranks, rows):
+    rows = np.unique(np.asarray(rows, dtype=np.int64))
+    rows = rows[~np.isnan(ranks[rows]).any(axis=1)]
+    row_group = np.full(len(ranks), -1, dtype=np.int64)
+    if len(rows) == 0:
+        return row_group, np.zeros((0, ranks.shape[1]))
+    sorted_ranks = np.sort(ranks[rows], axis=1)
+    patterns, first, groups = np.unique(np.round(sorted_ranks, 10), axis=0, return_index=True, return_inverse=True)
+    row_group[rows] = groups.ravel()
+    return row_group, sorted_ranks[first]
+
+
+#permutations of the sample labels, one per row
+def permutation_set(nobs, permutations, seed=1):
+    rng = np.random.default_rng(seed)
+    return np.argsort(rng.random((permutations, nobs)), axis=1).astype(np.int32)
+
+
+#worker globals, set once per process by the pool initializer
+_group_ranks = None
+_perms = None
+
+def _init_permutation_worker(group_ranks, perms):
+    global _group_ranks, _perms
+    _group_ranks = group_ranks
+    _perms = perms
+
+
+#absolute correlations in [0, 1] as integer keys below 2**44, offset by column, so that the null
+#values of all columns are counted by one search
+KEY_BITS = 44
+
+def column_keys(values, columns):
+    scaled = np.floor(np.clip(values, 0, 1) * (2.0 ** KEY_BITS - 1)).astype(np.int64)
+    return (columns.astype(np.int64) << KEY_BITS) + scaled
+
+
+#null exceedances of the pairs of one group against other groups
+#task: (group, other groups, column of every pair in other groups, absolute observed correlations)
+def _null_exceedances(task):
+    group, others, columns, abs_r = task
+    other_ranks = _group_ranks[others]
+    query_keys = column_keys(abs_r - 1e-12, columns)
+    counts = np.zeros(len(abs_r), dtype=np.int64)
+    for start in range(0, len(_perms), PERMUTATION_BATCH):
+        #permuted ranks of the group times the ranks of every other group
+        null = np.abs(_group_ranks[group][_perms[start:start+PERMUTATION_BATCH]] @ other_ranks.T)
+        null.sort(axis=0)
+        null_keys = column_keys(null.T, np.arange(len(others))[:, None]).ravel()
+        below = np.searchsorted(null_keys, query_keys, side='left') - columns * len(null)
+        counts += len(null) - below
+    return counts
+
+
+#permutation p-values of correlations r of row pairs (rows_a, rows_b); NaN for constant rows
+def permutation_pvalues(ranks, rows_a, rows_b, r, permutations=1000, seed=1, processes=1):
+    rows_a = np.asarray(rows_a, dtype=np.int64)
+    rows_b = np.asarray(rows_b, dtype=np.int64)
+    abs_r = np.abs(np.asarray(r, dtype=np.float64))
+    row_group, group_ranks = tie_groups(ranks, np.concatenate([rows_a, rows_b]))
+
+    #pairs sorted by (group, other group), the smaller group first; one task per group
+    group_a = row_group[rows_a]
+    group_b = row_group[rows_b]
+    pairs = np.flatnonzero((group_a >= 0) & (group_b >= 0) & ~np.isnan(abs_r))
+    low = np.minimum(group_a[pairs], group_b[pairs])
+    high = np.maximum(group_a[pairs], group_b[pairs])
+    order = np.lexsort((high, low))
+    pairs, low, high = pairs[order], low[order], high[order]
+    bounds = np.flatnonzero(np.diff(low)) + 1
+    tasks = []
+    task_pairs = []
+    for task in np.split(np.arange(len(pairs)), bounds):
+        if len(task) == 0:
+            continue
+        others, columns = np.unique(high[task], return_inverse=True)
+        tasks.append((low[task[0]], others, columns.ravel(), abs_r[pairs[task]]))
+        task_pairs.append(pairs[task])
+
+    perms = permutation_set(ranks.shape[1], permutations, seed)
+    results = []
+    with instrument.stage('permutations', total=len(tasks), unit='tie groups'):
+        if processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(processes, _init_permutation_worker, (group_ranks, perms))
+            try:
+                for counts in pool.imap(_null_exceedances, tasks):
+                    results.append(counts)
+                    instrument.advance()
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_permutation_worker(group_ranks, perms)
+            for task in tasks:
+                results.append(_null_exceedances(task))
+                instrument.advance()
+
+    pvals = np.full(len(rows_a), np.nan)
+    for task, counts in zip(task_pairs, results):
+        pvals[task] = (counts + 1) / (permutations + 1)
+    return pvals
+
+
+#Benjamini-Hochberg q-values; NaN p-values are left out of the correction
+def bh_qvalues(pvals):
+    pvals = np.asarray(pvals, dtype=np.float64)
+    qvals = np.full(len(pvals), np.nan)
+    tested = np.flatnonzero(~np.isnan(pvals))
+    if len(tested) == 0:
+        return qvals
+    order = tested[np.argsort(pvals[tested], kind='mergesort')]
+    q = pvals[order] * len(tested) / np.arange(1, len(tested) + 1)
+    qvals[order] = np.minimum(np.minimum.accumulate(q[::-1])[::-1], 1)
+    return qvals
+
+
+#permutation p- and q-values of every tested (name, name) pair; the q-values correct over all tested pairs
+def permutation_tests(ranks, row_index, tested, permutations=1000, seed=1, processes=1):
+    pairs = list(tested)
+    pvals = permutation_pvalues(ranks,
+                                [row_index[a] for a, b in pairs],
+                                [row_index[b] for a, b in pairs],
+                                [tested[pair] for pair in pairs],
+                                permutations,
+                                seed,
+                                processes)
+    qvals = bh_qvalues(pvals)
+    return dict(zip(pairs, pvals)), dict(zip(pairs, qvals))
+
+
+#a target gene is supported by three correlations, enhancer-TF, enhancer-gene and TF-gene;
+#its permutation p- and q-value are the largest of the three
+def module_pvalue(pair_values, enhancer, regulating_TF, nearGene):
+    return max(pair_values[(enhancer, regulating_TF)],
+               pair_values[(enhancer, nearGene)],
+               pair_values[(regulating_TF, nearGene)])
+
+
+#with pair_p and pair_q, the permutation p- and q-values of every target gene are added, in the order of the targets;
+#as Parquet, the table of modules_frame, one row per target gene
+def write_modules(eModules, outFile, pair_p=None, pair_q=None, outFormat='csv'):
+    if outFormat == 'parquet':
+        tableIO.write_table(modules_frame(eModules, pair_p, pair_q), outFile, outFormat, index=False)
+        return
+    with open(outFile, 'w') as f:
+        if pair_p is None:
+            f.write('Enhancer\tRegulating TF\tTarget genes\n')
+        else:
+            f.write('Enhancer\tRegulating TF\tTarget genes\tPerm P\tPerm Q\n')
+        for enhancer in eModules:
+            for regulating_TF in eModules[enhancer]:
+                targets = list(eModules[enhancer][regulating_TF])
+                target_str = ', '.join(targets)
+                if pair_p is None:
+                    f.write('\t'.join([enhancer, regulating_TF, target_str])+'\n')
+                else:
+                    p_str = ', '.join([format(module_pvalue(pair_p, enhancer, regulating_TF, gene), '.3e') for gene in targets])
+                    q_str = ', '.join([format(module_pvalue(pair_q, enhancer, regulating_TF, gene), '.3e') for gene in targets])
+                    f.write('\t'.join([enhancer, regulating_TF, target_str, p_str, q_str])+'\n')
+
+
+#enhancer modules ({enhancer: {TF: target genes}}) by the correlation engine; with permutations, also the
+#permutation p- and q-values of every tested pair (None otherwise)
+def find_modules(enhancers,
+                 near_genes,
+                 merged_exp_df,
+                 eTFBS,
+                 gTFBS,
+                 corr_cutoff,
+                 pval_cutoff,
+                 engine='matrix',
+                 permutations=0,
+                 seed=1,
+                 processes=1):
+    if permutations:
+        #the permutation tests reuse the rank matrix and the correlations of the matrix engine
+        with instrument.stage('find_modules', total=len(enhancers), unit='enhancers'):
+            ranked = rank_matrix(merged_exp_df)
+            tested = {}
+            eModules = find_modules_matrix(enhancers, near_genes, merged_exp_df, eTFBS, gTFBS, corr_cutoff, pval_cutoff,
+                                           ranked, tested)
+        pair_p, pair_q = permutation_tests(ranked[0], ranked[1], tested, permutations, seed, processes)
+        return eModules, pair_p, pair_q
+    with instrument.stage('find_modules', total=len(enhancers), unit='enhancers'):
+        if engine == 'scipy':
+            eModules = find_modules_scipy(enhancers, near_genes, merged_exp_df, eTFBS, gTFBS, corr_cutoff, pval_cutoff)
+        else:
+            eModules = find_modules_matrix(enhancers, near_genes, merged_exp_df, eTFBS, gTFBS, corr_cutoff, pval_cutoff)
+    return eModules, None, None
+
+
+#modules as a dataframe with one row per enhancer, regulating TF and target gene, and the
+#permutation p- and q-value of every target gene if given
+def modules_frame(eModules, pair_p=None, pair_q=None):
+    rows = []
+    for enhancer in eModules:
+        for regulating_TF in eModules[enhancer]:
+            for gene in eModules[enhancer][regulating_TF]:
+                row = [enhancer, regulating_TF, gene]
+                if pair_p is not None:
+                    row.append(module_pvalue(pair_p, enhancer, regulating_TF, gene))
+                    row.append(module_pvalue(pair_q, enhancer, regulating_TF, gene))
+                rows.append(row)
+    columns = ['Enhancer', 'Regulating TF', 'Target gene']
+    if pair_p is not None:
+        columns += ['Perm P', 'Perm Q']
+    return pd.DataFrame(rows, columns=columns)
+
+
+def identify_targets(enhancers,
+                     near_genes,
+                     merged_exp_df,
+                     eTFBS,
+                     gTFBS,
+                     corr_cutoff,
+                     pval_cutoff,
+                     outFile,
+                     engine='matrix',
+                     permutations=0,
+                     seed=1,
+                     processes=1,
+                     outFormat='csv'):
+    eModules, pair_p, pair_q = find_modules(enhancers, near_genes, merged_exp_df, eTFBS, gTFBS, corr_cutoff, pval_cutoff,
+                                            engine, permutations, seed, processes)
+    write_modules(eModules, outFile, pair_p, pair_q, outFormat)
+    
+
+
+#The candidate index holds every (enhancer, TF, target gene) triple the module search can consider
+#for a set of enhancers, a gtf file, a window, the TFBS files and a tfcutoff: the TFs binding the
+#enhancer, times the genes near it whose own TFBS do not include that TF. It does not depend on
+#expression, so it is built once and evaluated for every tissue. Names are kept once, everything
+#else as integer IDs:
+#  enhancers, tfs, genes      names
+#  etf_enhancer, etf_tf       enhancer-TF pairs, enhancers in input order
+#  target_etf, target_gene    candidate targets: enhancer-TF pair and near gene, sorted by pair
+#It is written as an npz file recording the inputs (path, size and modification time of the gtf
+#and TFBS files, tfcutoff and window) and rebuilt when they change or miss enhancers to analyze.
+INDEX_ARRAYS = ['enhancers', 'tfs', 'genes', 'etf_enhancer', 'etf_tf', 'target_etf', 'target_gene']
+
+
+def index_key(gtfFile, eTFBS_file, gTFBS_file, tfcutoff, window):
+    return json.dumps([geneIndex.gtf_key(gtfFile), geneIndex.gtf_key(eTFBS_file), geneIndex.gtf_key(gTFBS_file),
+                       tfcutoff, window])
+
+
+#ID of every element of a CSR row, repeated counts[i] times for row i
+def repeat_rows(indptr, rows, flat):
+    counts = indptr[rows + 1] - indptr[rows]
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return counts, flat[np.repeat(indptr[rows], counts) + offsets]
+
+
+def build_candidate_index(enhancers, gtfFile, eTFBS_file, gTFBS_file, tfcutoff, window=1000000, gtfCache=None):
+    enhancers = list(dict.fromkeys(enhancers))
+    near_genes = obtain_near_gene(enhancers, gtfFile, window, gtfCache)
+    genes = sorted(set().union(*near_genes.values()))
+    eTFBS = tfbsReader.read_tfbs(eTFBS_file, tfcutoff, enhancers)
+    gTFBS = tfbsReader.read_tfbs(gTFBS_file, tfcutoff, genes)
+
+    #enhancer-TF pairs, and near genes of every enhancer
+    positions = tfbsReader.key_positions(eTFBS)
+    etf_rows = np.array([positions.get(enhancer, -1) for enhancer in enhancers], dtype=np.int64)
+    bound = np.flatnonzero(etf_rows >= 0)
+    counts, etf_tf = repeat_rows(eTFBS['indptr'], etf_rows[bound], eTFBS['indices'])
+    etf_enhancer = np.repeat(bound, counts)
+    gene_ids = dict((gene, i) for i, gene in enumerate(genes))
+    gene_indptr = np.zeros(len(enhancers) + 1, dtype=np.int64)
+    gene_flat = []
+    for i, enhancer in enumerate(enhancers):
+        ids = sorted(gene_ids[gene] for gene in near_genes.get(enhancer, ()))
+        gene_indptr[i + 1] = gene_indptr[i] + len(ids)
+        gene_flat.extend(ids)
+
+    #every pair times the near genes of its enhancer, less the genes bound by the TF
+    counts, target_gene = repeat_rows(gene_indptr, etf_enhancer, np.array(gene_flat, dtype=np.int64))
+    target_etf = np.repeat(np.arange(len(etf_enhancer)), counts)
+    ntfs = max(len(eTFBS['tfs']), 1)
+    tf_ids = dict((tf, i) for i, tf in enumerate(eTFBS['tfs']))
+    gene_tfs = np.array([tf_ids.get(tf, -1) for tf in gTFBS['tfs']], dtype=np.int64)[gTFBS['indices']]
+    gene_rows = np.repeat(np.array([gene_ids[gene] for gene in gTFBS['keys']], dtype=np.int64), np.diff(gTFBS['indptr']))
+    gene_bindings = np.unique(gene_rows[gene_tfs >= 0] * ntfs + gene_tfs[gene_tfs >= 0])
+    free = ~np.isin(target_gene * ntfs + etf_tf[target_etf], gene_bindings)
+
+    return {'enhancers': np.array(enhancers, dtype=str),
+            'tfs': np.array(eTFBS['tfs'], dtype=str),
+            'genes': np.array(genes, dtype=str),
+            'etf_enhancer': etf_enhancer.astype(np.int32),
+            'etf_tf': etf_tf.astype(np.int32),
+            'target_etf': target_etf[free].astype(np.int32),
+            'target_gene': target_gene[free].astype(np.int32)}
+
+
+def write_candidate_index(index, indexFile, key):
+    tmpFile = '%s.%d.tmp' % (indexFile, os.getpid())
+    with open(tmpFile, 'wb') as f:
+        np.savez(f, key=np.array(key), **index)
+    os.replace(tmpFile, indexFile)
+
+
+#key and arrays of a candidate index file
+def read_candidate_index(indexFile):
+    with np.load(indexFile) as cache:
+        return str(cache['key']), dict((name, cache[name]) for name in INDEX_ARRAYS)
+
+
+#candidate index of the enhancers, from indexFile when it matches the inputs and covers the
+#enhancers, otherwise built (and written to indexFile if given)
+def candidate_index(enhancers, gtfFile, eTFBS_file, gTFBS_file, tfcutoff, window=1000000, gtfCache=None, indexFile=None):
+    key = index_key(gtfFile, eTFBS_file, gTFBS_file, tfcutoff, window)
+    if indexFile and os.path.exists(indexFile):
+        try:
+            cached_key, index = read_candidate_index(indexFile)
+            if cached_key == key and set(enhancers) <= set(index['enhancers'].tolist()):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+    with instrument.stage('candidate index', total=len(enhancers), unit='enhancers'):
+        index = build_candidate_index(enhancers, gtfFile, eTFBS_file, gTFBS_file, tfcutoff, window, gtfCache)
+    if indexFile:
+        write_candidate_index(index, indexFile, key)
+    return index
+
+
+#row of every name in the rank matrix, -1 for names without expression
+def index_rows(names, row_index, keep=None):
+    return np.array([row_index.get(name, -1) if keep is None or name in keep else -1 for name in names],
+                    dtype=np.int64)
+
+
+#which row pairs pass the correlation and p-value cutoffs, as correlated_pairs does for name pairs;
+#the correlation of every pair is recorded in tested under the row names if given
+def correlated_rows(ranks, rows_a, rows_b, corr_cutoff, pval_cutoff, tested=None, row_names=None):
+    if len(rows_a) == 0:
+        return np.zeros(0, dtype=bool)
+    r, pvals = pair_correlations(ranks, rows_a, rows_b)
+    if tested is not None:
+        tested.update(zip(zip([row_names[i] for i in rows_a.tolist()], [row_names[i] for i in rows_b.tolist()]), r))
+    return (np.abs(r) > corr_cutoff) & (pvals < pval_cutoff)
+
+
+#enhancer modules of the candidate index, as find_modules_matrix; only for the given enhancers if any
+def find_modules_index(index, merged_exp_df, corr_cutoff, pval_cutoff, enhancers=None, ranked=None, tested=None):
+    if ranked is None:
+        ranked = rank_matrix(merged_exp_df)
+    ranks, row_index = ranked
+    row_names = merged_exp_df.index.tolist()
+    enhancer_names = index['enhancers'].tolist()
+    tf_names = index['tfs'].tolist()
+    gene_names = index['genes'].tolist()
+    enhancer_rows = index_rows(enhancer_names, row_index, None if enhancers is None else set(enhancers))
+    tf_rows = index_rows(tf_names, row_index)
+    gene_rows = index_rows(gene_names, row_index)
+
+    #enhancer-TF correlations
+    etf_a = enhancer_rows[index['etf_enhancer']]
+    etf_b = tf_rows[index['etf_tf']]
+    pairs = np.flatnonzero((etf_a >= 0) & (etf_b >= 0))
+    regulating = np.zeros(len(etf_a), dtype=bool)
+    regulating[pairs] = correlated_rows(ranks, etf_a[pairs], etf_b[pairs], corr_cutoff, pval_cutoff, tested, row_names)
+
+    #enhancer-gene and TF-gene correlations of the candidate targets, every distinct row pair once
+    targets = np.flatnonzero(regulating[index['target_etf']] & (gene_rows[index['target_gene']] >= 0))
+    target_etf = index['target_etf'][targets]
+    target_gene = index['target_gene'][targets]
+    target_rows = gene_rows[target_gene]
+    nrows = len(ranks)
+    row_pairs, inverse = np.unique(np.concatenate([etf_a[target_etf] * nrows + target_rows,
+                                                   etf_b[target_etf] * nrows + target_rows]), return_inverse=True)
+    correlated = correlated_rows(ranks, row_pairs // nrows, row_pairs % nrows, corr_cutoff, pval_cutoff, tested, row_names)
+    inverse = inverse.ravel()
+    passed = np.flatnonzero(correlated[inverse[:len(targets)]] & correlated[inverse[len(targets):]])
+
+    eModules = {}
+    etf_enhancer = index['etf_enhancer']
+    etf_tf = index['etf_tf']
+    for pair, gene in zip(target_etf[passed].tolist(), target_gene[passed].tolist()):
+        enhancer = enhancer_names[etf_enhancer[pair]]
+        regulating_TF = tf_names[etf_tf[pair]]
+        if enhancer not in eModules:
+            eModules[enhancer] = {}
+        if regulating_TF not in eModules[enhancer]:
+            eModules[enhancer][regulating_TF] = set()
+        eModules[enhancer][regulating_TF].add(gene_names[gene])
+    return eModules
+
+
+#find_modules on the candidate index
+def find_modules_indexed(index,
+                         merged_exp_df,
+                         corr_cutoff,
+                         pval_cutoff,
+                         enhancers=None,
+                         permutations=0,
+                         seed=1,
+                         processes=1):
+    total = len(index['enhancers']) if enhancers is None else len(enhancers)
+    with instrument.stage('find_modules', total=total, unit='enhancers'):
+        ranked = rank_matrix(merged_exp_df)
+        tested = {} if permutations else None
+        eModules = find_modules_index(index, merged_exp_df, corr_cutoff, pval_cutoff, enhancers, ranked, tested)
+    if permutations:
+        pair_p, pair_q = permutation_tests(ranked[0], ranked[1], tested, permutations, seed, processes)
+        return eModules, pair_p, pair_q
+    return eModules, None, None
+
+
+#worker globals, set once per process by the pool initializer
+_tissue_args = None
+
+def _init_tissue_worker(args):
+    global _tissue_args
+    _tissue_args = args
+
+
+#genes of the candidate index whose expression the module search reads: TFs and near genes
+def index_genes(index):
+    return set(index['tfs'].tolist()) | set(index['genes'].tolist())
+
+
+#modules of one tissue; task: (tissue, enhancer expression file, gene expression file or None for the
+#shared gene expression, output file)
+def _tissue_modules(task):
+    tissue, eExpCsv, gExpCsv, outFile = task
+    index, gExp_df, corr_cutoff, pval_cutoff, enhancers, permutations, seed, outFormat = _tissue_args
+    if gExpCsv is not None:
+        gExp_df = read_gene_exp(gExpCsv, index_genes(index))
+    eExp_df = read_enhancer_exp(eExpCsv, index['enhancers'].tolist() if enhancers is None else enhancers)
+    merged_exp_df = merge_exp(eExp_df, gExp_df)
+    eModules, pair_p, pair_q = find_modules_indexed(index, merged_exp_df, corr_cutoff, pval_cutoff, enhancers,
+                                                    permutations, seed)
+    write_modules(eModules, outFile, pair_p, pair_q, outFormat)
+    return tissue
+
+
+#modules of every tissue of a folder of enhancer expression files (<tissue>.csv or <tissue>.parquet, as
+#written by eNormalization.py) against one candidate index, written to <outFolder>/<tissue>; the gene
+#expression is one dataframe shared by the tissues (gExp_df), or <gExpFolder>/<tissue>.csv (or
+#.parquet), and tissues without one are skipped. Tissues run in parallel processes.
+def identify_tissues(index,
+                     eExpFolder,
+                     outFolder,
+                     corr_cutoff,
+                     pval_cutoff,
+                     gExp_df=None,
+                     gExpFolder=None,
+                     enhancers=None,
+                     permutations=0,
+                     seed=1,
+                     processes=1,
+                     outFormat='csv'):
+    if not os.path.exists(outFolder):
+        os.makedirs(outFolder)
+    tasks = []
+    for tissue, eExpCsv in tableIO.folder_matrices(eExpFolder):
+        gExpCsv = None
+        if gExpFolder is not None:
+            gExpCsv = tableIO.find_matrix(gExpFolder, tissue)
+            if gExpCsv is None:
+                print('No gene expression for tissue %s, skipped' % tissue, file=sys.stderr)
+                continue
+        tasks.append((tissue, eExpCsv, gExpCsv, tableIO.results_file(os.path.join(outFolder, tissue), outFormat)))
+    args = (index, gExp_df, corr_cutoff, pval_cutoff, enhancers, permutations, seed, outFormat)
+    with instrument.stage('tissues', total=len(tasks), unit='tissues'):
+        if processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(processes, len(tasks)), _init_tissue_worker, (args,))
+            try:
+                for tissue in pool.imap_unordered(_tissue_modules, tasks):
+                    print(tissue)
+                    instrument.advance()
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_tissue_worker(args)
+            for task in tasks:
+                print(_tissue_modules(task))
+                instrument.advance()
+    return [task[0] for task in tasks]
+
+def usage():
+    print("""Parameters:
+        --eExpCsv         enhancer expression file (in csv or Parquet (.parquet) format). 
+        --gExpCsv         gene expression file (in csv or Parquet (.parquet) format). 
+        --gExpFolder      Folder of gene expression files, <tissue>.csv, with --eExpFolder (replaces --gExpCsv).
+        --eTFBS_file      Enhancers' TFBS profiles.
+        --gTFBS_file      Genes' TFBS profiles.
+        --eFile           Enhancers to analyze.
+        --gtfFile         Gene GTF file. This file can be downloaded from Ensembl.
+        --tfcutoff        TF binding score cutoff.
+        --rcutoff         Correlation coefficient cutoff.
+        --pcutoff         P-value cutoff.
+        --outFile         Output filename.
+        --format          Output format, csv (default): tab-separated text; parquet: Parquet table with one row per target gene (.parquet added to the file names written with --eExpFolder).
+        --gtfCache        Parsed gene table cache of the gtf file (default: <gtfFile>.genes.npz, built on first use).
+        --window          Distance (bp) between enhancer and gene start to call a near gene (default: 1000000).
+        --engine          Correlation engine, matrix (default): rank the expression matrix once and compute correlations in blocks; scipy: one spearmanr call per correlation.
+        --permutations    Number of sample label permutations; adds permutation p- and q-values of every target gene to the output (default: 0, none).
+        --seed            Seed of the permutations (default: 1).
+        --processes       Number of processes for the permutations, or for the tissues with --eExpFolder (default: 1).
+        --candidateIndex  Candidate index file of the enhancers, TFBS files, gtf file, window and tfcutoff (built on first use, and when its inputs change); evaluated with the matrix engine. Without --eExpCsv and --eExpFolder, only builds it.
+        --eExpFolder      Folder of enhancer expression files, <tissue>.csv (as written by eNormalization.py), replaces --eExpCsv: every tissue is evaluated against one candidate index.
+        --outFolder       Output folder with --eExpFolder, one file per tissue.
+        --progress        Print the progress of long stages, with ETA, to stderr.
+        --report          JSON file to write the wall time, CPU time, peak memory and throughput of every stage.
+        --profile         Run the stages under cProfile; the top functions go to the report (or to stderr without --report).
+        """)
+    print()
+    print('Example: python identifyModule.py  --eExpCsv  --gExpCsv --eTFBS_file --gTFBS_file --eFile --gtfFile --tfcutoff --rcutoff --pcutoff --outFile')
+    print('Example: python identifyModule.py  --eExpFolder eRNA_RPM/ --gExpFolder geneExp/ --eTFBS_file --gTFBS_file --eFile --gtfFile --tfcutoff --rcutoff --pcutoff --candidateIndex candidates.npz --processes 8 --outFolder modules/')
+    
+            
+def main(argv):
+    param = argv
+    try:
+        opts, args = getopt.getopt(param, '-h', ['eExpCsv=',
+                                                 'gExpCsv=', 
+                                                 'eTFBS_file=', 
+                                                 'gTFBS_file=', 
+                                                 'eFile=', 
+                                                 'gtfFile=', 
+                                                 'tfcutoff=',
+                                                 'rcutoff=', 
+                                                 'pcutoff=', 
+                                                 'outFile=',
+                                                 'window=',
+                                                 'gtfCache=',
+                                                 'engine=',
+                                                 'permutations=',
+                                                 'seed=',
+                                                 'processes=',
+                                                 'candidateIndex=',
+                                                 'eExpFolder=',
+                                                 'gExpFolder=',
+                                                 'outFolder=',
+                                                 'format=',
+                                                 'progress',
+                                                 'report=',
+                                                 'profile'])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+        
+    engine = 'matrix'
+    window = 1000000
+    gtfCache = None
+    permutations = 0
+    seed = 1
+    processes = 1
+    eExpCsv = None
+    candidateIndex = None
+    eExpFolder = None
+    gExpFolder = None
+    outFormat = 'csv'
+    progress = False
+    reportFile = None
+    profile = False
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit(2)
+        elif opt == '--eExpCsv':
+            eExpCsv = str(arg)
+        elif opt == '--gExpCsv':
+            gExpCsv = str(arg)
+        elif opt == '--eTFBS_file':
+            eTFBS_file = str(arg)
+        elif opt == '--gTFBS_file':
+            gTFBS_file = str(arg)
+        elif opt == '--eFile':
+            eFile = str(arg)
+        elif opt == '--gtfFile':
+            gtfFile = str(arg)
+        elif opt == '--rcutoff':
+            corr_cutoff = float(arg)
+        elif opt == '--tfcutoff':
+            tfcutoff = int(arg)
+        elif opt == '--pcutoff':
+            pval_cutoff = float(arg)
+        elif opt == '--outFile':
+            outFile = str(arg)
+        elif opt == '--gtfCache':
+            gtfCache = str(arg)
+        elif opt == '--window':
+            window = int(arg)
+        elif opt == '--engine':
+            engine = str(arg)
+        elif opt == '--permutations':
+            permutations = int(arg)
+        elif opt == '--seed':
+            seed = int(arg)
+        elif opt == '--processes':
+            processes = int(arg)
+        elif opt == '--candidateIndex':
+            candidateIndex = str(arg)
+        elif opt == '--eExpFolder':
+            eExpFolder = str(arg)
+        elif opt == '--gExpFolder':
+            gExpFolder = str(arg)
+        elif opt == '--outFolder':
+            outFolder = str(arg)
+        elif opt == '--format':
+            outFormat = str(arg)
+            if outFormat not in tableIO.FORMATS:
+                usage()
+                sys.exit(2)
+        elif opt == '--progress':
+            progress = True
+        elif opt == '--report':
+            reportFile = str(arg)
+        elif opt == '--profile':
+            profile = True
+    
+    instrument.configure(progress, reportFile, profile)
+
+    if candidateIndex or eExpFolder:
+        enhancers = read_enhancer(eFile)
+        index = candidate_index(enhancers, gtfFile, eTFBS_file, gTFBS_file, tfcutoff, window, gtfCache, candidateIndex)
+        if eExpFolder:
+            gExp_df = None if gExpFolder else read_gene_exp(gExpCsv, index_genes(index))
+            identify_tissues(index, eExpFolder, outFolder, corr_cutoff, pval_cutoff, gExp_df, gExpFolder, enhancers,
+                             permutations, seed, processes, outFormat)
+        elif eExpCsv:
+            merged_exp_df = merge_exp(read_enhancer_exp(eExpCsv, enhancers), read_gene_exp(gExpCsv, index_genes(index)))
+            eModules, pair_p, pair_q = find_modules_indexed(index, merged_exp_df, corr_cutoff, pval_cutoff, enhancers,
+                                                            permutations, seed, processes)
+            write_modules(eModules, outFile, pair_p, pair_q, outFormat)
+        return
+
+    enhancers = read_enhancer(eFile)
+    
+    near_genes = obtain_near_gene(enhancers, gtfFile, window, gtfCache)
+    
+    eTFBS = read_eTFBS(eTFBS_file, tfcutoff, enhancers)
+    
+    gTFBS = read_gTFBS(gTFBS_file, tfcutoff, set().union(*near_genes.values()))
+    
+    #only the expression of the enhancers, their TFs and near genes is read
+    eExp_df = read_enhancer_exp(eExpCsv, enhancers)
+    
+    gExp_df = read_gene_exp(gExpCsv, set().union(*near_genes.values(), *eTFBS.values()))
+    
+    merged_exp_df = merge_exp(eExp_df, gExp_df)
+    
+    identify_targets(enhancers,
+                     near_genes,
+                     merged_exp_df,
+                     eTFBS,
+                     gTFBS,
+                     corr_cutoff,
+                     pval_cutoff,
+                     outFile,
+                     engine,
+                     permutations,
+                     seed,
+                     processes,
+                     outFormat)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
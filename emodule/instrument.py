@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+
+
+#Instrumentation shared by the four scripts. A stage is a block of work run as
+#  with instrument.stage('glm Spleen', total=len(enhancers), unit='enhancers'):
+#      ...
+#      instrument.advance(n)    #n more items done, from any function called inside the stage
+#      instrument.annotate(load_s=t)    #seconds added to a field of the stage's record
+#Every stage records its wall time, CPU time (own and of finished child processes), resident memory
+#at start and end, peak resident memory of the process so far, and items per second. With progress
+#on, the innermost stage prints at most one progress line every PROGRESS_INTERVAL seconds, with the
+#ETA when its total is known. With profile on, the outermost stages run under cProfile.
+#Until configure() is called, stage() returns a shared do-nothing stage and advance() returns at once.
+PROGRESS_INTERVAL = 5.0
+PROFILE_TOP = 30
+
+_enabled = False
+_progress = False
+_profiler = None
+_reportFile = None
+_start = None
+_records = []
+_active = []
+
+
+#current resident memory in MB, None if unknown
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576
+    except (OSError, ValueError):
+        return None
+
+
+#peak resident memory of this process in MB (ru_maxrss is in KB on Linux, in bytes on macOS)
+def peak_rss():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / 1048576
+    return maxrss / 1024
+
+
+#CPU time of the finished child processes, e.g. of a process pool
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return '%d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+class Stage(object):
+    def __init__(self, name, total=None, unit='items'):
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.fields = {}
+
+    def __enter__(self):
+        if _profiler is not None and not _active:
+            _profiler.enable()
+        _active.append(self)
+        self.rss_start = current_rss()
+        self.children_cpu = children_cpu()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        self.next_report = self.wall + PROGRESS_INTERVAL
+        return self
+
+    def advance(self, n=1):
+        self.done += n
+        if _progress:
+            now = time.perf_counter()
+            if now >= self.next_report:
+                self.next_report = now + PROGRESS_INTERVAL
+                print_progress(self, now - self.wall)
+
+    def annotate(self, **fields):
+        for key, value in fields.items():
+            self.fields[key] = self.fields.get(key, 0) + value
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        if _active and _active[-1] is self:
+            _active.pop()
+        if _profiler is not None and not _active:
+            _profiler.disable()
+        items = self.done if self.done or self.total is None else self.total
+        record = {'stage': self.name,
+                  'start_s': round(self.wall - _start, 4),
+                  'wall_s': round(wall, 4),
+                  'cpu_s': round(cpu, 4),
+                  'children_cpu_s': round(children_cpu() - self.children_cpu, 4),
+                  'rss_start_mb': rounded(self.rss_start),
+                  'rss_end_mb': rounded(current_rss()),
+                  'peak_rss_mb': rounded(peak_rss()),
+                  'items': items,
+                  'unit': self.unit,
+                  'items_per_s': round(items / wall, 2) if wall > 0 else None,
+                  'failed': exc_type is not None}
+        for key, value in self.fields.items():
+            record[key] = round(value, 4)
+        _records.append(record)
+        if _progress:
+            print_summary(record)
+        return False
+
+
+#the stage of a disabled instrumentation
+class NullStage(object):
+    total = None
+    done = 0
+
+    def __enter__(self):
+        return self
+
+    def advance(self, n=1):
+        pass
+
+    def annotate(self, **fields):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+def rounded(value, digits=1):
+    return None if value is None else round(value, digits)
+
+
+def print_progress(stage, elapsed):
+    rate = stage.done / elapsed if elapsed > 0 else 0.0
+    line = '%s: %d' % (stage.name, stage.done)
+    if stage.total:
+        line += '/%d %s (%.1f%%)' % (stage.total, stage.unit, 100.0 * stage.done / stage.total)
+    else:
+        line += ' %s' % stage.unit
+    line += ', %.1f %s/s, elapsed %s' % (rate, stage.unit, format_duration(elapsed))
+    if stage.total and rate > 0:
+        line += ', ETA %s' % format_duration(max(stage.total - stage.done, 0) / rate)
+    print(line, file=sys.stderr, flush=True)
+
+
+def print_summary(record):
+    line = '%s: %s %s in %.2f s (CPU %.2f s' % (record['stage'], record['items'], record['unit'],
+                                               record['wall_s'], record['cpu_s'])
+    if record['children_cpu_s']:
+        line += ', child processes %.2f s' % record['children_cpu_s']
+    line += ', peak RSS %s MB)' % record['peak_rss_mb']
+    if record['items_per_s'] is not None:
+        line += ', %.1f %s/s' % (record['items_per_s'], record['unit'])
+    if 'load_s' in record:
+        line += ', load %.2f s, waited %.2f s, compute %.2f s' % (record['load_s'], record['load_wait_s'], record['compute_s'])
+    if record['failed']:
+        line += ', failed'
+    print(line, file=sys.stderr, flush=True)
+
+
+#a new stage; use as a context manager
+def stage(name, total=None, unit='items'):
+    if not _enabled:
+        return NULL_STAGE
+    return Stage(name, total, unit)
+
+
+#count n more items done in the innermost stage
+def advance(n=1):
+    if _active:
+        _active[-1].advance(n)
+
+
+#add to fields of the innermost stage's record, e.g. the time spent reading files
+def annotate(**fields):
+    if _active:
+        _active[-1].annotate(**fields)
+
+
+#turn the instrumentation on; the report (and the profile) are written when the process exits
+def configure(progress=False, reportFile=None, profile=False):
+    global _enabled, _progress, _profiler, _reportFile, _start
+    if not (progress or reportFile or profile):
+        return
+    _enabled = True
+    _progress = progress
+    _reportFile = reportFile
+    _start = time.perf_counter()
+    if profile:
+        import cProfile
+        _profiler = cProfile.Profile()
+    atexit.register(finish)
+
+
+#functions with the largest cumulative time in the profiled stages
+def profile_table(profiler, top=PROFILE_TOP):
+    import pstats
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (fileName, line, function), (calls, ncalls, tottime, cumtime, callers) in stats.stats.items():
+        rows.append({'function': '%s:%d(%s)' % (os.path.basename(fileName), line, function),
+                     'calls': ncalls,
+                     'tottime_s': round(tottime, 4),
+                     'cumtime_s': round(cumtime, 4)})
+    rows.sort(key=lambda row: row['cumtime_s'], reverse=True)
+    return rows[:top]
+
+
+def report():
+    return {'command': sys.argv,
+            'pid': os.getpid(),
+            'wall_s': round(time.perf_counter() - _start, 4),
+            'cpu_s': round(time.process_time(), 4),
+            'children_cpu_s': round(children_cpu(), 4),
+            'peak_rss_mb': rounded(peak_rss()),
+            'stages': _records}
+
+
+#write the report, and the profile: its top functions in the report (or on stderr without a report)
+#and the full statistics to <report>.prof for pstats or snakeviz
+def finish():
+    global _enabled
+    if not _enabled:
+        return
+    _enabled = False
+    profile = None
+    if _profiler is not None:
+        _profiler.disable()
+        try:
+            profile = profile_table(_profiler)
+        except TypeError:
+            #no profiled stage
+            profile = []
+    if _reportFile:
+        result = report()
+        if profile is not None:
+            result['profile'] = profile
+            _profiler.dump_stats(_reportFile + '.prof')
+        with open(_reportFile, 'w') as f:
+            json.dump(result, f, indent=1)
+    elif profile:
+        print('%10s %12s %12s  function' % ('calls', 'tottime (s)', 'cumtime (s)'), file=sys.stderr)
+        for row in profile:
+            print('%10d %12.3f %12.3f  %s' % (row['calls'], row['tottime_s'], row['cumtime_s'], row['function']),
+                  file=sys.stderr)
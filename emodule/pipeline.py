@@ -0,0 +1,391 @@
+import os
+import sys, getopt
+import json
+import hashlib
+import shutil
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from . import calculateExp
+from . import eNormalization
+from . import diffExp
+from . import identifyModule
+from . import tableIO
+
+
+#The pipeline runs calculateExp.py -> eNormalization.py -> diffExp.py -> identifyModule.py as a DAG
+#of tasks: one quantification task per bigwig file, then normalization, differential expression
+#and module inference per tissue. The candidate index of the annotated enhancers (near genes and
+#TFBS) is built by one task and shared by the module inference of every tissue. Every task writes its output under
+#  <workFolder>/<stage>/<key>/
+#where key is a hash of the stage, its parameters, the content of its input files and the keys of
+#the tasks it depends on. A task whose output folder exists is skipped, so changing a cutoff only
+#re-runs the stages downstream of it, and adding bigwig files only quantifies the new ones and
+#re-runs the tissues whose sample set changed.
+
+DEFAULT_CONFIG = {'quantify_engine': 'vector',
+                  'tmm': 'edgeR',
+                  'glm_engine': 'statsmodels',
+                  'fdrcutoff': 0.05,
+                  'correlation_engine': 'matrix',
+                  'tfcutoff': 400,
+                  'rcutoff': 0.3,
+                  'pcutoff': 0.05,
+                  'window': 1000000,
+                  'format': 'csv'}
+
+
+def read_config(configFile):
+    config = dict(DEFAULT_CONFIG)
+    with open(configFile) as f:
+        config.update(json.load(f))
+    return config
+
+
+#content hash of a file, remembered by path, size and modification time so that every file is hashed once
+def file_digest(path, digests):
+    stat = os.stat(path)
+    memo_key = '%s:%d:%d' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in digests:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digests[memo_key] = sha.hexdigest()
+    return digests[memo_key]
+
+
+def read_digests(workFolder):
+    digestFile = os.path.join(workFolder, 'digests.json')
+    if os.path.exists(digestFile):
+        with open(digestFile) as f:
+            return json.load(f)
+    return {}
+
+
+def write_digests(workFolder, digests):
+    digestFile = os.path.join(workFolder, 'digests.json')
+    with open(digestFile + '.tmp', 'w') as f:
+        json.dump(digests, f)
+    os.replace(digestFile + '.tmp', digestFile)
+
+
+def task_key(stage, params, inputs):
+    text = json.dumps({'stage': stage, 'params': params, 'inputs': inputs}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:24]
+
+
+#a task of the DAG; its output folder is <workFolder>/<stage>/<key>
+class Task(object):
+    def __init__(self, name, stage, key, func, args, deps):
+        self.name = name
+        self.stage = stage
+        self.key = key
+        self.func = func
+        self.args = args
+        self.deps = deps
+
+
+def output_folder(workFolder, stage, key):
+    return os.path.join(workFolder, stage, key)
+
+
+#run a stage function into a temporary folder, and move it into place when it finished
+def run_task(func, args, outFolder):
+    tmpFolder = '%s.%d.tmp' % (outFolder, os.getpid())
+    if os.path.exists(tmpFolder):
+        shutil.rmtree(tmpFolder)
+    os.makedirs(tmpFolder)
+    try:
+        func(*(args + (tmpFolder,)))
+        os.replace(tmpFolder, outFolder)
+    except Exception:
+        shutil.rmtree(tmpFolder, ignore_errors=True)
+        return traceback.format_exc()
+    return None
+
+
+#stage functions; the last argument is the folder to write into
+
+_enhancers = {}
+
+def quantify_stage(bwfile, annoFile, engine, outFolder):
+    if annoFile not in _enhancers:
+        _enhancers[annoFile] = calculateExp.read_enhancer(annoFile)
+    counts = calculateExp.quantify_exp(bwfile, _enhancers[annoFile], engine)
+    np.save(os.path.join(outFolder, 'exp.npy'), np.array(counts))
+
+
+def normalize_stage(annoFile, tissue, samples, quantifyFolders, tmm, outFormat, outFolder):
+    enhancer_index, lengths = eNormalization.read_enhancer(annoFile)
+    averages = np.column_stack([np.load(os.path.join(folder, 'exp.npy')) for folder in quantifyFolders])
+    counts = eNormalization.average_to_counts(enhancer_index, lengths, averages)
+    counts_df = eNormalization.counts_frame(counts, enhancer_index, samples)
+    eNormalization.normalize_exp(counts_df, {tissue: samples}, outFolder + os.sep, tmm, outFormat)
+
+
+def diffexp_stage(tissue, normalizeFolder, sampleFile, engine, fdr_cutoff, outFormat, outFolder):
+    diffExp.diff_exp(os.path.join(normalizeFolder, tableIO.matrix_file(tissue, outFormat)),
+                     sampleFile,
+                     tissue,
+                     tableIO.results_file(os.path.join(outFolder, 'sexBiasedEnhancer'), outFormat),
+                     engine,
+                     fdr_cutoff,
+                     outFormat=outFormat)
+
+
+def candidates_stage(annoFile, config, outFolder):
+    enhancers = [t[-1] for t in calculateExp.read_enhancer(annoFile)]
+    index = identifyModule.build_candidate_index(enhancers, config['gtfFile'], config['eTFBS_file'], config['gTFBS_file'],
+                                                 config['tfcutoff'], config['window'], config.get('gtfCache'))
+    key = identifyModule.index_key(config['gtfFile'], config['eTFBS_file'], config['gTFBS_file'], config['tfcutoff'], config['window'])
+    identifyModule.write_candidate_index(index, os.path.join(outFolder, 'candidates.npz'), key)
+
+
+def module_stage(tissue, normalizeFolder, diffexpFolder, gExpCsv, candidatesFolder, config, outFolder):
+    outFormat = config['format']
+    results_df = tableIO.read_table(tableIO.results_file(os.path.join(diffexpFolder, 'sexBiasedEnhancer'), outFormat))
+    enhancers = results_df['Enhancer'].tolist()
+    eExp_df = identifyModule.read_enhancer_exp(os.path.join(normalizeFolder, tableIO.matrix_file(tissue, outFormat)), enhancers)
+    outFile = tableIO.results_file(os.path.join(outFolder, 'module'), outFormat)
+    if config['correlation_engine'] == 'matrix':
+        key, index = identifyModule.read_candidate_index(os.path.join(candidatesFolder, 'candidates.npz'))
+        gExp_df = identifyModule.read_gene_exp(gExpCsv, identifyModule.index_genes(index))
+        merged_exp_df = identifyModule.merge_exp(eExp_df, gExp_df)
+        eModules, pair_p, pair_q = identifyModule.find_modules_indexed(index, merged_exp_df, config['rcutoff'], config['pcutoff'],
+                                                                       enhancers)
+        identifyModule.write_modules(eModules, outFile, outFormat=outFormat)
+        return
+    near_genes = identifyModule.obtain_near_gene(enhancers, config['gtfFile'], config['window'], config.get('gtfCache'))
+    eTFBS = identifyModule.read_eTFBS(config['eTFBS_file'], config['tfcutoff'], enhancers)
+    gTFBS = identifyModule.read_gTFBS(config['gTFBS_file'], config['tfcutoff'], set().union(*near_genes.values()))
+    gExp_df = identifyModule.read_gene_exp(gExpCsv, set().union(*near_genes.values(), *eTFBS.values()))
+    merged_exp_df = identifyModule.merge_exp(eExp_df, gExp_df)
+    identifyModule.identify_targets(enhancers,
+                                    near_genes,
+                                    merged_exp_df,
+                                    eTFBS,
+                                    gTFBS,
+                                    config['rcutoff'],
+                                    config['pcutoff'],
+                                    outFile,
+                                    config['correlation_engine'],
+                                    outFormat=outFormat)
+
+
+#sample attribute file of a tissue for diffExp.py
+def tissue_sample_file(config, tissue):
+    if 'sampleMap' in config and tissue in config['sampleMap']:
+        return config['sampleMap'][tissue]
+    for fileName in (tissue + '_sample.csv', tissue + '.csv'):
+        path = os.path.join(config['sampleFolder'], fileName)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+#build the tasks of every stage
+def build_tasks(config, workFolder, digests):
+    tasks = []
+    anno_digest = file_digest(config['annoFile'], digests)
+
+    #quantification, one task per bigwig file; bigwig files with the same content share a task
+    quantify_tasks = {}
+    key_tasks = {}
+    for bwfile in calculateExp.read_bwfiles(config['bwList']):
+        sample = calculateExp.sample_id(bwfile)
+        key = task_key('quantify',
+                       {'engine': config['quantify_engine']},
+                       [anno_digest, file_digest(bwfile, digests)])
+        if key not in key_tasks:
+            key_tasks[key] = Task(sample, 'quantify', key, quantify_stage,
+                                  (bwfile, config['annoFile'], config['quantify_engine']), [])
+            tasks.append(key_tasks[key])
+        quantify_tasks[sample] = key_tasks[key]
+
+    #candidate index of the annotated enhancers, built once for the module inference of all tissues
+    #(only the matrix engine reads it)
+    candidates_task = None
+    candidatesFolder = None
+    if 'gExpFolder' in config and config['correlation_engine'] == 'matrix':
+        key = task_key('candidates',
+                       dict((name, config[name]) for name in ('tfcutoff', 'window')),
+                       [anno_digest,
+                        file_digest(config['eTFBS_file'], digests),
+                        file_digest(config['gTFBS_file'], digests),
+                        file_digest(config['gtfFile'], digests)])
+        candidates_task = Task('all', 'candidates', key, candidates_stage, (config['annoFile'], config), [])
+        candidatesFolder = output_folder(workFolder, 'candidates', key)
+
+    tissue_samples, all_samples = eNormalization.read_sample(config['sampleFile'])
+    tissues = config.get('tissues') or sorted(tissue_samples)
+    for tissue in tissues:
+        samples = [sample for sample in tissue_samples.get(tissue, []) if sample in quantify_tasks]
+        if not samples:
+            print('No quantified samples for tissue %s, skipped' % tissue, file=sys.stderr)
+            continue
+        deps = [quantify_tasks[sample] for sample in samples]
+        key = task_key('normalize',
+                       {'tmm': config['tmm'], 'tissue': tissue, 'samples': samples, 'format': config['format']},
+                       [anno_digest] + [task.key for task in deps])
+        quantifyFolders = [output_folder(workFolder, 'quantify', task.key) for task in deps]
+        normalize_task = Task(tissue, 'normalize', key, normalize_stage,
+                              (config['annoFile'], tissue, samples, quantifyFolders, config['tmm'], config['format']), deps)
+        tasks.append(normalize_task)
+        normalizeFolder = output_folder(workFolder, 'normalize', key)
+
+        sampleFile = tissue_sample_file(config, tissue)
+        if sampleFile is None:
+            print('No sample attribute file for tissue %s, stopped after normalization' % tissue, file=sys.stderr)
+            continue
+        key = task_key('diffexp',
+                       {'engine': config['glm_engine'], 'fdrcutoff': config['fdrcutoff'], 'tissue': tissue, 'format': config['format']},
+                       [normalize_task.key, file_digest(sampleFile, digests)])
+        diffexp_task = Task(tissue, 'diffexp', key, diffexp_stage,
+                            (tissue, normalizeFolder, sampleFile, config['glm_engine'], config['fdrcutoff'], config['format']),
+                            [normalize_task])
+        tasks.append(diffexp_task)
+        diffexpFolder = output_folder(workFolder, 'diffexp', key)
+
+        gExpCsv = tableIO.find_matrix(config['gExpFolder'], tissue) if 'gExpFolder' in config else None
+        if gExpCsv is None:
+            continue
+        params = dict((name, config[name]) for name in ('tfcutoff', 'rcutoff', 'pcutoff', 'window', 'correlation_engine', 'format'))
+        params['tissue'] = tissue
+        deps = [normalize_task, diffexp_task]
+        digest_list = [file_digest(gExpCsv, digests)]
+        if candidates_task is not None:
+            if candidates_task not in tasks:
+                tasks.append(candidates_task)
+            deps.append(candidates_task)
+        else:
+            #without the candidate index the module stage reads the annotation files itself
+            digest_list += [file_digest(config['eTFBS_file'], digests),
+                            file_digest(config['gTFBS_file'], digests),
+                            file_digest(config['gtfFile'], digests)]
+        key = task_key('module',
+                       params,
+                       [task.key for task in deps] + digest_list)
+        tasks.append(Task(tissue, 'module', key, module_stage,
+                          (tissue, normalizeFolder, diffexpFolder, gExpCsv, candidatesFolder, config),
+                          deps))
+    return tasks
+
+
+#run the tasks whose output does not exist yet, independent tasks concurrently
+#returns {task: error} of the failed tasks (and of the tasks depending on them)
+def run_tasks(tasks, workFolder, processes):
+    done = set()
+    failed = {}
+    pending = []
+    for task in tasks:
+        if os.path.exists(output_folder(workFolder, task.stage, task.key)):
+            done.add(task)
+        else:
+            pending.append(task)
+    print('%d of %d tasks cached' % (len(done), len(tasks)))
+
+    running = {}
+    executor = ProcessPoolExecutor(processes)
+    try:
+        while pending or running:
+            for task in list(pending):
+                if any(dep in failed for dep in task.deps):
+                    failed[task] = 'skipped, an upstream task failed'
+                    pending.remove(task)
+                elif all(dep in done for dep in task.deps):
+                    outFolder = output_folder(workFolder, task.stage, task.key)
+                    if not os.path.exists(os.path.dirname(outFolder)):
+                        os.makedirs(os.path.dirname(outFolder))
+                    running[executor.submit(run_task, task.func, task.args, outFolder)] = task
+                    pending.remove(task)
+            if not running:
+                break
+            finished, unfinished = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                error = future.result()
+                if error:
+                    failed[task] = error
+                    print('%s %s failed:\n%s' % (task.stage, task.name, error), file=sys.stderr)
+                else:
+                    done.add(task)
+                    print('%s %s' % (task.stage, task.name))
+    finally:
+        executor.shutdown()
+    return failed
+
+
+#copy the results of every tissue to the output folder
+def collect_results(tasks, workFolder, outFolder, failed, outFormat='csv'):
+    if not os.path.exists(outFolder):
+        os.makedirs(outFolder)
+    outputs = {'normalize': (tableIO.matrix_file('%s', outFormat), tableIO.matrix_file('%s', outFormat)),
+               'diffexp': (tableIO.results_file('sexBiasedEnhancer', outFormat), tableIO.results_file('%s_sexBiasedEnhancer', outFormat)),
+               'module': (tableIO.results_file('module', outFormat), tableIO.results_file('%s_module', outFormat))}
+    for task in tasks:
+        if task.stage in outputs and task not in failed:
+            source, target = outputs[task.stage]
+            if '%s' in source:
+                source = source % task.name
+            shutil.copyfile(os.path.join(output_folder(workFolder, task.stage, task.key), source),
+                            os.path.join(outFolder, target % task.name))
+
+
+def run_pipeline(configFile, workFolder, outFolder, processes=None):
+    config = read_config(configFile)
+    if not os.path.exists(workFolder):
+        os.makedirs(workFolder)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    digests = read_digests(workFolder)
+    tasks = build_tasks(config, workFolder, digests)
+    write_digests(workFolder, digests)
+
+    failed = run_tasks(tasks, workFolder, processes)
+    collect_results(tasks, workFolder, outFolder, failed, config['format'])
+    return failed
+
+
+def usage():
+    print("""Parameters:
+        --config          JSON file of the pipeline inputs and parameters (see README).
+        --workFolder      folder of cached stage outputs.
+        --outFolder       folder to write the results of every tissue.
+        --processes       number of tasks run at once (default: number of cores).
+        """)
+    print()
+    print('Example: python pipeline.py  --config pipeline.json --workFolder pipeline_cache/ --outFolder results/ --processes 8')
+
+
+def main(argv):
+    param = argv
+    try:
+        opts, args = getopt.getopt(param, '-h', ['config=', 'workFolder=', 'outFolder=', 'processes='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    processes = None
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit(2)
+        elif opt == '--config':
+            configFile = str(arg)
+        elif opt == '--workFolder':
+            workFolder = str(arg)
+        elif opt == '--outFolder':
+            outFolder = str(arg)
+        elif opt == '--processes':
+            processes = int(arg)
+
+    failed = run_pipeline(configFile, workFolder, outFolder, processes)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import instrument
+
+
+#Prefetching reader for loops over many files. iter_prefetch(load, items, depth) yields
+#(item, load(item)) for every item in input order, while a bounded pool of threads already loads
+#the next depth items: the caller parses the current file while the next ones are opened and read.
+#At most depth loaded results wait to be consumed, so a slow consumer stops the readers
+#(backpressure); what a result holds (e.g. pages brought into the cache) is up to load. With depth
+#0 every item is loaded in the caller's thread, as a plain loop would. The time spent in load
+#(summed over the threads), the time the caller waited for a result and the time the caller spent
+#between results are added to the innermost instrument stage as load_s, load_wait_s and compute_s.
+#load_s is read time only when load reads the file; for bigwig files it is the time to locate the
+#blocks and request their read-ahead, and the reads themselves fall in compute_s.
+DEPTH = 4
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+#content of a text file, read in one call (universal newlines, as iterating over the file does)
+def read_text(path):
+    with open(path) as f:
+        return f.read()
+
+
+#bring byte ranges (offset, length) of a file into the page cache, so that the library that opens it
+#next (pyBigWig) finds them in memory: posix_fadvise(WILLNEED) starts the kernel's read-ahead of
+#exactly those ranges, or they are read where it is not available; returns the number of bytes
+def warm_ranges(path, ranges):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for offset, length in ranges:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+                continue
+            os.lseek(fd, offset, os.SEEK_SET)
+            while length > 0:
+                data = os.read(fd, min(length, BLOCK_SIZE))
+                if not data:
+                    break
+                length -= len(data)
+    finally:
+        os.close(fd)
+    return sum(length for offset, length in ranges)
+
+
+def iter_prefetch(load, items, depth=DEPTH, threads=None):
+    times = {'load_s': 0.0, 'load_wait_s': 0.0, 'compute_s': 0.0}
+    lock = threading.Lock()
+
+    def timed_load(item):
+        start = time.perf_counter()
+        try:
+            return load(item)
+        finally:
+            with lock:
+                times['load_s'] += time.perf_counter() - start
+
+    try:
+        if depth <= 0:
+            for item in items:
+                start = time.perf_counter()
+                result = timed_load(item)
+                times['load_wait_s'] += time.perf_counter() - start
+                start = time.perf_counter()
+                yield item, result
+                times['compute_s'] += time.perf_counter() - start
+            return
+
+        items = iter(items)
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=threads or depth)
+        try:
+            for item in items:
+                pending.append((item, executor.submit(timed_load, item)))
+                if len(pending) >= depth:
+                    break
+            while pending:
+                start = time.perf_counter()
+                item, future = pending.popleft()
+                result = future.result()
+                times['load_wait_s'] += time.perf_counter() - start
+                #a slot is free: the next item is read while the caller works on this one
+                for next_item in items:
+                    pending.append((next_item, executor.submit(timed_load, next_item)))
+                    break
+                start = time.perf_counter()
+                yield item, result
+                times['compute_s'] += time.perf_counter() - start
+        finally:
+            for item, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+    finally:
+        instrument.annotate(**times)
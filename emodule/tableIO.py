@@ -0,0 +1,127 @@
+import os
+import csv
+import pandas as pd
+
+
+#Expression matrices (first column as index) and results tables are written as csv, the default, or
+#as Parquet files, chosen by the format option of the scripts. Readers tell the format from the file
+#extension, so every script reads the output of the one before it in either format. Parquet keeps
+#the column types (integer RPM, float statistics), and reads only the requested columns (samples)
+#and rows (enhancers). pyarrow is imported by pandas, and only for Parquet files.
+FORMATS = ['csv', 'parquet']
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet'}
+
+
+def file_format(path):
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        return 'parquet'
+    return 'csv'
+
+
+#file name of a matrix, e.g. <tissue>.csv or <tissue>.parquet
+def matrix_file(prefix, fmt='csv'):
+    return prefix + EXTENSIONS[fmt]
+
+
+#file name of a results table; text tables keep their name without extension
+def results_file(path, fmt='csv'):
+    if fmt == 'parquet':
+        return path + EXTENSIONS[fmt]
+    return path
+
+
+#name of the matrix files of a folder (<name>.csv or <name>.parquet) and their paths, sorted by name
+def folder_matrices(folder):
+    matrices = []
+    for fileName in sorted(os.listdir(folder)):
+        for fmt in FORMATS:
+            if fileName.endswith(EXTENSIONS[fmt]):
+                matrices.append((fileName[:-len(EXTENSIONS[fmt])], os.path.join(folder, fileName)))
+    return matrices
+
+
+#<folder>/<name>.csv or <folder>/<name>.parquet, whichever exists (csv first), None if neither
+def find_matrix(folder, name):
+    for fmt in FORMATS:
+        path = os.path.join(folder, matrix_file(name, fmt))
+        if os.path.exists(path):
+            return path
+    return None
+
+
+#column of a Parquet file that holds the pandas index, None if the index was not stored (a
+#RangeIndex, index=False or a file written without pandas); the first column is then the index
+def parquet_index_column(schema):
+    index_columns = (schema.pandas_metadata or {}).get('index_columns')
+    return index_columns[0] if index_columns and isinstance(index_columns[0], str) else None
+
+
+#matrix with its first column as index; only the given columns and rows if any, in file order
+def read_matrix(path, columns=None, rows=None, sep=','):
+    if file_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(path)
+        index_column = parquet_index_column(schema)
+        if columns is not None:
+            keep = set(columns)
+            columns = [name for name in schema.names if name in keep and name != index_column]
+        if index_column is None:
+            #the first column is the index: it is read too, and the rows are filtered after the read
+            first = schema.names[0]
+            if columns is not None:
+                columns = [first] + [name for name in columns if name != first]
+            matrix = pd.read_parquet(path, engine='pyarrow', columns=columns).set_index(first)
+            if rows is not None:
+                matrix = matrix[matrix.index.isin(list(set(rows)))]
+            return matrix
+        filters = None
+        if rows is not None:
+            rows = list(set(rows))
+            if not rows:
+                #no row to keep: an empty matrix with the columns (a filter on no value fails)
+                return schema.empty_table().to_pandas()[columns if columns is not None else slice(None)]
+            filters = [(index_column, 'in', rows)]
+        return pd.read_parquet(path, engine='pyarrow', columns=columns, filters=filters)
+
+    usecols = None
+    if columns is not None:
+        keep = set(columns)
+        with open(path) as f:
+            header = next(csv.reader(f, delimiter=sep))
+        usecols = [0] + [i for i, name in enumerate(header) if i > 0 and name in keep]
+    matrix = pd.read_csv(path, sep=sep, index_col=0, usecols=usecols)
+    if rows is not None:
+        matrix = matrix[matrix.index.isin(list(set(rows)))]
+    return matrix
+
+
+#blocks of block_size rows of a matrix, with its first column as index
+def iter_matrix_blocks(path, block_size, sep=','):
+    if file_format(path) == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path)
+        index_column = parquet_index_column(parquet.schema_arrow)
+        for batch in parquet.iter_batches(batch_size=block_size):
+            block = pa.Table.from_batches([batch], schema=parquet.schema_arrow).to_pandas()
+            if index_column is None:
+                block = block.set_index(parquet.schema_arrow.names[0])
+            yield block
+        return
+    for block in pd.read_csv(path, sep=sep, index_col=0, chunksize=block_size):
+        yield block
+
+
+#write a matrix (with its index) or a table (without) in the format
+def write_table(table, path, fmt='csv', index=True):
+    if fmt == 'parquet':
+        table.to_parquet(path, engine='pyarrow', index=index)
+    else:
+        table.to_csv(path, index=index)
+
+
+#read a results table in the format of its file name
+def read_table(path, sep='\t'):
+    if file_format(path) == 'parquet':
+        return pd.read_parquet(path, engine='pyarrow')
+    return pd.read_csv(path, sep=sep)
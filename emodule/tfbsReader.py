@@ -0,0 +1,112 @@
+import csv
+import numpy as np
+import pandas as pd
+
+
+#A TFBS file (header line, then key<TAB>TF[::TF...]<TAB>score, with enhancers or genes as keys)
+#is read in chunks. Bindings above the score cutoff are kept as a sparse key x TF table:
+#  keys     key names, in order of first appearance
+#  tfs      TF names (upper case), in order of first appearance
+#  indptr   bindings of key i are indices[indptr[i]:indptr[i+1]]
+#  indices  TF IDs, sorted and unique within every key
+CHUNK_SIZE = 250000
+
+
+#ID of every name, adding names not seen before to the vocabulary
+def intern_names(names, ids, vocabulary):
+    codes, uniques = pd.factorize(names)
+    unique_ids = np.empty(len(uniques), dtype=np.int32)
+    for i, name in enumerate(uniques):
+        if name not in ids:
+            ids[name] = len(vocabulary)
+            vocabulary.append(name)
+        unique_ids[i] = ids[name]
+    return unique_ids[codes]
+
+
+#read bindings with score > tfcutoff; with keys given, only bindings of those keys are kept
+def read_tfbs(tfbsFile, tfcutoff, keys=None, chunk_size=CHUNK_SIZE):
+    if keys is not None:
+        keys = set(keys)
+    key_ids = {}
+    key_names = []
+    tf_ids = {}
+    tf_names = []
+    #TF IDs of every distinct TF column value, e.g. 'Ahr::Arnt' -> IDs of AHR and ARNT
+    dimer_ids = {}
+    key_codes = []
+    tf_codes = []
+    reader = pd.read_csv(tfbsFile,
+                         sep='\t',
+                         header=None,
+                         skiprows=1,
+                         names=['key', 'tfs', 'score'],
+                         dtype={'key': str, 'tfs': str},
+                         quoting=csv.QUOTE_NONE,
+                         chunksize=chunk_size)
+    for chunk in reader:
+        chunk = chunk[chunk['score'] > tfcutoff]
+        if keys is not None:
+            chunk = chunk[chunk['key'].isin(keys)]
+        if len(chunk) == 0:
+            continue
+
+        #TF names are split and upper-cased once per distinct value, not once per line
+        codes, uniques = pd.factorize(chunk['tfs'].values)
+        unique_tfs = []
+        for dimer in uniques:
+            if dimer not in dimer_ids:
+                dimer_ids[dimer] = intern_names(np.array(dimer.upper().split('::'), dtype=object), tf_ids, tf_names)
+            unique_tfs.append(dimer_ids[dimer])
+        lengths = np.array([len(ids) for ids in unique_tfs], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        flat_tfs = np.concatenate(unique_tfs)
+
+        #one binding per TF of every line
+        repeats = lengths[codes]
+        line_starts = np.repeat(np.cumsum(repeats) - repeats, repeats)
+        positions = np.repeat(offsets[codes], repeats) + np.arange(repeats.sum()) - line_starts
+        key_codes.append(np.repeat(intern_names(chunk['key'].values, key_ids, key_names), repeats))
+        tf_codes.append(flat_tfs[positions])
+
+    if key_codes:
+        key_codes = np.concatenate(key_codes).astype(np.int64)
+        tf_codes = np.concatenate(tf_codes).astype(np.int64)
+    else:
+        key_codes = np.zeros(0, dtype=np.int64)
+        tf_codes = np.zeros(0, dtype=np.int64)
+
+    #unique (key, TF) pairs sorted by key, then TF
+    ntfs = max(len(tf_names), 1)
+    pairs = np.sort(key_codes * ntfs + tf_codes)
+    if len(pairs):
+        pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+    rows = pairs // ntfs
+    indptr = np.zeros(len(key_names) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(key_names)), out=indptr[1:])
+    indices = (pairs % ntfs).astype(np.int32)
+    return {'keys': key_names,
+            'tfs': tf_names,
+            'indptr': indptr,
+            'indices': indices}
+
+
+#position of every key in tfbs['keys']
+def key_positions(tfbs):
+    return dict((key, i) for i, key in enumerate(tfbs['keys']))
+
+
+#materialize {key: set of TF names} for the requested keys only (all keys if None)
+def tfbs_sets(tfbs, keys=None):
+    positions = key_positions(tfbs)
+    if keys is None:
+        keys = tfbs['keys']
+    indptr = tfbs['indptr']
+    indices = tfbs['indices']
+    tf_names = tfbs['tfs']
+    sets = {}
+    for key in keys:
+        if key in positions:
+            i = positions[key]
+            sets[key] = set(tf_names[j] for j in indices[indptr[i]:indptr[i+1]].tolist())
+    return sets
@@ -0,0 +1,13 @@
+library(edgeR)
+
+tmm_nor <- function(count, output){
+	y <- DGEList(counts=count)
+	y <- calcNormFactors(y)
+	write.table(y$counts, sep =",", file=output)
+}
+
+tmm_factors <- function(count, refColumn=NULL){
+	y <- DGEList(counts=count)
+	y <- calcNormFactors(y, refColumn=refColumn)
+	y$samples$norm.factors
+}
@@ -0,0 +1,7 @@
+import sys
+from emodule.geneIndex import *
+
+
+#geneIndex.py is kept as a script and as a module for existing command lines and imports; the code is in emodule/geneIndex.py
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,5 @@
+import os
+import sys
+
+#the tests import the emodule package from the repository, as the scripts at the top level do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+import struct
+import zlib
+import numpy as np
+import pytest
+from emodule import bwIndex
+
+pyBigWig = pytest.importorskip('pyBigWig')
+
+
+#a bigwig file of two chromosomes with many data blocks (pyBigWig compresses about 32 kB of items per block), and
+#its values
+def write_bigwig(path):
+    rng = np.random.default_rng(2)
+    chroms = [('chr1', 2000000), ('chr2', 1000000)]
+    bw = pyBigWig.open(path, 'w')
+    bw.addHeader(chroms, maxZooms=0)
+    for chrom, length in chroms:
+        starts = np.arange(0, length - 20, 20)
+        bw.addEntries([chrom] * len(starts), starts.tolist(), ends=(starts + 20).tolist(),
+                      values=rng.gamma(1, 5, len(starts)).tolist())
+    bw.close()
+
+
+SPANS = {'chr1': [(1000, 1500), (1250000, 1262000), (1255000, 1256000)], 'chr2': [(650000, 650800)], 'chr3': [(0, 100)]}
+
+
+#every range found with no merging is one data block: a zlib stream whose section header holds the
+#chromosome and bases of the block, which overlap a span
+def test_block_offsets(tmp_path):
+    path = str(tmp_path / 'sample.bw')
+    write_bigwig(path)
+    with pyBigWig.open(path) as bw:
+        chrom_ids = dict((chrom, i) for i, chrom in enumerate(sorted(bw.chroms())))
+    with open(path, 'rb') as f:
+        data = f.read()
+    ranges = bwIndex.data_ranges(path, SPANS, merge_gap=-1)
+    assert len(ranges) > 3
+    for offset, length in ranges:
+        block = zlib.decompress(data[offset:offset + length])
+        chromId, start, end = struct.unpack('<III', block[:12])
+        chrom = [name for name in chrom_ids if chrom_ids[name] == chromId][0]
+        assert any(start < span_end and span_start < end for span_start, span_end in SPANS[chrom])
+
+
+#the ranges hold every byte pyBigWig reads for the spans: with all other data blocks zeroed the
+#values are the same, and the ranges are a small part of the file
+def test_ranges_cover_reads(tmp_path):
+    path = str(tmp_path / 'sample.bw')
+    write_bigwig(path)
+    ranges = bwIndex.data_ranges(path, SPANS)
+    with open(path, 'rb') as f:
+        data = f.read()
+    fullDataOffset, fullIndexOffset = struct.unpack('<QQ', data[16:32])
+    kept = bytearray(data)
+    kept[fullDataOffset + 8:fullIndexOffset] = bytes(fullIndexOffset - fullDataOffset - 8)
+    for offset, length in ranges:
+        kept[offset:offset + length] = data[offset:offset + length]
+    with open(str(tmp_path / 'kept.bw'), 'wb') as f:
+        f.write(kept)
+
+    assert sum(length for offset, length in ranges) < (fullIndexOffset - fullDataOffset) / 10
+    with pyBigWig.open(path) as bw, pyBigWig.open(str(tmp_path / 'kept.bw')) as kept_bw:
+        for chrom in ('chr1', 'chr2'):
+            for start, end in SPANS[chrom]:
+                np.testing.assert_array_equal(kept_bw.values(chrom, start, end), bw.values(chrom, start, end))
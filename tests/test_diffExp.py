@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+import pytest
+from emodule import diffExp
+
+
+#coefficients and p-values of the irls engine must match statsmodels to this relative tolerance
+RTOL = 1e-8
+
+
+#fixed cohort of 40 samples (sample attributes, enhancer expression as samples x enhancers): Poisson
+#counts of 25 enhancers with Sex, Age and RIN effects, one of them sex-biased, one near zero
+def cohort():
+    rng = np.random.default_rng(11)
+    n = 40
+    samples = ['S%d' % i for i in range(n)]
+    attributes = pd.DataFrame({'Sex': np.tile([1, 2], n // 2),
+                               'Age': rng.choice([25, 35, 45, 55, 65], n),
+                               'RIN': np.round(rng.uniform(5.5, 9, n), 1)},
+                              index=samples)
+    X = np.column_stack([np.ones(n), attributes.values])
+    beta = np.column_stack([rng.normal(2, 1, 25), rng.normal(0, 0.4, 25), rng.normal(0, 0.01, 25), rng.normal(0, 0.1, 25)])
+    beta[1] = [1, 2, 0, 0]
+    Y = rng.poisson(np.exp(np.minimum(X[:, :3] @ beta[:, :3].T, 8)))
+    Y[:, 0] = rng.poisson(0.3, n)
+    expression_data = pd.DataFrame(Y, index=samples, columns=['chr1:%d-%d' % (i * 1000, i * 1000 + 500) for i in range(25)])
+    return attributes, expression_data
+
+
+def test_irls_matches_statsmodels():
+    pytest.importorskip('statsmodels')
+    attributes, expression_data = cohort()
+    irls_coefs, irls_pvals = diffExp.glm_irls(expression_data, attributes)
+    sm_coefs, sm_pvals = diffExp.glm_statsmodels(expression_data, attributes)
+    np.testing.assert_allclose(irls_coefs, sm_coefs, rtol=RTOL)
+    np.testing.assert_allclose(irls_pvals, sm_pvals, rtol=RTOL)
+
+
+#an enhancer with no counts has no fit: it gets coefficient NaN and p-value 1, and the other enhancers
+#of its chunk are fitted as by statsmodels; the score test leaves it untested too
+def test_irls_all_zero_enhancer():
+    pytest.importorskip('statsmodels')
+    attributes, expression_data = cohort()
+    expression_data.iloc[:, 3] = 0
+    coefs, pvals = diffExp.glm_irls(expression_data, attributes)
+    assert np.isnan(coefs[3]) and pvals[3] == 1
+    others = [i for i in range(expression_data.shape[1]) if i != 3]
+    sm_coefs, sm_pvals = diffExp.glm_statsmodels(expression_data.iloc[:, others], attributes)
+    np.testing.assert_allclose(coefs[others], sm_coefs, rtol=RTOL)
+    np.testing.assert_allclose(pvals[others], sm_pvals, rtol=RTOL)
+    score_pvals = diffExp.glm_score(expression_data, attributes)
+    assert score_pvals[3] == 1 and np.isfinite(score_pvals).all()
+
+
+#a singular system of a chunk is solved by pseudo-inverse, the others as before
+def test_solve_stacked_singular():
+    A = np.array([[[2.0, 0.0], [0.0, 4.0]], [[1.0, 1.0], [1.0, 1.0]]])
+    b = np.array([[2.0, 8.0], [2.0, 2.0]])
+    np.testing.assert_allclose(diffExp.solve_stacked(A, b), [[1.0, 2.0], [1.0, 1.0]])
+    np.testing.assert_allclose(diffExp.inv_stacked(A), [[[0.5, 0.0], [0.0, 0.25]], np.linalg.pinv(A[1])])
+
+
+#fixed cohort of 40 samples and 120 low-count enhancers, 40 of them with Sex effects of various sizes,
+#so that some enhancers of abs(log2(FC)) > 1 are near the FDR cutoff
+def sex_effect_cohort():
+    rng = np.random.default_rng(5)
+    n = 40
+    samples = ['S%d' % i for i in range(n)]
+    attributes = pd.DataFrame({'Sex': np.tile([1, 2], n // 2),
+                               'Age': rng.choice([25, 35, 45, 55, 65], n)},
+                              index=samples)
+    base = rng.uniform(0.3, 2.5, 120)
+    effect = np.zeros(120)
+    effect[:40] = rng.choice([-1, 1], 40) * rng.uniform(0.3, 1.2, 40)
+    Y = rng.poisson(np.exp(base[None, :] + (attributes['Sex'].values - 1)[:, None] * effect[None, :]))
+    expression_data = pd.DataFrame(Y, index=samples, columns=['chr1:%d-%d' % (i * 1000, i * 1000 + 500) for i in range(120)])
+    return attributes, expression_data
+
+
+#enhancer rows (FDR as the last column) of every prefilter, and the enhancers each one reports
+def prefilter_results():
+    attributes, expression_data = sex_effect_cohort()
+    results = {}
+    reported = {}
+    for prefilter in diffExp.PREFILTERS:
+        results[prefilter] = diffExp.test_enhancers(expression_data, attributes, 'Spleen', 'irls', prefilter)
+        reported[prefilter] = [row[1] for row in results[prefilter] if diffExp.is_sex_biased(row[4], row[5], row[7])]
+    return results, reported
+
+
+#the score prefilter changes only the p-values of the enhancers that cannot be reported, and here
+#reports the same enhancers as no prefilter
+def test_prefilter_score_reports_same_rows():
+    results, reported = prefilter_results()
+    candidates = [abs(row[4]) > 1 for row in results['none']]
+    for candidate, row, score_row in zip(candidates, results['none'], results['score']):
+        if candidate:
+            assert score_row[5:7] == row[5:7]
+    assert any(score_row[6] != row[6] for candidate, row, score_row in zip(candidates, results['none'], results['score'])
+               if not candidate)
+    assert len(reported['none']) > 0
+    assert reported['score'] == reported['none']
+
+
+#the fc prefilter is conservative: its FDRs are never smaller, and it reports a subset of the enhancers
+def test_prefilter_fc_conservative():
+    results, reported = prefilter_results()
+    none_fdrs = np.array([row[7] for row in results['none']])
+    fc_fdrs = np.array([row[7] for row in results['fc']])
+    assert (fc_fdrs >= none_fdrs - 1e-12).all()
+    assert set(reported['fc']) <= set(reported['none'])
+    assert len(reported['fc']) < len(reported['none'])
+
+
+#the out-of-core block mode writes the same file as the in-memory mode
+def test_block_mode_matches(tmp_path):
+    attributes, expression_data = cohort()
+    expFile = str(tmp_path / 'Spleen.csv')
+    sampleFile = str(tmp_path / 'Spleen_sample.csv')
+    expression_data.T.to_csv(expFile)
+    attributes.T.to_csv(sampleFile)
+    diffExp.diff_exp(expFile, sampleFile, 'Spleen', str(tmp_path / 'inMemory'))
+    diffExp.diff_exp(expFile, sampleFile, 'Spleen', str(tmp_path / 'blocks'), block_size=7)
+    with open(str(tmp_path / 'inMemory')) as f:
+        in_memory = f.read()
+    with open(str(tmp_path / 'blocks')) as f:
+        blocks = f.read()
+    assert len(in_memory.splitlines()) > 1
+    assert blocks == in_memory
+
+
+#a tissue that fails (its sample file has no Sex) is reported and does not stop the others; the
+#results of the other tissue and the combined table are those of a run of that tissue alone
+@pytest.mark.parametrize('processes', [1, 2])
+def test_diff_exp_tissues_isolates_failure(tmp_path, processes):
+    attributes, expression_data = cohort()
+    expFolder = tmp_path / 'rpm'
+    sampleFolder = tmp_path / 'samples'
+    outFolder = tmp_path / 'out'
+    expFolder.mkdir()
+    sampleFolder.mkdir()
+    for tissue in ('Liver', 'Spleen'):
+        expression_data.T.to_csv(str(expFolder / (tissue + '.csv')))
+    attributes.T.to_csv(str(sampleFolder / 'Spleen_sample.csv'))
+    attributes.drop(columns='Sex').T.to_csv(str(sampleFolder / 'Liver_sample.csv'))
+
+    failed = diffExp.diff_exp_tissues(str(expFolder), str(outFolder), sampleFolder=str(sampleFolder),
+                                      processes=processes, engine='irls')
+    assert list(failed) == ['Liver']
+    assert 'KeyError' in failed['Liver']
+    assert not (outFolder / 'Liver_sexBiasedEnhancer').exists()
+
+    diffExp.diff_exp(str(expFolder / 'Spleen.csv'), str(sampleFolder / 'Spleen_sample.csv'), 'Spleen',
+                     str(tmp_path / 'Spleen_alone'), 'irls')
+    with open(str(tmp_path / 'Spleen_alone')) as f:
+        alone = f.read()
+    assert len(alone.splitlines()) > 1
+    with open(str(outFolder / 'Spleen_sexBiasedEnhancer')) as f:
+        assert f.read() == alone
+    with open(str(outFolder / 'sexBiasedEnhancer_allTissues')) as f:
+        assert f.read() == alone
@@ -0,0 +1,55 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from emodule import identifyModule
+
+
+#correlations and p-values of the matrix engine must match scipy.stats.spearmanr to this tolerance
+RTOL = 1e-9
+ATOL = 1e-12
+
+
+#fixed expression matrix (rows x 30 samples) of small integer counts, so that most rows have ties,
+#with a constant row, an all-zero row and a row tied with another row's ranks
+def expression():
+    rng = np.random.default_rng(5)
+    values = rng.poisson(rng.uniform(0.5, 20, 12)[:, None], (12, 30)).astype(np.float64)
+    values[3] = 7
+    values[4] = 0
+    values[5] = values[0] * 2 + 1
+    values[6] = -values[1]
+    return pd.DataFrame(values, index=['row%d' % i for i in range(12)])
+
+
+def test_pair_correlations_match_spearmanr():
+    from scipy import stats
+    exp_df = expression()
+    ranks, row_index = identifyModule.rank_matrix(exp_df)
+    rows_a, rows_b = np.triu_indices(len(exp_df), k=1)
+    r, pvals = identifyModule.pair_correlations(ranks, rows_a, rows_b, block_size=7)
+
+    expected_r = []
+    expected_p = []
+    with warnings.catch_warnings():
+        #spearmanr warns about the constant rows, and returns NaN for them
+        warnings.simplefilter('ignore')
+        for a, b in zip(rows_a, rows_b):
+            rho, p = stats.spearmanr(exp_df.values[a], exp_df.values[b])
+            expected_r.append(rho)
+            expected_p.append(p)
+    np.testing.assert_allclose(r, expected_r, rtol=RTOL, atol=ATOL)
+    np.testing.assert_allclose(pvals, expected_p, rtol=RTOL, atol=ATOL)
+    #constant rows give NaN, so they never pass the cutoffs
+    assert np.isnan(r[(rows_a == 3) | (rows_b == 3)]).all()
+
+
+def test_correlated_pairs_constant_rows():
+    exp_df = expression()
+    ranks, row_index = identifyModule.rank_matrix(exp_df)
+    tested = {}
+    passed = identifyModule.correlated_pairs([('row0', 'row5'), ('row1', 'row6'), ('row0', 'row3'), ('row3', 'row4')],
+                                             ranks, row_index, 0.3, 0.05, tested)
+    assert passed == {('row0', 'row5'), ('row1', 'row6')}
+    assert tested[('row0', 'row5')] == pytest.approx(1.0)
+    assert tested[('row1', 'row6')] == pytest.approx(-1.0)
@@ -0,0 +1,86 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from emodule import pipeline
+
+pyBigWig = pytest.importorskip('pyBigWig')
+
+
+#a small pipeline input: one tissue of 8 samples (bigwig files), its sample attributes and gene
+#expression, TFBS files and a GTF, with the scipy correlation engine (no candidate index)
+def write_inputs(folder):
+    rng = np.random.default_rng(3)
+    chroms = [('chr1', 200000)]
+    enhancers = []
+    with open(os.path.join(folder, 'anno'), 'w') as f:
+        for start in range(1000, 190000, 9000):
+            enhancers.append('chr1:%d-%d' % (start, start + 500))
+            f.write('chr1\t%d\t%d\n' % (start, start + 500))
+    os.makedirs(os.path.join(folder, 'bw'))
+    samples = ['GTEX-SP%d-0126-SM-%d' % (i, i) for i in range(8)]
+    for i, sample in enumerate(samples):
+        bw = pyBigWig.open(os.path.join(folder, 'bw', 'gtex.base_sums.SPLEEN_%s.1.ALL.bw' % sample), 'w')
+        bw.addHeader(chroms)
+        starts = np.arange(0, 199900, 100)
+        values = rng.gamma(1, 5, len(starts)) * (1 + 2 * (i % 2) * (starts % 700 == 0))
+        bw.addEntries(['chr1'] * len(starts), starts.tolist(), ends=(starts + 100).tolist(), values=np.round(values).tolist())
+        bw.close()
+    with open(os.path.join(folder, 'sampleAttributes'), 'w') as f:
+        f.write('tissue\tsample\tother\n')
+        for sample in samples:
+            f.write('Spleen\t%s\tx\n' % sample)
+    os.makedirs(os.path.join(folder, 'samples'))
+    pd.DataFrame([[1 + i % 2 for i in range(8)], rng.integers(20, 70, 8)], index=['Sex', 'Age'],
+                 columns=samples).to_csv(os.path.join(folder, 'samples', 'Spleen_sample.csv'))
+    os.makedirs(os.path.join(folder, 'gexp'))
+    genes = ['TF%d' % i for i in range(4)] + ['G%d' % i for i in range(6)]
+    pd.DataFrame(rng.poisson(50, (len(genes), 8)), index=genes, columns=samples).to_csv(os.path.join(folder, 'gexp', 'Spleen.csv'))
+    with open(os.path.join(folder, 'eTFBS'), 'w') as f:
+        f.write('e\tt\ts\n')
+        for k, enhancer in enumerate(enhancers):
+            f.write('%s\tTF%d\t500\n' % (enhancer, k % 4))
+    with open(os.path.join(folder, 'gTFBS'), 'w') as f:
+        f.write('g\tt\ts\n')
+        for i in range(6):
+            f.write('G%d\tTF%d\t500\n' % (i, i % 4))
+    with open(os.path.join(folder, 'mini.gtf'), 'w') as f:
+        for i in range(6):
+            f.write('1\tx\tgene\t%d\t%d\t.\t+\t.\tgene_id "E%d"; gene_name "G%d"; gene_biotype "protein_coding";\n'
+                    % (20000 * i + 5000, 20000 * i + 5010, i, i))
+    config = {'annoFile': 'anno', 'bwList': 'bw', 'sampleFile': 'sampleAttributes', 'sampleFolder': 'samples',
+              'gExpFolder': 'gexp', 'eTFBS_file': 'eTFBS', 'gTFBS_file': 'gTFBS', 'gtfFile': 'mini.gtf',
+              'tmm': 'python', 'glm_engine': 'statsmodels', 'correlation_engine': 'scipy',
+              'fdrcutoff': 1.0, 'rcutoff': 0.1, 'pcutoff': 1.0}
+    configFile = os.path.join(folder, 'pipeline.json')
+    with open(configFile, 'w') as f:
+        json.dump(config, f)
+    return configFile
+
+
+def stage_keys(configFile, workFolder):
+    config = pipeline.read_config(configFile)
+    return dict((task.stage, task.key) for task in pipeline.build_tasks(config, workFolder, {}))
+
+
+#without the candidate index, the module task reads the TFBS files itself: a changed TFBS file
+#re-runs it (and only it)
+def test_module_reruns_on_tfbs_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    configFile = write_inputs(str(tmp_path))
+    workFolder = str(tmp_path / 'work')
+    assert pipeline.run_pipeline(configFile, workFolder, str(tmp_path / 'out'), processes=1) == {}
+    before = stage_keys(configFile, workFolder)
+    assert 'candidates' not in before
+    assert os.path.exists(pipeline.output_folder(workFolder, 'module', before['module']))
+
+    with open(tmp_path / 'eTFBS', 'a') as f:
+        f.write('chr1:1000-1500\tTF3\t500\n')
+    after = stage_keys(configFile, workFolder)
+    assert after['module'] != before['module']
+    for stage in ('quantify', 'normalize', 'diffexp'):
+        assert after[stage] == before[stage]
+    assert not os.path.exists(pipeline.output_folder(workFolder, 'module', after['module']))
+    assert pipeline.run_pipeline(configFile, workFolder, str(tmp_path / 'out'), processes=1) == {}
+    assert os.path.exists(pipeline.output_folder(workFolder, 'module', after['module']))
@@ -0,0 +1,123 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from emodule import eNormalization
+
+
+#--tmm python must give edgeR's calcNormFactors(method='TMM') factors to this relative tolerance
+RTOL = 1e-6
+
+#fixed counts (30 enhancers x 5 samples) with all-zero enhancers, zeros in single samples and
+#one enhancer absent from a sample, so that the filtering and trimming paths are exercised
+COUNTS = np.array([[40, 69, 49, 39, 76],
+                   [46, 84, 34, 52, 67],
+                   [3, 7, 10, 22, 33],
+                   [0, 0, 0, 0, 0],
+                   [123, 66, 51, 45, 104],
+                   [7, 6, 11, 3, 5],
+                   [6, 1, 6, 7, 6],
+                   [25, 15, 7, 29, 24],
+                   [28, 69, 20, 33, 44],
+                   [0, 4, 2, 3, 2],
+                   [1, 0, 0, 0, 0],
+                   [21, 27, 3, 15, 43],
+                   [111, 354, 112, 218, 73],
+                   [14, 35, 31, 99, 43],
+                   [2, 3, 0, 3, 18],
+                   [3, 7, 5, 3, 6],
+                   [0, 0, 0, 0, 0],
+                   [4, 3, 2, 6, 8],
+                   [27, 136, 42, 111, 146],
+                   [100, 157, 113, 157, 127],
+                   [900, 1500, 0, 1100, 2000],
+                   [18, 15, 9, 40, 54],
+                   [94, 141, 127, 148, 237],
+                   [24, 23, 28, 9, 68],
+                   [1, 2, 3, 0, 7],
+                   [16, 49, 18, 18, 43],
+                   [22, 57, 10, 4, 33],
+                   [5, 24, 52, 70, 61],
+                   [3, 5, 1, 2, 4],
+                   [10, 11, 5, 4, 6]], dtype=np.uint32)
+
+
+def counts_frame(counts):
+    return pd.DataFrame(counts,
+                        index=['chr1:%d-%d' % (i * 1000, i * 1000 + 500) for i in range(counts.shape[0])],
+                        columns=['S%d' % i for i in range(counts.shape[1])])
+
+
+#the reference factors come from edgeR itself, through the --tmm edgeR path (rpy2 and tmm.r)
+def test_tmm_matches_edgeR():
+    pytest.importorskip('rpy2')
+    from rpy2.robjects.packages import isinstalled
+    if not isinstalled('edgeR'):
+        pytest.skip('edgeR is not installed')
+    counts_df = counts_frame(COUNTS)
+    counts_tmm, edgeR_factors = eNormalization.tmm_edgeR(counts_df)
+    python_factors = eNormalization.calc_norm_factors(COUNTS)
+    np.testing.assert_allclose(python_factors, edgeR_factors.values, rtol=RTOL)
+
+
+#samples proportional to each other have factor 1, whatever their library sizes
+def test_tmm_proportional_samples():
+    counts = np.column_stack([COUNTS[:, 0], COUNTS[:, 0] * 3, COUNTS[:, 0] * 10])
+    np.testing.assert_allclose(eNormalization.calc_norm_factors(counts), np.ones(3), rtol=RTOL)
+
+
+#the factors multiply to one, and both engines hand the counts to the RPM step unchanged
+def test_tmm_factors_scale():
+    counts_df = counts_frame(COUNTS)
+    counts_tmm, norm_factors = eNormalization.tmm_python(counts_df)
+    assert abs(np.prod(norm_factors.values) - 1) < RTOL
+    assert counts_tmm.equals(counts_df)
+
+
+#incremental normalization: a second batch is compared with the reference sample chosen in the
+#first batch, and the factors of the cohort equal those of a full run with that reference
+def test_incremental_factors(tmp_path):
+    counts_df = counts_frame(COUNTS)
+    enhancer_index = list(counts_df.index)
+    tissue_samples = {'Spleen': list(counts_df.columns)}
+    stateFolder = str(tmp_path / 'state')
+    outFolder = str(tmp_path) + '/'
+
+    def read_counts(samples):
+        return counts_df[[sample for sample in counts_df.columns if sample in samples]]
+
+    eNormalization.normalize_incremental(enhancer_index, tissue_samples, ['S0', 'S1', 'S2'], read_counts, outFolder, stateFolder, 'python')
+    eNormalization.normalize_incremental(enhancer_index, tissue_samples, list(counts_df.columns), read_counts, outFolder, stateFolder, 'python')
+    state = eNormalization.read_state(stateFolder, enhancer_index)
+    reference = list(counts_df.columns).index(state['tmm']['reference'])
+    assert reference == eNormalization.reference_column(COUNTS[:, :3])
+    expected = eNormalization.calc_norm_factors(COUNTS, refColumn=reference)
+    np.testing.assert_allclose([state['norm_factors'][sample] for sample in counts_df.columns], expected, rtol=RTOL)
+
+
+#incremental normalization in two batches writes the same RPM as a full run over all samples
+def test_incremental_matches_full_run(tmp_path):
+    counts_df = counts_frame(COUNTS)
+    enhancer_index = list(counts_df.index)
+    tissue_samples = {'Spleen': ['S0', 'S1', 'S3'], 'Liver': ['S2', 'S4']}
+    stateFolder = str(tmp_path / 'state')
+    incrementalFolder = str(tmp_path / 'incremental') + '/'
+    fullFolder = str(tmp_path / 'full') + '/'
+    os.makedirs(incrementalFolder)
+    os.makedirs(fullFolder)
+
+    def read_counts(samples):
+        return counts_df[[sample for sample in counts_df.columns if sample in samples]]
+
+    eNormalization.normalize_incremental(enhancer_index, tissue_samples, ['S0', 'S2'], read_counts, incrementalFolder, stateFolder, 'python')
+    written = eNormalization.normalize_incremental(enhancer_index, tissue_samples, list(counts_df.columns), read_counts,
+                                                   incrementalFolder, stateFolder, 'python')
+    assert sorted(written) == ['Liver', 'Spleen']
+    eNormalization.normalize_exp(counts_df, tissue_samples, fullFolder, 'python')
+    for tissue in tissue_samples:
+        incremental = pd.read_csv(incrementalFolder + tissue + '.csv', index_col=0)
+        full = pd.read_csv(fullFolder + tissue + '.csv', index_col=0)
+        pd.testing.assert_frame_equal(incremental, full)
+    state = eNormalization.read_state(stateFolder, enhancer_index)
+    assert state['tmm']['reference'] in ('S0', 'S2')
+    assert state['tmm']['reference_batch'] == 'batch_0'
@@ -1,7 +0,0 @@
-library(edgeR)
-
-tmm_nor <- function(count, output){
-	y <- DGEList(counts=count)
-	y <- calcNormFactors(y)
-	write.table(y$counts, sep =",", file=output)
-}
\ No newline at end of file